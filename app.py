@@ -1,17 +1,56 @@
 # app.py (antigo main.py)
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file, Response
-import pdfkit
+from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file, jsonify, abort, make_response, Response
 from database import criar_tabelas
+import database
 import auth
 import estoque
 import relatorios
+import relatorios_pdf
 import gerenciamento
 import pedidos
 import excel_handler
+import tarefas
 import os
+import sys
+import uuid
+import secrets
+import hashlib
+from datetime import date, datetime, timedelta, timezone
 
 app = Flask(__name__)
-app.secret_key = os.urandom(24) # Chave secreta para gerenciar sessões de usuário
+
+def _carregar_chave_secreta():
+    """
+    Chave secreta das sessões: ESTOQUE_SECRET_KEY ou, sem ela, a gravada em instance/secret_key
+    (gerada na primeira execução). Assim as sessões valem em todos os workers e após reinícios.
+    """
+    chave = os.environ.get("ESTOQUE_SECRET_KEY")
+    if chave:
+        return chave
+    caminho = os.path.join(app.instance_path, "secret_key")
+    os.makedirs(app.instance_path, exist_ok=True)
+    try:
+        # O_EXCL: se dois processos iniciarem juntos, só um gera a chave.
+        descritor = os.open(caminho, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(descritor, "w") as arquivo:
+            arquivo.write(secrets.token_hex(32))
+    with open(caminho) as arquivo:
+        return arquivo.read().strip()
+
+app.secret_key = _carregar_chave_secreta() # Chave secreta para gerenciar sessões de usuário
+
+@app.before_request
+def abrir_conexao_requisicao():
+    """Todas as consultas feitas durante a requisição compartilham uma única conexão do pool."""
+    database.abrir_escopo()
+
+@app.teardown_request
+def liberar_conexao_requisicao(exc):
+    """Devolve a conexão da requisição ao pool."""
+    database.encerrar_escopo()
 
 @app.context_processor
 def inject_permissions():
@@ -27,10 +66,39 @@ def inject_auth():
 def inject_notifications():
     """Disponibiliza notificações (ex: pedidos pendentes) para todos os templates."""
     if 'usuario' in session and session['usuario']['role'] == 'administracao':
-        pedidos_pendentes_count = len(pedidos.listar_pedidos_pendentes())
+        pedidos_pendentes_count = pedidos.contar_pedidos_pendentes()
         return dict(pedidos_pendentes_count=pedidos_pendentes_count)
     return dict(pedidos_pendentes_count=0)
 
+def pagina_do_catalogo(usuario, gerar, *extras):
+    """
+    Responde uma página montada a partir do catálogo (itens e descrições) com ETag e Last-Modified.
+    Se o navegador já tem a versão atual, devolve 304 sem consultar nem renderizar nada;
+    `gerar()` só é chamada quando a página precisa ser montada.
+    `extras` são outros dados que a página exibe e que não mudam a versão do catálogo.
+    """
+    # Mensagens flash pendentes precisam ser exibidas, então a página é sempre renderizada
+    if session.get('_flashes'):
+        return gerar()
+
+    versao, modificado_em = database.versao_catalogo()
+    if versao is None:
+        return gerar()
+    pendentes = pedidos.contar_pedidos_pendentes() if usuario['role'] == 'administracao' else 0
+    etag = hashlib.sha1(repr((request.path, versao, usuario['id'], usuario['role'], pendentes, extras)).encode()).hexdigest()
+    ultima_modificacao = datetime.fromtimestamp(int(modificado_em), timezone.utc)
+
+    if request.if_none_match.contains(etag):
+        resposta = make_response("", 304)
+    else:
+        resposta = make_response(gerar())
+    resposta.set_etag(etag)
+    resposta.last_modified = ultima_modificacao
+    # Página por usuário: só o navegador guarda, e sempre revalida com o servidor
+    resposta.cache_control.private = True
+    resposta.cache_control.no_cache = True
+    return resposta
+
 # --- Rotas de Autenticação ---
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -82,9 +150,27 @@ def ver_estoque():
         flash("Você não tem permissão para acessar esta página.", "danger")
         return redirect(url_for('dashboard'))
 
-    itens_estoque = estoque.listar_itens()
-    descricoes_disponiveis = gerenciamento.listar_descricoes()
-    return render_template('estoque.html', usuario=usuario, itens=itens_estoque, descricoes=descricoes_disponiveis)
+    # A tabela de itens é carregada aos poucos pela página, via /api/estoque/itens
+    def gerar():
+        descricoes_disponiveis = gerenciamento.listar_descricoes()
+        return render_template('estoque.html', usuario=usuario, descricoes=descricoes_disponiveis)
+    return pagina_do_catalogo(usuario, gerar)
+
+@app.route('/api/estoque/itens')
+def api_buscar_itens():
+    usuario = session.get('usuario')
+    if not usuario:
+        abort(401)
+    if not auth.tem_permissao(usuario['role'], 'ver_estoque'):
+        abort(403)
+
+    pagina = request.args.get('pagina', 1, type=int)
+    por_pagina = min(max(request.args.get('por_pagina', 50, type=int), 1), 200)
+    resultado = estoque.buscar_itens(termo=request.args.get('q', '').strip(),
+                                     ordenar=request.args.get('ordenar', 'nome'),
+                                     direcao=request.args.get('direcao', 'asc'),
+                                     pagina=pagina, por_pagina=por_pagina)
+    return jsonify(resultado)
 
 @app.route('/estoque/adicionar', methods=['POST'])
 def adicionar_novo_item():
@@ -143,8 +229,10 @@ def editar_item(id):
         flash("Item não encontrado.", "warning")
         return redirect(url_for('ver_estoque'))
     
-    descricoes_disponiveis = gerenciamento.listar_descricoes()
-    return render_template('estoque_item_editar.html', usuario=usuario, item=item_para_editar, descricoes=descricoes_disponiveis)
+    def gerar():
+        descricoes_disponiveis = gerenciamento.listar_descricoes()
+        return render_template('estoque_item_editar.html', usuario=usuario, item=item_para_editar, descricoes=descricoes_disponiveis)
+    return pagina_do_catalogo(usuario, gerar)
 
 @app.route('/movimentacao', methods=['GET', 'POST'])
 def registrar_movimentacao():
@@ -175,9 +263,92 @@ def registrar_movimentacao():
         flash(msg, "success" if sucesso else "danger")
         return redirect(url_for('registrar_movimentacao'))
 
-    itens_estoque = estoque.listar_itens()
-    ultimas_movimentacoes = relatorios.get_ultimas_movimentacoes(limit=5)
-    return render_template('movimentacao.html', usuario=usuario, itens=itens_estoque, ultimas_movimentacoes=ultimas_movimentacoes, pode_entrar=pode_entrar, pode_sair=pode_sair)
+    # Toda movimentação altera a quantidade de um item, então a versão do catálogo cobre as últimas movimentações
+    def gerar():
+        itens_estoque = estoque.listar_itens()
+        ultimas_movimentacoes = relatorios.get_ultimas_movimentacoes(limit=5)
+        return render_template('movimentacao.html', usuario=usuario, itens=itens_estoque, ultimas_movimentacoes=ultimas_movimentacoes, pode_entrar=pode_entrar, pode_sair=pode_sair)
+    return pagina_do_catalogo(usuario, gerar)
+
+def _ler_linhas_romaneio(item_ids, quantidades):
+    """Converte os pares (item, quantidade) recebidos em [(item_id, quantidade)], ignorando linhas vazias."""
+    linhas = []
+    for numero, (item_id, quantidade) in enumerate(zip(item_ids, quantidades), start=1):
+        if str(item_id).strip() == '' and str(quantidade).strip() == '':
+            continue
+        try:
+            linhas.append((int(item_id), int(quantidade)))
+        except (TypeError, ValueError):
+            return None, f"Linha {numero}: item ou quantidade inválidos."
+    return linhas, None
+
+def _permissao_romaneio(usuario, tipo):
+    if tipo == 'entrada':
+        return auth.tem_permissao(usuario['role'], 'registrar_entrada')
+    if tipo == 'saida':
+        return auth.tem_permissao(usuario['role'], 'registrar_saida')
+    return False
+
+@app.route('/movimentacao/romaneio', methods=['GET', 'POST'])
+def registrar_romaneio():
+    usuario = session.get('usuario')
+    if not usuario:
+        return redirect(url_for('login'))
+
+    pode_entrar = _permissao_romaneio(usuario, 'entrada')
+    pode_sair = _permissao_romaneio(usuario, 'saida')
+    if not (pode_entrar or pode_sair):
+        flash("Você não tem permissão para acessar esta página.", "danger")
+        return redirect(url_for('dashboard'))
+
+    if request.method == 'POST':
+        tipo = request.form['tipo']
+        linhas, erro = _ler_linhas_romaneio(request.form.getlist('item_id'), request.form.getlist('quantidade'))
+        if erro:
+            sucesso, msg = False, erro
+        elif not _permissao_romaneio(usuario, tipo):
+            sucesso, msg = False, "Tipo de movimentação inválida ou sem permissão."
+        else:
+            sucesso, msg = estoque.registrar_romaneio(linhas, tipo, usuario['id'], request.form.get('observacao', ''))
+
+        flash(msg, "success" if sucesso else "danger")
+        if sucesso:
+            return redirect(url_for('registrar_movimentacao'))
+        # Em caso de erro o formulário volta preenchido, para corrigir só as linhas com problema
+        return render_template('romaneio.html', usuario=usuario, itens=estoque.listar_itens(), pode_entrar=pode_entrar,
+                               pode_sair=pode_sair, linhas=list(zip(request.form.getlist('item_id'), request.form.getlist('quantidade'))),
+                               tipo=tipo, observacao=request.form.get('observacao', ''))
+
+    return render_template('romaneio.html', usuario=usuario, itens=estoque.listar_itens(), pode_entrar=pode_entrar,
+                           pode_sair=pode_sair, linhas=[], tipo='entrada' if pode_entrar else 'saida', observacao='')
+
+@app.route('/api/movimentacoes/romaneio', methods=['POST'])
+def api_registrar_romaneio():
+    """Recebe {"tipo", "observacao", "linhas": [{"item_id", "quantidade"}, ...]} e aplica tudo ou nada."""
+    usuario = session.get('usuario')
+    if not usuario:
+        abort(401)
+
+    dados = request.get_json(silent=True)
+    if not isinstance(dados, dict):
+        return jsonify({"sucesso": False, "mensagem": "O corpo da requisição deve ser um objeto JSON."}), 400
+    tipo = dados.get('tipo')
+    if not _permissao_romaneio(usuario, tipo):
+        return jsonify({"sucesso": False, "mensagem": "Tipo de movimentação inválida ou sem permissão."}), 403
+
+    linhas_recebidas = dados.get('linhas') or []
+    if not isinstance(linhas_recebidas, list) or not all(isinstance(linha, dict) for linha in linhas_recebidas):
+        return jsonify({"sucesso": False, "mensagem": "O campo 'linhas' deve ser uma lista de objetos."}), 400
+    linhas, erro = _ler_linhas_romaneio([linha.get('item_id') for linha in linhas_recebidas],
+                                        [linha.get('quantidade') for linha in linhas_recebidas])
+    if erro:
+        return jsonify({"sucesso": False, "mensagem": erro}), 400
+    observacao = dados.get('observacao') or ''
+    if not isinstance(observacao, str):
+        return jsonify({"sucesso": False, "mensagem": "O campo 'observacao' deve ser um texto."}), 400
+
+    sucesso, msg = estoque.registrar_romaneio(linhas, tipo, usuario['id'], observacao)
+    return jsonify({"sucesso": sucesso, "mensagem": msg}), 200 if sucesso else 422
 
 @app.route('/relatorios')
 def ver_relatorios():
@@ -189,9 +360,10 @@ def ver_relatorios():
         flash("Você não tem permissão para acessar esta página.", "danger")
         return redirect(url_for('dashboard'))
 
-    # Paginação para a tabela de histórico
-    page = request.args.get('page', 1, type=int)
-    pagination_data = relatorios.get_todas_movimentacoes(page=page, per_page=15)
+    # Paginação por cursor para a tabela de histórico
+    cursor_pagina = request.args.get('cursor')
+    direcao = request.args.get('direcao', 'proximo')
+    pagination_data = relatorios.get_todas_movimentacoes(cursor_pagina=cursor_pagina, direcao=direcao, per_page=15)
     movimentacoes = pagination_data.get('movimentacoes', [])
     valor_total_estoque = relatorios.relatorio_saldo_geral()
     dados_graficos = relatorios.get_dados_graficos()
@@ -218,6 +390,28 @@ def ver_relatorios():
                            pedidos_usuario_stats=pedidos_usuario_stats,
                            pagination_data=pagination_data)
 
+@app.route('/api/relatorios/serie')
+def api_serie_movimentacoes():
+    usuario = session.get('usuario')
+    if not usuario:
+        abort(401)
+    if not auth.tem_permissao(usuario['role'], 'ver_relatorios'):
+        abort(403)
+
+    # Padrão: últimos 30 dias, por dia
+    hoje = datetime.now().date()
+    try:
+        inicio = date.fromisoformat(request.args.get('inicio', (hoje - timedelta(days=29)).isoformat()))
+        fim = date.fromisoformat(request.args.get('fim', hoje.isoformat()))
+        granularidade = request.args.get('granularidade', 'dia')
+        if (fim - inicio).days > 3660:
+            raise ValueError("Intervalo máximo de 10 anos.")
+        item_id = request.args.get('item_id', type=int)
+        serie = relatorios.get_serie_movimentacoes(inicio, fim, granularidade, item_id=item_id)
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+    return jsonify(serie)
+
 @app.route('/relatorios/exportar_pdf')
 def exportar_relatorio_pdf():
     usuario = session.get('usuario')
@@ -225,29 +419,9 @@ def exportar_relatorio_pdf():
         flash("Acesso negado.", "danger")
         return redirect(url_for('dashboard'))
 
-    # Reutiliza a lógica de busca de dados (sem paginação para o PDF)
-    movimentacoes = relatorios.get_todas_movimentacoes(page=1, per_page=999999)['movimentacoes']
-    valor_total_estoque = relatorios.relatorio_saldo_geral()
-
-    # Renderiza um template HTML específico para o PDF
-    html_para_pdf = render_template(
-        'relatorio_pdf.html',
-        movimentacoes=movimentacoes,
-        valor_total=valor_total_estoque
-    )
-
-    # Gera o PDF em memória e o retorna como um download
-    try:
-        # Caminho para o executável do wkhtmltopdf (padrão de instalação)
-        path_wkhtmltopdf = r'C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe'
-        config = pdfkit.configuration(wkhtmltopdf=path_wkhtmltopdf)
-        
-        # Gera o PDF a partir do HTML
-        pdf = pdfkit.from_string(html_para_pdf, False, configuration=config)
-        return Response(pdf, mimetype="application/pdf", headers={"Content-Disposition": "inline;filename=relatorio_estoque.pdf"})
-    except FileNotFoundError:
-        flash("ERRO: O programa 'wkhtmltopdf' não foi encontrado no caminho padrão. Verifique a instalação.", "danger")
-        return redirect(url_for('ver_relatorios'))
+    # O PDF é gerado em segundo plano; o usuário acompanha o progresso e baixa quando estiver pronto
+    tarefa_id = tarefas.enviar('pdf_movimentacoes', {}, usuario['id'])
+    return redirect(url_for('ver_tarefa', id=tarefa_id))
 
 @app.route('/obras/<int:id>/exportar_pdf')
 def exportar_relatorio_obra_pdf(id):
@@ -255,27 +429,57 @@ def exportar_relatorio_obra_pdf(id):
     if not usuario:
         return redirect(url_for('login'))
 
-    # Busca os dados para o relatório
     obra = pedidos.get_obra(id)
     if not obra:
         flash("Obra não encontrada.", "warning")
         return redirect(url_for('listar_obras_public'))
-        
-    materiais_enviados = pedidos.get_materiais_por_obra(id)
 
-    # Renderiza um template HTML específico para o PDF
-    html_para_pdf = render_template('obra_relatorio_pdf.html', obra=obra, materiais=materiais_enviados)
+    tarefa_id = tarefas.enviar('pdf_obra', {'obra_id': id}, usuario['id'])
+    return redirect(url_for('ver_tarefa', id=tarefa_id))
 
-    # Gera o PDF e o retorna como um download
-    try:
-        path_wkhtmltopdf = r'C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe'
-        config = pdfkit.configuration(wkhtmltopdf=path_wkhtmltopdf)
-        pdf = pdfkit.from_string(html_para_pdf, False, configuration=config)
-        filename = f"relatorio_obra_{obra['nome'].replace(' ', '_')}.pdf"
-        return Response(pdf, mimetype="application/pdf", headers={"Content-Disposition": f"inline;filename={filename}"})
-    except FileNotFoundError:
-        flash("ERRO: O programa 'wkhtmltopdf' não foi encontrado no caminho padrão. Verifique a instalação.", "danger")
-        return redirect(url_for('detalhes_obra', id=id))
+# --- Rotas de Tarefas em Segundo Plano ---
+
+def _tarefa_do_usuario(tarefa_id, usuario):
+    """Busca a tarefa, garantindo que pertence ao usuário (administradores veem todas)."""
+    tarefa = tarefas.get_tarefa(tarefa_id)
+    if not tarefa or (tarefa['usuario_id'] != usuario['id'] and usuario['role'] != 'administracao'):
+        abort(404)
+    return tarefa
+
+@app.route('/tarefas/<id>')
+def ver_tarefa(id):
+    usuario = session.get('usuario')
+    if not usuario:
+        return redirect(url_for('login'))
+    tarefa = _tarefa_do_usuario(id, usuario)
+    return render_template('tarefa.html', usuario=usuario, tarefa=tarefa)
+
+@app.route('/tarefas/<id>/status')
+def status_tarefa(id):
+    usuario = session.get('usuario')
+    if not usuario:
+        abort(401)
+    tarefa = _tarefa_do_usuario(id, usuario)
+    return jsonify({
+        "id": tarefa['id'],
+        "status": tarefa['status'],
+        "progresso": tarefa['progresso'],
+        "erro": tarefa['erro'],
+        "download": url_for('baixar_tarefa', id=id) if tarefa['status'] == 'concluida' else None
+    })
+
+@app.route('/tarefas/<id>/download')
+def baixar_tarefa(id):
+    usuario = session.get('usuario')
+    if not usuario:
+        return redirect(url_for('login'))
+    tarefa = _tarefa_do_usuario(id, usuario)
+    if (tarefa['status'] != 'concluida' or tarefas.expirada(tarefa)
+            or not tarefa['arquivo'] or not os.path.exists(tarefa['arquivo'])):
+        flash("O arquivo desta exportação não está disponível (ainda em processamento ou expirado).", "warning")
+        return redirect(url_for('ver_tarefa', id=id))
+    return send_file(os.path.abspath(tarefa['arquivo']), mimetype=tarefa['mimetype'],
+                     as_attachment=True, download_name=tarefa['nome_arquivo'])
 
 
 # --- Rotas de Administração e Excel ---
@@ -407,6 +611,52 @@ def rejeitar_pedido():
     flash(msg, "success" if sucesso else "danger")
     return redirect(url_for('gerenciar_pedidos'))
 
+@app.route('/admin/pedidos/lote', methods=['POST'])
+def processar_pedidos_em_lote():
+    """Aprova ou rejeita os pedidos selecionados numa única transação e devolve o resultado de cada um."""
+    usuario = session.get('usuario')
+    if request.is_json:
+        dados = request.get_json(silent=True) or {}
+    else:
+        dados = {"acao": request.form.get('acao'), "motivo": request.form.get('motivo', ''),
+                 "pedido_ids": request.form.getlist('pedido_ids')}
+    if not usuario or usuario['role'] != 'administracao':
+        if request.is_json:
+            return jsonify({"erro": "Acesso negado."}), 403
+        flash("Acesso negado.", "danger")
+        return redirect(url_for('dashboard'))
+
+    acao = dados.get('acao')
+    motivo = (dados.get('motivo') or '').strip()
+    try:
+        pedido_ids = [int(pedido_id) for pedido_id in dados.get('pedido_ids') or []]
+    except (TypeError, ValueError):
+        pedido_ids = None
+
+    erro = None
+    if acao not in ('aprovar', 'rejeitar'):
+        erro = "Ação inválida."
+    elif not pedido_ids:
+        erro = "Selecione ao menos um pedido."
+    elif len(pedido_ids) > pedidos.LIMITE_PEDIDOS_LOTE:
+        erro = f"Selecione no máximo {pedidos.LIMITE_PEDIDOS_LOTE} pedidos por vez."
+    elif acao == 'rejeitar' and not motivo:
+        erro = "Informe o motivo da rejeição."
+    if erro:
+        if request.is_json:
+            return jsonify({"erro": erro}), 400
+        flash(erro, "warning")
+        return redirect(url_for('gerenciar_pedidos'))
+
+    resultados = pedidos.processar_pedidos_em_lote(pedido_ids, acao, usuario['id'], motivo)
+    processados = sum(1 for resultado in resultados if resultado['sucesso'])
+    if request.is_json:
+        return jsonify({"processados": processados, "falhas": len(resultados) - processados, "resultados": resultados})
+
+    # O relatório pode ter centenas de linhas: é exibido direto na página, não via flash (cookie de sessão)
+    return render_template('admin_pedidos.html', usuario=usuario, pedidos=pedidos.listar_pedidos_pendentes(),
+                           resultados_lote=resultados, acao_lote=acao, processados_lote=processados)
+
 @app.route('/obras')
 def listar_obras_public():
     usuario = session.get('usuario')
@@ -429,15 +679,19 @@ def detalhes_obra(id):
         return redirect(url_for('detalhes_obra', id=id))
 
     obra = pedidos.get_obra(id)
-    materiais_enviados = pedidos.get_materiais_por_obra(id)
-    
-    # Calcula os totais para os cards
-    total_quantidade_enviada = sum(m['quantidade'] for m in materiais_enviados)
-    total_solicitacoes = len(materiais_enviados)
 
-    itens_estoque = estoque.listar_itens()
-    return render_template('obra_detalhes.html', usuario=usuario, obra=obra, materiais=materiais_enviados, itens_estoque=itens_estoque,
-                           total_quantidade_enviada=total_quantidade_enviada, total_solicitacoes=total_solicitacoes)
+    def gerar():
+        materiais_enviados = pedidos.get_materiais_por_obra(id)
+        
+        # Calcula os totais para os cards
+        total_quantidade_enviada = sum(m['quantidade'] for m in materiais_enviados)
+        total_solicitacoes = len(materiais_enviados)
+
+        itens_estoque = estoque.listar_itens()
+        return render_template('obra_detalhes.html', usuario=usuario, obra=obra, materiais=materiais_enviados, itens_estoque=itens_estoque,
+                               total_quantidade_enviada=total_quantidade_enviada, total_solicitacoes=total_solicitacoes)
+    # Os materiais enviados vêm de saídas (que mudam a versão do catálogo); os dados da obra entram na ETag
+    return pagina_do_catalogo(usuario, gerar, tuple(obra.values()) if obra else None)
 
 @app.route('/admin/descricoes', methods=['GET', 'POST'])
 def gerenciar_descricoes():
@@ -483,7 +737,17 @@ def importar_excel():
         return redirect(url_for('dashboard'))
 
     if file and (file.filename.endswith('.xls') or file.filename.endswith('.xlsx')):
-        # Salva o arquivo temporariamente para ser lido pelo pandas
+        if request.form.get('modo') == 'atualizar':
+            # Modo atualização: a planilha fica guardada até o usuário confirmar (ou cancelar) a prévia
+            _descartar_importacao_pendente()
+            extensao = '.xlsx' if file.filename.endswith('.xlsx') else '.xls'
+            caminho = os.path.join("uploads", uuid.uuid4().hex + extensao)
+            os.makedirs("uploads", exist_ok=True)
+            file.save(caminho)
+            session['importacao'] = {'arquivo': caminho, 'nome': file.filename}
+            return redirect(url_for('previa_importacao'))
+
+        # Salva o arquivo temporariamente para ser lido
         caminho_temporario = os.path.join("uploads", file.filename)
         os.makedirs("uploads", exist_ok=True)
         file.save(caminho_temporario)
@@ -497,6 +761,66 @@ def importar_excel():
 
     return redirect(url_for('dashboard'))
 
+def _descartar_importacao_pendente():
+    """Apaga a planilha guardada para a prévia de importação, se houver."""
+    importacao = session.pop('importacao', None)
+    if importacao and os.path.exists(importacao['arquivo']):
+        os.remove(importacao['arquivo'])
+
+@app.route('/admin/importar/previa')
+def previa_importacao():
+    usuario = session.get('usuario')
+    if not usuario or not auth.tem_permissao(usuario['role'], 'all'):
+        flash("Acesso negado.", "danger")
+        return redirect(url_for('dashboard'))
+
+    importacao = session.get('importacao')
+    if not importacao or not os.path.exists(importacao['arquivo']):
+        session.pop('importacao', None)
+        flash("Nenhuma importação aguardando confirmação.", "warning")
+        return redirect(url_for('dashboard'))
+
+    previa, erro = excel_handler.previa_importacao(importacao['arquivo'])
+    if erro:
+        _descartar_importacao_pendente()
+        flash(*erro)
+        return redirect(url_for('dashboard'))
+    return render_template('importar_previa.html', usuario=usuario, previa=previa, nome_arquivo=importacao['nome'])
+
+@app.route('/admin/importar/aplicar', methods=['POST'])
+def aplicar_importacao():
+    usuario = session.get('usuario')
+    if not usuario or not auth.tem_permissao(usuario['role'], 'all'):
+        flash("Acesso negado.", "danger")
+        return redirect(url_for('dashboard'))
+
+    importacao = session.get('importacao')
+    if not importacao or not os.path.exists(importacao['arquivo']):
+        session.pop('importacao', None)
+        flash("Nenhuma importação aguardando confirmação.", "warning")
+        return redirect(url_for('dashboard'))
+
+    sucesso, msg = excel_handler.aplicar_importacao(importacao['arquivo'], usuario['id'], request.form.get('assinatura', ''))
+    if not sucesso:
+        # A planilha continua guardada: a prévia é recalculada com o estado atual do estoque
+        flash(msg, "warning")
+        return redirect(url_for('previa_importacao'))
+
+    _descartar_importacao_pendente()
+    flash(msg, "success")
+    return redirect(url_for('ver_estoque'))
+
+@app.route('/admin/importar/cancelar', methods=['POST'])
+def cancelar_importacao():
+    usuario = session.get('usuario')
+    if not usuario or not auth.tem_permissao(usuario['role'], 'all'):
+        flash("Acesso negado.", "danger")
+        return redirect(url_for('dashboard'))
+
+    _descartar_importacao_pendente()
+    flash("Importação cancelada. Nenhuma alteração foi feita.", "info")
+    return redirect(url_for('dashboard'))
+
 @app.route('/admin/exportar')
 def exportar_excel():
     usuario = session.get('usuario')
@@ -504,19 +828,22 @@ def exportar_excel():
         flash("Acesso negado.", "danger")
         return redirect(url_for('dashboard'))
 
-    caminho_arquivo, mensagem = excel_handler.exportar_para_excel()
-    if caminho_arquivo:
-        flash(mensagem, "success")
-        return send_file(caminho_arquivo, as_attachment=True)
-    else:
-        flash(mensagem, "danger")
-        return redirect(url_for('dashboard'))
+    # CSV: transmitido direto do banco enquanto é lido, sem arquivo intermediário
+    if request.args.get('formato') == 'csv':
+        nome_arquivo = f"saldo_estoque_{datetime.now().strftime('%Y%m%d_%H%M')}.csv"
+        return Response(excel_handler.gerar_csv_saldo(), mimetype='text/csv; charset=utf-8',
+                        headers={'Content-Disposition': f'attachment; filename="{nome_arquivo}"'})
+
+    tarefa_id = tarefas.enviar('excel_estoque', {}, usuario['id'])
+    return redirect(url_for('ver_tarefa', id=tarefa_id))
 
 
 def inicializar_sistema():
     """Função para ser executada uma vez na inicialização do servidor."""
     print("Inicializando o sistema...")
     criar_tabelas()
+    database.verificar_valor_estoque()
+    tarefas.recuperar_interrompidas()
     # Cria um usuário administrador padrão se o banco de dados estiver vazio
     conn = auth.conectar_bd()
     if conn:
@@ -534,7 +861,6 @@ def inicializar_sistema():
     print("Sistema pronto.")
 
 if __name__ == "__main__":
-    inicializar_sistema()
-    # O modo debug recarrega o servidor a cada alteração de código.
-    # Não use em produção!
-    app.run(debug=True)
+    # A aplicação sobe só pelo servidor.py, que importa este módulo como "app". Chamá-lo daqui
+    # carregaria o módulo duas vezes (como __main__ e como app), duplicando a inicialização.
+    sys.exit("Para rodar a aplicação, use: python servidor.py")
@@ -0,0 +1,377 @@
+# benchmarks/carga.py
+"""
+Teste de carga local das escritas: sobe o servidor de produção (servidor.py) sobre uma cópia do banco
+e dispara, de vários usuários simulados em paralelo, saídas de material (POST /movimentacao), pedidos
+de saída (POST /obras/<id>) e aprovações (GET /admin/pedidos/aprovar/<id>).
+
+Para cada etapa (número de usuários simultâneos) relata a vazão, as latências p50/p95/p99 e as taxas
+de recusa (ex.: estoque insuficiente), de erro de bloqueio do banco ("database is locked") e de outros
+erros. Ao final, com o servidor encerrado, verifica que itens_estoque.quantidade continua igual ao
+saldo das movimentações de cada item (entradas e compras menos saídas).
+
+Uso (a partir da raiz do projeto):
+    python benchmarks/carga.py --banco dados.db --usuarios 4,16,64 --duracao 20
+    python benchmarks/carga.py --itens 2000 --movimentacoes 100000 --workers 4 --threads 8 --saida carga.json
+Sem --banco, gera um banco com gerar_dados.py. O banco informado não é alterado.
+Cada usuário simulado repete sua operação sem pausa (carga fechada): a vazão medida é a máxima
+sustentada naquele número de usuários.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import base64
+import random
+import signal
+import socket
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlencode
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import auth
+from benchmarks.gerar_dados import gerar
+from benchmarks.suite import _copiar_banco
+
+SENHA = "carga"
+
+# Operação -> perfil do usuário simulado que a executa
+PERFIS = {"saida": "encarregado", "pedido": "engenheiro", "aprovacao": "administracao"}
+
+class _Cliente:
+    """Um usuário simulado: conexão HTTP persistente e o cookie de sessão do Flask."""
+
+    def __init__(self, porta):
+        self.porta = porta
+        self.conexao = None
+        self.cookie = None
+
+    def _enviar(self, metodo, caminho, dados=None):
+        cabecalhos = {"Cookie": f"session={self.cookie}"} if self.cookie else {}
+        corpo = None
+        if dados is not None:
+            corpo = urlencode(dados)
+            cabecalhos["Content-Type"] = "application/x-www-form-urlencoded"
+        for tentativa in range(2):
+            try:
+                if self.conexao is None:
+                    self.conexao = http.client.HTTPConnection("127.0.0.1", self.porta, timeout=60)
+                self.conexao.request(metodo, caminho, body=corpo, headers=cabecalhos)
+                resposta = self.conexao.getresponse()
+                resposta.read()
+                return resposta.status, _cookie_sessao(resposta)
+            except (http.client.RemoteDisconnected, ConnectionError, http.client.CannotSendRequest):
+                # Conexão ociosa fechada pelo servidor (keep-alive): reabre uma vez.
+                self.conexao.close()
+                self.conexao = None
+                if tentativa:
+                    raise
+
+    def entrar(self, username, senha):
+        _, cookie = self._enviar("POST", "/login", {"username": username, "password": senha})
+        if not cookie:
+            raise RuntimeError(f"Login de '{username}' falhou.")
+        self.cookie = cookie
+        # Consome a mensagem de boas-vindas: daqui em diante o cookie guardado não tem flashes,
+        # e o cookie de cada resposta traz só a mensagem da própria requisição.
+        _, cookie = self._enviar("GET", "/")
+        self.cookie = cookie or self.cookie
+
+    def requisitar(self, metodo, caminho, dados=None):
+        """Retorna (situação, segundos): ok, recusada, bloqueio ou erro."""
+        inicio = time.perf_counter()
+        try:
+            status, cookie = self._enviar(metodo, caminho, dados)
+        except (OSError, http.client.HTTPException):
+            return "erro", time.perf_counter() - inicio
+        duracao = time.perf_counter() - inicio
+        if status >= 400:
+            return "erro", duracao
+        categoria, mensagem = _ler_flash(cookie)
+        if categoria == "danger":
+            texto = mensagem.lower()
+            return ("bloqueio" if "locked" in texto or "busy" in texto else "recusada"), duracao
+        return "ok", duracao
+
+def _cookie_sessao(resposta):
+    for cabecalho in resposta.headers.get_all("Set-Cookie") or []:
+        if cabecalho.startswith("session="):
+            return cabecalho[len("session="):].split(";", 1)[0]
+    return None
+
+def _ler_flash(cookie):
+    """Última mensagem flash do cookie de sessão do Flask (assinado, mas não criptografado)."""
+    if not cookie:
+        return None, ""
+    comprimido = cookie.startswith(".")
+    dados = cookie.lstrip(".").split(".")[0]
+    bruto = base64.urlsafe_b64decode(dados + "=" * (-len(dados) % 4))
+    sessao = json.loads(zlib.decompress(bruto) if comprimido else bruto)
+    flashes = sessao.get("_flashes") or []
+    if not flashes:
+        return None, ""
+    ultimo = flashes[-1]
+    if isinstance(ultimo, dict):  # tuplas são serializadas como {" t": [...]}
+        ultimo = ultimo.get(" t")
+    return ultimo[0], ultimo[1]
+
+class _PedidosPendentes:
+    """Distribui os pedidos pendentes entre os aprovadores, cada pedido para um único aprovador."""
+
+    def __init__(self, caminho_banco):
+        self.caminho = caminho_banco
+        self.fila = []
+        self.ultimo_id = 0
+        self.lock = threading.Lock()
+
+    def proximo(self):
+        with self.lock:
+            if not self.fila:
+                conn = sqlite3.connect(self.caminho, timeout=30)
+                self.fila = [row[0] for row in conn.execute(
+                    "SELECT id FROM pedidos WHERE status = 'pendente' AND id > ? ORDER BY id LIMIT 500", (self.ultimo_id,))]
+                conn.close()
+            if not self.fila:
+                return None
+            pedido_id = self.fila.pop(0)
+            self.ultimo_id = max(self.ultimo_id, pedido_id)
+            return pedido_id
+
+def _percentil(ordenados, p):
+    if not ordenados:
+        return None
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+def _resumir(registros, duracao):
+    """registros: lista de (situação, segundos). Retorna vazão, latências (ms) e taxas."""
+    total = len(registros)
+    latencias = sorted(segundos * 1000 for _, segundos in registros)
+    contagem = {situacao: 0 for situacao in ("ok", "recusada", "bloqueio", "erro")}
+    for situacao, _ in registros:
+        contagem[situacao] += 1
+    return {
+        "requisicoes": total,
+        "vazao_por_s": round(total / duracao, 1),
+        "ok_por_s": round(contagem["ok"] / duracao, 1),
+        "p50_ms": round(_percentil(latencias, 0.50), 1) if total else None,
+        "p95_ms": round(_percentil(latencias, 0.95), 1) if total else None,
+        "p99_ms": round(_percentil(latencias, 0.99), 1) if total else None,
+        **{f"taxa_{situacao}": round(n / total, 4) if total else 0.0 for situacao, n in contagem.items()},
+    }
+
+def _distribuir(usuarios, mistura):
+    """Quantos usuários simulados fazem cada operação, proporcional aos pesos da mistura."""
+    total_pesos = sum(mistura.values())
+    divisao = {operacao: int(usuarios * peso / total_pesos) for operacao, peso in mistura.items()}
+    # Sobras para as operações de maior peso; toda operação com peso recebe ao menos um usuário.
+    for operacao in sorted(mistura, key=mistura.get, reverse=True):
+        if sum(divisao.values()) >= usuarios:
+            break
+        divisao[operacao] += 1
+    for operacao, peso in mistura.items():
+        if peso and not divisao[operacao]:
+            divisao[operacao] = 1
+    return divisao
+
+def _preparar_banco(caminho, usuarios_por_perfil):
+    """Cria os usuários da carga e escolhe os itens e obras usados nas requisições."""
+    conn = sqlite3.connect(caminho)
+    senha = auth.hash_password(SENHA)
+    contas = {}
+    for perfil, quantidade in usuarios_por_perfil.items():
+        contas[perfil] = [f"carga_{perfil}_{i:03d}" for i in range(quantidade)]
+        conn.executemany("INSERT OR IGNORE INTO usuarios (username, password_hash, role) VALUES (?, ?, ?)",
+                         [(nome, senha, perfil) for nome in contas[perfil]])
+    conn.commit()
+    # Itens com saldo folgado concentram as saídas (contenção realista sobre os itens mais movimentados).
+    itens = [row[0] for row in conn.execute("SELECT id FROM itens_estoque ORDER BY quantidade DESC LIMIT 200")]
+    obras = [row[0] for row in conn.execute("SELECT id FROM obras")]
+    conn.close()
+    return contas, itens, obras
+
+def _diferencas_livro(caminho):
+    """Itens cuja quantidade difere do saldo das movimentações: {item_id: quantidade - saldo}."""
+    conn = sqlite3.connect(caminho)
+    diferencas = dict(conn.execute("""
+        SELECT i.id, i.quantidade - COALESCE(m.saldo, 0)
+        FROM itens_estoque i
+        LEFT JOIN (SELECT item_id, SUM(CASE WHEN tipo = 'saida' THEN -quantidade ELSE quantidade END) AS saldo
+                   FROM movimentacoes GROUP BY item_id) m ON m.item_id = i.id
+        WHERE i.quantidade <> COALESCE(m.saldo, 0)
+    """).fetchall())
+    conn.close()
+    return diferencas
+
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _subir_servidor(pasta, porta, workers, threads):
+    ambiente = dict(os.environ, ESTOQUE_SECRET_KEY="carga", PYTHONPATH=RAIZ)
+    saida = open(os.path.join(pasta, "servidor.log"), "w")
+    processo = subprocess.Popen(
+        [sys.executable, os.path.join(RAIZ, "servidor.py"), "--bind", f"127.0.0.1:{porta}",
+         "--workers", str(workers), "--threads", str(threads)],
+        cwd=pasta, env=ambiente, stdout=saida, stderr=subprocess.STDOUT
+    )
+    limite = time.monotonic() + 120
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            break
+        try:
+            conexao = http.client.HTTPConnection("127.0.0.1", porta, timeout=2)
+            conexao.request("GET", "/login")
+            if conexao.getresponse().status == 200:
+                return processo
+        except OSError:
+            time.sleep(0.2)
+    processo.kill()
+    with open(os.path.join(pasta, "servidor.log")) as log:
+        raise RuntimeError("O servidor não subiu:\n" + log.read()[-3000:])
+
+def _executar_etapa(porta, usuarios, mistura, duracao, contas, itens, obras, pendentes, semente):
+    divisao = _distribuir(usuarios, mistura)
+    registros = {operacao: [] for operacao in mistura}
+    inicio_comum = threading.Barrier(sum(divisao.values()) + 1)
+    fim = {"instante": None}
+
+    def simular(operacao, indice):
+        rng = random.Random(semente * 1000 + indice)
+        cliente = _Cliente(porta)
+        cliente.entrar(contas[PERFIS[operacao]][indice], SENHA)
+        locais = []
+        inicio_comum.wait()
+        while time.monotonic() < fim["instante"]:
+            if operacao == "saida":
+                resultado = cliente.requisitar("POST", "/movimentacao", {
+                    "item_id": rng.choice(itens), "quantidade": 1, "tipo": "saida", "observacao": "Teste de carga"})
+            elif operacao == "pedido":
+                resultado = cliente.requisitar("POST", f"/obras/{rng.choice(obras)}", {
+                    "item_id": rng.choice(itens), "quantidade": 1, "justificativa": "Teste de carga"})
+            else:
+                pedido_id = pendentes.proximo()
+                if pedido_id is None:
+                    time.sleep(0.05)
+                    continue
+                resultado = cliente.requisitar("GET", f"/admin/pedidos/aprovar/{pedido_id}")
+            locais.append(resultado)
+        registros[operacao].extend(locais)  # list.extend é atômico sob o GIL
+
+    threads = []
+    for operacao, quantidade in divisao.items():
+        for indice in range(quantidade):
+            thread = threading.Thread(target=simular, args=(operacao, indice), daemon=True)
+            thread.start()
+            threads.append(thread)
+    fim["instante"] = time.monotonic() + duracao + 5  # provisório, até todos entrarem
+    inicio_comum.wait()
+    inicio = time.monotonic()
+    fim["instante"] = inicio + duracao
+    for thread in threads:
+        thread.join()
+    decorrido = time.monotonic() - inicio
+
+    resultado = {"usuarios": usuarios, "divisao": divisao, "duracao_s": round(decorrido, 1)}
+    for operacao, lista in registros.items():
+        resultado[operacao] = _resumir(lista, decorrido)
+    resultado["total"] = _resumir([r for lista in registros.values() for r in lista], decorrido)
+    return resultado
+
+def _imprimir(etapa):
+    print(f"\n{etapa['usuarios']} usuários ({', '.join(f'{op}: {n}' for op, n in etapa['divisao'].items())}), "
+          f"{etapa['duracao_s']}s")
+    print(f"  {'operação':<11}{'req':>8}{'req/s':>9}{'ok/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+          f"{'recusa':>9}{'bloqueio':>10}{'erro':>8}")
+    for operacao in (*etapa["divisao"], "total"):
+        r = etapa[operacao]
+        latencias = "".join(f"{r[k]:>9.1f}" if r[k] is not None else f"{'-':>9}" for k in ("p50_ms", "p95_ms", "p99_ms"))
+        print(f"  {operacao:<11}{r['requisicoes']:>8}{r['vazao_por_s']:>9.1f}{r['ok_por_s']:>9.1f}{latencias}"
+              f"{r['taxa_recusada']:>9.1%}{r['taxa_bloqueio']:>10.1%}{r['taxa_erro']:>8.1%}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--banco", help="banco de partida (não é alterado)")
+    parser.add_argument("--itens", type=int, default=2000)
+    parser.add_argument("--movimentacoes", type=int, default=100000)
+    parser.add_argument("--pedidos", type=int, default=2000)
+    parser.add_argument("--usuarios", default="4,16,64", help="etapas: usuários simultâneos, separados por vírgula")
+    parser.add_argument("--duracao", type=float, default=15, help="segundos por etapa")
+    parser.add_argument("--mistura", default="saida=70,pedido=20,aprovacao=10", help="peso de cada operação")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--saida", help="arquivo JSON com os resultados")
+    args = parser.parse_args()
+
+    etapas = [int(n) for n in args.usuarios.split(",")]
+    mistura = {}
+    for parte in args.mistura.split(","):
+        operacao, peso = parte.split("=")
+        if operacao not in PERFIS:
+            parser.error(f"operação desconhecida na mistura: {operacao}")
+        mistura[operacao] = int(peso)
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = os.path.join(pasta, "estoque.db")  # nome usado pelo servidor (DB_NAME)
+        if args.banco:
+            _copiar_banco(args.banco, caminho)
+        else:
+            print("Gerando banco de dados...")
+            gerar(caminho, itens=args.itens, movimentacoes=args.movimentacoes, pedidos=args.pedidos, semente=args.semente)
+
+        maior = _distribuir(max(etapas), mistura)
+        contas, itens, obras = _preparar_banco(caminho, {PERFIS[op]: n for op, n in maior.items()})
+        if "pedido" in mistura and not obras:
+            parser.error("o banco não tem obras para os pedidos")
+        antes = _diferencas_livro(caminho)
+
+        porta = _porta_livre()
+        print(f"Subindo o servidor ({args.workers} workers x {args.threads} threads) na porta {porta}...")
+        processo = _subir_servidor(pasta, porta, args.workers, args.threads)
+        resultados = []
+        try:
+            pendentes = _PedidosPendentes(caminho)
+            for usuarios in etapas:
+                etapa = _executar_etapa(porta, usuarios, mistura, args.duracao, contas, itens, obras, pendentes, args.semente)
+                _imprimir(etapa)
+                resultados.append(etapa)
+        finally:
+            processo.send_signal(signal.SIGTERM)
+            try:
+                processo.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                processo.kill()
+
+        # --- Invariante do livro de estoque (com o servidor já encerrado) ---
+        depois = _diferencas_livro(caminho)
+        violacoes = {item: (antes.get(item, 0), diferenca) for item, diferenca in depois.items() if antes.get(item, 0) != diferenca}
+        violacoes.update({item: (diferenca, 0) for item, diferenca in antes.items() if item not in depois})
+        conn = sqlite3.connect(caminho)
+        itens_verificados = conn.execute("SELECT COUNT(*) FROM itens_estoque").fetchone()[0]
+        conn.close()
+
+    print(f"\nInvariante quantidade = saldo das movimentações: {itens_verificados} itens verificados, "
+          f"{len(violacoes)} violação(ões)")
+    if antes:
+        print(f"  ({len(antes)} item(ns) já divergiam no banco de partida; só mudanças nessa diferença contam)")
+    for item, (esperado, encontrado) in list(violacoes.items())[:10]:
+        print(f"  item {item}: diferença {esperado} antes, {encontrado} depois")
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            json.dump({"parametros": vars(args), "etapas": resultados,
+                       "invariante": {"itens_verificados": itens_verificados, "violacoes": len(violacoes)}},
+                      arquivo, ensure_ascii=False, indent=2)
+        print(f"Resultados gravados em {args.saida}")
+    sys.exit(1 if violacoes else 0)
+
+if __name__ == "__main__":
+    main()
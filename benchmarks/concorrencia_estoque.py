@@ -0,0 +1,127 @@
+# benchmarks/concorrencia_estoque.py
+"""
+Verifica que a baixa de estoque (_modificar_estoque) não perde atualizações sob concorrência.
+
+Cria um banco novo numa pasta temporária, com um único item de quantidade Q, e dispara sobre ele
+`--processos` processos com `--threads` threads cada, cada thread fazendo `--saidas` saídas de 1
+unidade. Com mais tentativas do que estoque, falha (código de saída 1) se:
+  - a quantidade final não for Q menos o número de saídas bem-sucedidas;
+  - o saldo tiver ficado negativo em algum momento (conferido pelo "Novo Saldo" de cada auditoria);
+  - dois commits tiverem gravado o mesmo saldo (atualização perdida);
+  - o número de linhas em movimentacoes não for o número de saídas bem-sucedidas;
+  - alguma saída tiver sido recusada com saldo disponível, ou falhado com erro do banco.
+
+Uso (a partir da raiz do projeto):
+    python benchmarks/concorrencia_estoque.py [--quantidade 1000] [--processos 2] [--threads 16] [--saidas 50]
+"""
+import os
+import re
+import sys
+import sqlite3
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import estoque
+import logs
+
+def _preparar(caminho, quantidade):
+    """Banco novo com um usuário e um item de quantidade `quantidade` (sem movimentações)."""
+    database.DB_NAME = caminho
+    database.criar_tabelas()
+    database.aplicar_migracoes()
+    conn = sqlite3.connect(caminho)
+    with conn:
+        usuario_id = conn.execute(
+            "INSERT INTO usuarios (username, password_hash, role) VALUES ('concorrencia', '-', 'encarregado')").lastrowid
+        item_id = conn.execute(
+            "INSERT INTO itens_estoque (nome, quantidade, preco_unitario) VALUES ('Cimento CP-II 50kg', ?, 1.0)",
+            (quantidade,)).lastrowid
+    conn.close()
+    database.fechar_pool()
+    return usuario_id, item_id
+
+def _disparar(caminho, item_id, usuario_id, threads, saidas):
+    """Roda num processo: `threads` threads com `saidas` saídas de 1 cada. Retorna (sucessos, recusas, erros)."""
+    database.DB_NAME = caminho
+    contagem = {"sucessos": 0, "recusas": 0, "erros": []}
+    lock = threading.Lock()
+    largada = threading.Barrier(threads)
+
+    def baixar():
+        largada.wait()
+        for _ in range(saidas):
+            sucesso, mensagem = estoque._modificar_estoque(item_id, 1, 'saida', usuario_id, "Teste de concorrência")
+            with lock:
+                if sucesso:
+                    contagem["sucessos"] += 1
+                elif mensagem.startswith("Erro: Estoque insuficiente"):
+                    contagem["recusas"] += 1
+                else:
+                    contagem["erros"].append(mensagem)
+
+    grupo = [threading.Thread(target=baixar) for _ in range(threads)]
+    for thread in grupo:
+        thread.start()
+    for thread in grupo:
+        thread.join()
+    logs.descarregar()
+    database.fechar_pool()
+    return contagem["sucessos"], contagem["recusas"], contagem["erros"]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quantidade", type=int, default=1000, help="quantidade inicial do item (Q)")
+    parser.add_argument("--processos", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=16, help="threads por processo")
+    parser.add_argument("--saidas", type=int, default=50, help="saídas de 1 unidade por thread")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = os.path.join(pasta, "estoque.db")
+        usuario_id, item_id = _preparar(caminho, args.quantidade)
+
+        # spawn: cada processo abre suas próprias conexões, como um worker do servidor.
+        contexto = multiprocessing.get_context("spawn")
+        with contexto.Pool(args.processos) as pool:
+            parciais = pool.starmap(_disparar, [(caminho, item_id, usuario_id, args.threads, args.saidas)] * args.processos)
+        sucessos = sum(p[0] for p in parciais)
+        recusas = sum(p[1] for p in parciais)
+        erros = [mensagem for p in parciais for mensagem in p[2]]
+
+        conn = sqlite3.connect(caminho)
+        final = conn.execute("SELECT quantidade FROM itens_estoque WHERE id = ?", (item_id,)).fetchone()[0]
+        linhas = conn.execute("SELECT COUNT(*) FROM movimentacoes WHERE item_id = ? AND tipo = 'saida'", (item_id,)).fetchone()[0]
+        saldos = [int(re.search(r"Novo Saldo: (-?\d+)", detalhes).group(1)) for (detalhes,) in conn.execute(
+            "SELECT detalhes FROM logs_auditoria WHERE acao = 'MOVIMENTACAO_SAIDA'")]
+        conn.close()
+
+    tentativas = args.processos * args.threads * args.saidas
+    print(f"{tentativas} saídas tentadas ({args.processos} processo(s) x {args.threads} threads x {args.saidas}) "
+          f"sobre quantidade inicial {args.quantidade}")
+    print(f"  sucessos: {sucessos}, recusas: {recusas}, erros: {len(erros)}")
+    print(f"  quantidade final: {final}, movimentações gravadas: {linhas}")
+
+    falhas = []
+    if final != args.quantidade - sucessos:
+        falhas.append(f"quantidade final {final}, esperada {args.quantidade - sucessos}")
+    if final < 0 or min(saldos, default=0) < 0:
+        falhas.append(f"saldo negativo (final {final}, menor saldo auditado {min(saldos, default=0)})")
+    if len(saldos) != sucessos or len(set(saldos)) != len(saldos):
+        falhas.append(f"{len(saldos)} saldos auditados, {len(set(saldos))} distintos, para {sucessos} saídas")
+    if linhas != sucessos:
+        falhas.append(f"{linhas} movimentações gravadas para {sucessos} saídas bem-sucedidas")
+    if sucessos != min(args.quantidade, tentativas - len(erros)):
+        falhas.append(f"{sucessos} saídas aceitas; havia saldo para {min(args.quantidade, tentativas - len(erros))}")
+    if erros:
+        falhas.append(f"{len(erros)} saída(s) com erro, ex.: {erros[0]}")
+    for falha in falhas:
+        print(f"FALHA: {falha}")
+    sys.exit(1 if falhas else 0)
+
+if __name__ == "__main__":
+    main()
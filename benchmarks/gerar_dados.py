@@ -0,0 +1,226 @@
+# benchmarks/gerar_dados.py
+"""
+Gera um banco de dados sintético (com o esquema e as migrações da aplicação) para testes de escala.
+
+Uso (a partir da raiz do projeto):
+    python benchmarks/gerar_dados.py dados.db --itens 50000 --movimentacoes 5000000 --semente 42
+
+Com a mesma semente e os mesmos parâmetros, o conteúdo gerado é o mesmo (exceto as datas, que
+terminam no momento da geração). O histórico é consistente: as movimentações de cada item seguem
+em ordem cronológica, nenhuma saída deixa o saldo negativo e itens_estoque.quantidade é a soma das
+entradas/compras menos as saídas. Pedidos aprovados têm a movimentação correspondente (pedido_id).
+Usuários: "admin" (senha "admin", administração) e usuario0001... (senha "senha", perfis variados).
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import auth
+
+MATERIAIS = ("Cimento", "Areia", "Brita", "Tijolo", "Bloco de Concreto", "Telha", "Prego", "Parafuso",
+             "Tubo PVC", "Conexão PVC", "Fio Elétrico", "Cabo Flexível", "Tinta Acrílica", "Argamassa",
+             "Vergalhão", "Tábua de Pinus", "Piso Cerâmico", "Azulejo", "Rejunte", "Cal Hidratada",
+             "Manta Asfáltica", "Disjuntor", "Registro de Gaveta", "Caixa d'Água", "Impermeabilizante")
+ESPECIFICACOES = ("CP-II 50kg", "Média", "Nº 1", "8 Furos", "14x19x39", "Colonial", "18x27", "6mm",
+                  "25mm", "Joelho 90°", "2,5mm", "10mm", "Branco Neve 18L", "AC-III 20kg", "CA-50 10mm",
+                  "30cm", "60x60", "Branco", "Cinza 5kg", "20kg", "3mm", "Bipolar 32A", "3/4\"", "1000L", "18L")
+CATEGORIAS = ("Alvenaria e Vedação", "Hidráulica", "Elétrica", "Acabamento", "Cobertura", "Fundação",
+              "Estrutura", "Pintura", "Ferragens", "Impermeabilização")
+PERFIS = ("engenheiro", "encarregado", "comercial", "administracao")
+
+# Linhas acumuladas antes de cada INSERT em lote.
+TAMANHO_LOTE = 50000
+
+def _formatar(instante):
+    """Mesmo formato (UTC) do CURRENT_TIMESTAMP do SQLite."""
+    return instante.strftime("%Y-%m-%d %H:%M:%S")
+
+def _remover_indices_e_triggers(conn, tabela):
+    """Remove índices e triggers da tabela (para a carga em lote) e retorna o SQL para recriá-los."""
+    objetos = conn.execute(
+        "SELECT type, name, sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+        (tabela,)
+    ).fetchall()
+    for tipo, nome, _ in objetos:
+        conn.execute(f"DROP {tipo.upper()} {nome}")
+    return [sql for _, _, sql in objetos]
+
+def gerar(caminho, itens=5000, descricoes=200, obras=50, usuarios=20, movimentacoes=500000, pedidos=5000,
+          dias=365, semente=42, ao_avancar=None):
+    """
+    Cria o banco em `caminho` (que não deve existir) e retorna as contagens geradas.
+    `ao_avancar(etapa, feito, total)` é chamado a cada lote, para acompanhar o progresso.
+    """
+    if os.path.exists(caminho):
+        raise FileExistsError(caminho)
+    rng = random.Random(semente)
+    descricoes = max(1, min(descricoes, itens))
+
+    database.DB_NAME = caminho
+    database.criar_tabelas()
+    database.fechar_pool()
+
+    conn = sqlite3.connect(caminho)
+    conn.execute("PRAGMA synchronous = OFF")  # só durante a geração: o banco é descartável até o fim
+    conn.execute("BEGIN")
+
+    # --- Cadastros ---
+    conn.execute("INSERT INTO usuarios (username, password_hash, role) VALUES ('admin', ?, 'administracao')",
+                 (auth.hash_password("admin"),))
+    senha = auth.hash_password("senha")
+    conn.executemany("INSERT INTO usuarios (username, password_hash, role) VALUES (?, ?, ?)",
+                     [(f"usuario{i:04d}", senha, PERFIS[i % len(PERFIS)]) for i in range(1, usuarios + 1)])
+    ids_usuarios = [row[0] for row in conn.execute("SELECT id FROM usuarios")]
+
+    conn.executemany("INSERT INTO descricoes (nome) VALUES (?)",
+                     [(f"{CATEGORIAS[i % len(CATEGORIAS)]} {i // len(CATEGORIAS) + 1:03d}",) for i in range(descricoes)])
+    ids_descricoes = [row[0] for row in conn.execute("SELECT id FROM descricoes")]
+
+    conn.executemany("INSERT INTO obras (nome, localizacao) VALUES (?, ?)",
+                     [(f"Obra {i:04d}", f"Quadra {rng.randint(1, 99)}, Lote {rng.randint(1, 40)}") for i in range(1, obras + 1)])
+    obras_lista = [tuple(row) for row in conn.execute("SELECT id, nome FROM obras")]
+
+    conn.executemany(
+        "INSERT INTO itens_estoque (nome, descricao_id, preco_unitario, quantidade) VALUES (?, ?, ?, 0)",
+        [(f"{rng.choice(MATERIAIS)} {rng.choice(ESPECIFICACOES)} {i:06d}", rng.choice(ids_descricoes),
+          round(rng.uniform(0.5, 500), 2)) for i in range(1, itens + 1)]
+    )
+    ids_itens = [row[0] for row in conn.execute("SELECT id FROM itens_estoque ORDER BY id")]
+    saldos = dict.fromkeys(ids_itens, 0)
+
+    # --- Movimentações (em ordem cronológica) e pedidos aprovados junto com elas ---
+    recriar = _remover_indices_e_triggers(conn, "movimentacoes")
+    fim = datetime.now(timezone.utc).replace(microsecond=0)
+    instante = fim - timedelta(days=dias)
+    passo_medio = dias * 86400 / max(movimentacoes, 1)
+
+    aprovados = min(int(pedidos * 0.75), movimentacoes)
+    posicoes_pedidos = set(rng.sample(range(movimentacoes), aprovados)) if aprovados else set()
+    proximo_pedido = 1
+    lote_movs, lote_pedidos = [], []
+
+    def gravar_lotes():
+        conn.executemany(
+            "INSERT INTO pedidos (id, item_id, quantidade, tipo, status, data_solicitacao, solicitante_id, "
+            "data_decisao, aprovador_id, obra_id, justificativa, motivo_rejeicao) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            lote_pedidos)
+        conn.executemany(
+            "INSERT INTO movimentacoes (item_id, tipo, quantidade, data, usuario_id, observacao, obra_id, pedido_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", lote_movs)
+        lote_movs.clear()
+        lote_pedidos.clear()
+
+    for posicao in range(movimentacoes):
+        instante += timedelta(seconds=rng.expovariate(1 / passo_medio))
+        data = _formatar(min(instante, fim))
+        # Poucos itens concentram a maior parte do movimento, como num almoxarifado real.
+        item_id = ids_itens[int(len(ids_itens) * rng.random() ** 2)]
+        usuario_id = rng.choice(ids_usuarios)
+        quantidade = rng.randint(1, 50)
+
+        if saldos[item_id] >= quantidade and rng.random() < 0.5:
+            tipo = 'saida'
+            saldos[item_id] -= quantidade
+        else:
+            tipo = 'compra' if rng.random() < 0.05 else 'entrada'
+            saldos[item_id] += quantidade
+        obra_id, observacao, pedido_id = None, None, None
+        if tipo == 'saida' and obras_lista and rng.random() < 0.7:
+            obra_id, obra_nome = rng.choice(obras_lista)
+            observacao = f"Obra: {obra_nome}"
+
+        if posicao in posicoes_pedidos:
+            pedido_id = proximo_pedido
+            proximo_pedido += 1
+            solicitado = _formatar(min(instante, fim) - timedelta(hours=rng.uniform(1, 72)))
+            tipo_pedido = 'saida' if tipo == 'saida' else 'compra'
+            if tipo_pedido == 'saida' and obra_id is None and obras_lista:
+                obra_id, obra_nome = rng.choice(obras_lista)
+            tipo = 'saida' if tipo_pedido == 'saida' else 'entrada'  # compra aprovada vira entrada
+            observacao = (f"Obra: {obra_nome} (Pedido #{pedido_id})" if obra_id else f"Ref. Pedido Aprovado #{pedido_id}")
+            lote_pedidos.append((pedido_id, item_id, quantidade, tipo_pedido, 'aprovado', solicitado, usuario_id,
+                                 data, ids_usuarios[0], obra_id if tipo_pedido == 'saida' else None, "Gerado", None))
+
+        lote_movs.append((item_id, tipo, quantidade, data, usuario_id, observacao, obra_id, pedido_id))
+        if len(lote_movs) >= TAMANHO_LOTE:
+            gravar_lotes()
+            if ao_avancar:
+                ao_avancar("movimentacoes", posicao + 1, movimentacoes)
+    gravar_lotes()
+
+    # --- Pedidos pendentes e rejeitados (sem movimentação) ---
+    restantes = pedidos - aprovados
+    pendentes = int(restantes * 0.4)
+    for numero in range(restantes):
+        pendente = numero < pendentes
+        tipo_pedido = 'saida' if rng.random() < 0.7 else 'compra'
+        obra_id = rng.choice(obras_lista)[0] if tipo_pedido == 'saida' and obras_lista else None
+        solicitado = fim - timedelta(seconds=rng.uniform(0, dias * 86400))
+        lote_pedidos.append((
+            proximo_pedido, rng.choice(ids_itens), rng.randint(1, 50), tipo_pedido,
+            'pendente' if pendente else 'rejeitado', _formatar(solicitado), rng.choice(ids_usuarios),
+            None if pendente else _formatar(min(solicitado + timedelta(hours=rng.uniform(1, 48)), fim)),
+            None if pendente else ids_usuarios[0], obra_id, "Gerado", None if pendente else "Gerado (rejeitado)"
+        ))
+        proximo_pedido += 1
+    gravar_lotes()
+
+    # --- Saldos finais, índices, triggers e resumos ---
+    conn.executemany("UPDATE itens_estoque SET quantidade = ? WHERE id = ?", [(saldo, item) for item, saldo in saldos.items()])
+    if ao_avancar:
+        ao_avancar("indices", 0, len(recriar))
+    for sql in recriar:
+        conn.execute(sql)
+    conn.commit()
+    conn.close()
+
+    database.reconstruir_resumos()
+    database.verificar_valor_estoque()
+    conn = database.conectar_bd()
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    database.fechar_pool()
+
+    return {"itens": itens, "descricoes": descricoes, "obras": obras, "usuarios": usuarios + 1,
+            "movimentacoes": movimentacoes, "pedidos": pedidos, "pedidos_pendentes": pendentes}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("saida", help="arquivo do banco a criar")
+    parser.add_argument("--itens", type=int, default=5000)
+    parser.add_argument("--descricoes", type=int, default=200)
+    parser.add_argument("--obras", type=int, default=50)
+    parser.add_argument("--usuarios", type=int, default=20)
+    parser.add_argument("--movimentacoes", type=int, default=500000)
+    parser.add_argument("--pedidos", type=int, default=5000)
+    parser.add_argument("--dias", type=int, default=365, help="período coberto pelo histórico")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--sobrescrever", action="store_true")
+    args = parser.parse_args()
+
+    if args.sobrescrever:
+        for sufixo in ("", "-wal", "-shm"):
+            if os.path.exists(args.saida + sufixo):
+                os.remove(args.saida + sufixo)
+
+    inicio = time.perf_counter()
+    def ao_avancar(etapa, feito, total):
+        print(f"\r{etapa}: {feito}/{total} ({time.perf_counter() - inicio:.0f}s)", end="", flush=True)
+
+    contagens = gerar(args.saida, args.itens, args.descricoes, args.obras, args.usuarios, args.movimentacoes,
+                      args.pedidos, args.dias, args.semente, ao_avancar=ao_avancar)
+    print(f"\rGerado em {time.perf_counter() - inicio:.1f}s: {args.saida} ({os.path.getsize(args.saida) / 2**20:.1f} MiB)")
+    for nome, valor in contagens.items():
+        print(f"  {nome}: {valor}")
+
+if __name__ == "__main__":
+    main()
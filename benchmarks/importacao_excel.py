@@ -0,0 +1,102 @@
+# benchmarks/importacao_excel.py
+"""
+Compara a importação de planilhas em lote (excel_handler.importar_do_excel) com o laço
+linha a linha usado antes (iterrows + SELECT/INSERT por linha).
+
+Uso (a partir da raiz do projeto):
+    python benchmarks/importacao_excel.py --linhas 20000 --descricoes 200
+Cada método roda num banco novo, em uma pasta temporária; o estoque.db não é tocado.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openpyxl
+import pandas as pd
+import database
+import excel_handler
+
+def gerar_planilha(caminho, linhas, descricoes, prefixo="Material"):
+    pasta = openpyxl.Workbook(write_only=True)
+    planilha = pasta.create_sheet()
+    planilha.append(["Nome", "Descrição", "Preço Unitário", "Quantidade"])
+    for i in range(linhas):
+        planilha.append([f"{prefixo} {i:06d}", f"Categoria {i % descricoes:03d}", round(1 + (i % 997) * 0.37, 2), i % 500])
+    pasta.save(caminho)
+
+def importar_linha_a_linha(caminho_arquivo):
+    """O laço anterior, mantido aqui apenas como referência de comparação."""
+    df = pd.read_excel(caminho_arquivo, engine='openpyxl')
+    df.columns = [excel_handler._normalizar_cabecalho(col) for col in df.columns]
+    df.rename(columns=excel_handler.COLUNAS_IMPORTACAO, inplace=True)
+
+    conn = database.conectar_bd()
+    cursor = conn.cursor()
+    count_sucesso = 0
+    for _, row in df.iterrows():
+        cursor.execute("SELECT id FROM descricoes WHERE nome = ?", (row['Descricao'],))
+        descricao_row = cursor.fetchone()
+        if descricao_row:
+            descricao_id = descricao_row['id']
+        else:
+            cursor.execute("INSERT INTO descricoes (nome) VALUES (?)", (row['Descricao'],))
+            descricao_id = cursor.lastrowid
+        cursor.execute(
+            "INSERT OR IGNORE INTO itens_estoque (nome, descricao_id, preco_unitario, quantidade) VALUES (?, ?, ?, ?)",
+            (row['Nome'], descricao_id, row['Preco_Unitario'], row['Quantidade'])
+        )
+        if cursor.rowcount > 0:
+            count_sucesso += 1
+    conn.commit()
+    conn.close()
+    return f"{count_sucesso} novos itens importados com sucesso da planilha.", "success"
+
+def medir(nome, funcao, planilha, pasta_temporaria, memoria=False):
+    """Roda a importação num banco novo. Com `memoria`, mede o pico de alocação (tracemalloc deixa tudo mais lento)."""
+    database.DB_NAME = os.path.join(pasta_temporaria, f"{nome}{'_memoria' if memoria else ''}.db")
+    database.criar_tabelas()
+
+    if memoria:
+        tracemalloc.start()
+    inicio = time.perf_counter()
+    mensagem, _ = funcao(planilha)
+    duracao = time.perf_counter() - inicio
+    pico = tracemalloc.get_traced_memory()[1] if memoria else None
+    tracemalloc.stop()
+    database.fechar_pool()
+    return duracao, pico, mensagem
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--linhas", type=int, default=20000)
+    parser.add_argument("--descricoes", type=int, default=200)
+    parser.add_argument("--memoria", action="store_true", help="também mede o pico de memória (execução extra)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta_temporaria:
+        planilha = os.path.join(pasta_temporaria, "planilha.xlsx")
+        gerar_planilha(planilha, args.linhas, args.descricoes)
+        print(f"Planilha: {args.linhas} linhas, {args.descricoes} descrições "
+              f"({os.path.getsize(planilha) / 1024:.0f} KiB)\n")
+
+        resultados = []
+        for nome, funcao in (("linha_a_linha", importar_linha_a_linha), ("em_lote", excel_handler.importar_do_excel)):
+            duracao, _, mensagem = medir(nome, funcao, planilha, pasta_temporaria)
+            pico = medir(nome, funcao, planilha, pasta_temporaria, memoria=True)[1] if args.memoria else None
+            resultados.append((nome, duracao, pico, mensagem))
+
+    print(f"{'método':<15}{'tempo (s)':>12}{'linhas/s':>12}{'pico memória (MiB)':>21}")
+    for nome, duracao, pico, _ in resultados:
+        memoria = f"{pico / 2**20:.1f}" if pico is not None else "-"
+        print(f"{nome:<15}{duracao:>12.2f}{args.linhas / duracao:>12.0f}{memoria:>21}")
+    print(f"\nGanho: {resultados[0][1] / resultados[1][1]:.1f}x")
+    for nome, _, _, mensagem in resultados:
+        print(f"{nome}: {mensagem}")
+
+if __name__ == "__main__":
+    main()
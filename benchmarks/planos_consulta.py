@@ -0,0 +1,106 @@
+# benchmarks/planos_consulta.py
+"""
+Verifica, com EXPLAIN QUERY PLAN, que as consultas principais usam os índices criados pelas migrações.
+
+Cria um banco novo numa pasta temporária (criar_tabelas + aplicar_migracoes), executa as funções da
+aplicação capturando o SQL que cada uma roda (com os parâmetros já substituídos) e confere o plano de
+cada consulta. Falha (código de saída 1) se alguma consulta não usar o índice esperado ou precisar
+ordenar/agrupar numa tabela temporária (USE TEMP B-TREE) em vez de seguir a ordem do índice.
+
+Uso (a partir da raiz do projeto):
+    python benchmarks/planos_consulta.py
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import relatorios
+import pedidos
+
+def _sql(consulta, *parametros):
+    """Executa uma consulta avulsa (para índices ainda sem consulta própria na aplicação)."""
+    def executar():
+        conn = database.conectar_bd()
+        conn.execute(consulta, parametros).fetchall()
+        conn.close()
+    return executar
+
+_CURSOR = relatorios._codificar_cursor({"data": "2024-06-01 12:00:00", "id": 100})
+
+# (descrição, tabela, índice esperado, chamada que executa a consulta)
+VERIFICACOES = [
+    ("relatorios.get_ultimas_movimentacoes", "movimentacoes", "idx_movimentacoes_data",
+     lambda: relatorios.get_ultimas_movimentacoes()),
+    ("relatorios.get_todas_movimentacoes (primeira página)", "movimentacoes", "idx_movimentacoes_data",
+     lambda: relatorios.get_todas_movimentacoes()),
+    ("relatorios.get_todas_movimentacoes (próxima página)", "movimentacoes", "idx_movimentacoes_data",
+     lambda: relatorios.get_todas_movimentacoes(cursor_pagina=_CURSOR)),
+    ("relatorios.get_todas_movimentacoes (página anterior)", "movimentacoes", "idx_movimentacoes_data",
+     lambda: relatorios.get_todas_movimentacoes(cursor_pagina=_CURSOR, direcao="anterior")),
+    ("pedidos.listar_pedidos_pendentes", "pedidos", "idx_pedidos_status_data",
+     lambda: pedidos.listar_pedidos_pendentes()),
+    ("pedidos.get_pedidos_por_solicitante", "pedidos", "idx_pedidos_solicitante",
+     lambda: pedidos.get_pedidos_por_solicitante(1)),
+    ("resumo por item e tipo (reconstruir_resumos)", "movimentacoes", "idx_movimentacoes_item_tipo",
+     _sql(database.RESUMOS["resumo_movimentacoes_item"])),
+    ("movimentações de um item por tipo", "movimentacoes", "idx_movimentacoes_item_tipo",
+     _sql("SELECT SUM(quantidade) FROM movimentacoes WHERE item_id = ? AND tipo = ?", 1, "saida")),
+    ("auditoria por período", "logs_auditoria", "idx_logs_timestamp",
+     _sql("SELECT usuario_id, acao, detalhes FROM logs_auditoria WHERE timestamp >= ? ORDER BY timestamp DESC",
+          "2024-06-01 00:00:00")),
+]
+
+def consultas_executadas(chamada, tabela):
+    """SQL executado por `chamada()` que lê de `tabela`, capturado na conexão do escopo."""
+    executadas = []
+    database.abrir_escopo()
+    try:
+        conn = database.conectar_bd()
+        conn.set_trace_callback(executadas.append)
+        conn.close()  # volta ao escopo: as funções chamadas reutilizam esta mesma conexão
+        chamada()
+        conn = database.conectar_bd()
+        conn.set_trace_callback(None)
+        conn.close()
+    finally:
+        database.encerrar_escopo()
+    return [sql for sql in executadas if f"FROM {tabela}" in sql]
+
+def plano(sql):
+    conn = database.conectar_bd()
+    linhas = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+    conn.close()
+    return linhas
+
+def main():
+    falhas = []
+    with tempfile.TemporaryDirectory() as pasta:
+        database.DB_NAME = os.path.join(pasta, "estoque.db")
+        database.criar_tabelas()
+        database.aplicar_migracoes()
+
+        for descricao, tabela, indice, chamada in VERIFICACOES:
+            consultas = consultas_executadas(chamada, tabela)
+            if not consultas:
+                falhas.append(f"{descricao}: nenhuma consulta a {tabela} foi executada")
+                print(f"FALHA  {descricao}")
+                continue
+            for sql in consultas:
+                linhas = plano(sql)
+                ok = any(f"INDEX {indice}" in linha for linha in linhas) and not any("TEMP B-TREE" in linha for linha in linhas)
+                print(f"{'ok' if ok else 'FALHA':<6} {descricao}: {indice}")
+                for linha in linhas:
+                    print(f"         {linha}")
+                if not ok:
+                    falhas.append(f"{descricao}: plano sem {indice} ou com ordenação temporária")
+        database.fechar_pool()
+
+    for falha in falhas:
+        print(f"FALHA: {falha}")
+    sys.exit(1 if falhas else 0)
+
+if __name__ == "__main__":
+    main()
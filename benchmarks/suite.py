@@ -0,0 +1,237 @@
+# benchmarks/suite.py
+"""
+Mede o tempo das principais funções de acesso a dados (estoque, pedidos, relatórios, importação)
+e das rotas Flask (pelo test client), e grava os resultados em JSON para comparar execuções.
+
+Uso (a partir da raiz do projeto):
+    python benchmarks/suite.py --banco dados.db --saida resultados.json
+    python benchmarks/suite.py --itens 5000 --movimentacoes 500000 --saida resultados.json
+    python benchmarks/suite.py --banco dados.db --comparar resultados.json
+
+Sem --banco, gera um banco com gerar_dados.py (mesmos parâmetros de tamanho). O banco informado não
+é alterado: a suíte trabalha numa cópia, numa pasta temporária. Com --comparar, mostra a razão entre
+as medianas de agora e as do arquivo anterior e sai com código 1 se alguma passar da tolerância.
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import platform
+import tempfile
+import statistics
+from datetime import date, datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("ESTOQUE_SECRET_KEY", "benchmark")  # não grava instance/secret_key
+
+import database
+import estoque
+import pedidos
+import relatorios
+import excel_handler
+import logs
+from app import app
+from benchmarks.gerar_dados import gerar
+from benchmarks.importacao_excel import gerar_planilha
+
+def cronometrar(funcao, repeticoes, aquecer=True):
+    """Executa `funcao(i)` `repeticoes` vezes e retorna as estatísticas, em ms."""
+    if aquecer:
+        funcao(-1)
+    tempos = []
+    for i in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao(i)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    tempos.sort()
+    return {
+        "repeticoes": len(tempos),
+        "min_ms": round(tempos[0], 3),
+        "mediana_ms": round(statistics.median(tempos), 3),
+        "p95_ms": round(tempos[min(len(tempos) - 1, int(len(tempos) * 0.95))], 3),
+        "media_ms": round(statistics.fmean(tempos), 3),
+        "max_ms": round(tempos[-1], 3),
+    }
+
+def _copiar_banco(origem, destino):
+    """Cópia consistente (API de backup do SQLite), mesmo com o WAL ainda não integrado."""
+    fonte, copia = sqlite3.connect(origem), sqlite3.connect(destino)
+    with copia:
+        fonte.backup(copia)
+    fonte.close()
+    copia.close()
+
+def _dados_de_apoio(conn):
+    """Valores reais do banco usados como parâmetros: cursor de página profunda, obra, pedidos pendentes."""
+    total = database.ler_contador(conn.cursor(), 'movimentacoes')
+    profunda = conn.execute("SELECT id, data FROM movimentacoes ORDER BY data DESC, id DESC LIMIT 1 OFFSET ?",
+                            (max(int(total * 0.9) - 1, 0),)).fetchone()
+    obra = conn.execute("SELECT obra_id FROM movimentacoes WHERE obra_id IS NOT NULL AND tipo = 'saida' "
+                        "GROUP BY obra_id ORDER BY COUNT(*) DESC LIMIT 1").fetchone()
+    # Pedidos de compra: a aprovação sempre tem efeito (não depende de saldo)
+    pendentes = [row[0] for row in conn.execute("SELECT id FROM pedidos WHERE status = 'pendente' ORDER BY tipo = 'compra' DESC, id")]
+    item = conn.execute("SELECT id FROM itens_estoque ORDER BY id LIMIT 1").fetchone()
+    return {
+        "total_movimentacoes": total,
+        "cursor_profundo": relatorios._codificar_cursor(profunda) if profunda else None,
+        "obra_id": obra[0] if obra else None,
+        "pendentes": pendentes,
+        "item_id": item[0] if item else None,
+    }
+
+def executar(caminho_banco, repeticoes, linhas_planilha, pasta):
+    """Roda todas as medições sobre o banco em `caminho_banco` e retorna {nome: estatísticas}."""
+    database.DB_NAME = caminho_banco
+    conn = database.conectar_bd()
+    apoio = _dados_de_apoio(conn)
+    conn.close()
+    resultados = {}
+
+    def medir(nome, funcao, vezes=repeticoes, aquecer=True):
+        resultados[nome] = cronometrar(funcao, vezes, aquecer)
+        print(f"  {nome:<55}{resultados[nome]['mediana_ms']:>10.2f} ms")
+
+    # --- Funções de acesso a dados ---
+    def listar_itens_sem_cache(_):
+        estoque.listar_itens.limpar_cache()
+        estoque.listar_itens()
+    medir("estoque.listar_itens (sem cache)", listar_itens_sem_cache)
+    medir("estoque.listar_itens (em cache)", lambda _: estoque.listar_itens())
+    medir("estoque.buscar_itens('cim')", lambda _: estoque.buscar_itens("cim"))
+    medir("estoque.buscar_itens (página 20, por quantidade)", lambda _: estoque.buscar_itens("", "quantidade", "desc", 20))
+    medir("relatorios.get_todas_movimentacoes (primeira página)", lambda _: relatorios.get_todas_movimentacoes())
+    if apoio["cursor_profundo"]:
+        medir("relatorios.get_todas_movimentacoes (página a 90%)",
+              lambda _: relatorios.get_todas_movimentacoes(cursor_pagina=apoio["cursor_profundo"]))
+    medir("relatorios.get_dados_graficos", lambda _: relatorios.get_dados_graficos())
+    medir("relatorios.get_movimentacoes_do_dia", lambda _: relatorios.get_movimentacoes_do_dia())
+    medir("relatorios.relatorio_saldo_geral", lambda _: relatorios.relatorio_saldo_geral())
+    hoje = date.today()
+    medir("relatorios.get_serie_movimentacoes (365 dias, por semana)",
+          lambda _: relatorios.get_serie_movimentacoes(hoje - timedelta(days=365), hoje, 'semana'))
+    if apoio["obra_id"]:
+        medir("pedidos.get_materiais_por_obra", lambda _: pedidos.get_materiais_por_obra(apoio["obra_id"]))
+    medir("pedidos.listar_pedidos_pendentes", lambda _: pedidos.listar_pedidos_pendentes())
+
+    # --- Escritas (cada repetição usa dados próprios; sem aquecimento) ---
+    if apoio["item_id"]:
+        medir("estoque.registrar_entrada", lambda _: estoque.registrar_entrada(apoio["item_id"], 1, 1, "benchmark"))
+    vezes = min(repeticoes, len(apoio["pendentes"]))
+    if vezes:
+        medir("pedidos.aprovar_pedido", lambda i: pedidos.aprovar_pedido(apoio["pendentes"][i], 1), vezes, aquecer=False)
+    planilhas = []
+    for i in range(max(1, repeticoes // 4)):
+        planilha = os.path.join(pasta, f"planilha_{i}.xlsx")
+        gerar_planilha(planilha, linhas_planilha, 50, prefixo=f"Benchmark {i:03d}")
+        planilhas.append(planilha)
+    medir(f"excel_handler.importar_do_excel ({linhas_planilha} linhas)",
+          lambda i: excel_handler.importar_do_excel(planilhas[i]), len(planilhas), aquecer=False)
+
+    # --- Rotas (test client, logado como administrador) ---
+    cliente = app.test_client()
+    resposta = cliente.post('/login', data={'username': 'admin', 'password': 'admin'})
+    if resposta.status_code != 302:
+        print("  (rotas não medidas: login 'admin'/'admin' falhou)")
+        return resultados
+    rotas = ['/', '/estoque', '/api/estoque/itens?q=cim', '/movimentacao', '/relatorios', '/admin/pedidos',
+             '/api/relatorios/serie?granularidade=semana']
+    if apoio["cursor_profundo"]:
+        rotas.append(f"/relatorios?cursor={apoio['cursor_profundo']}")
+    if apoio["obra_id"]:
+        rotas.append(f"/obras/{apoio['obra_id']}")
+
+    def requisitar(rota):
+        def funcao(_):
+            resposta = cliente.get(rota)
+            if resposta.status_code != 200:
+                raise RuntimeError(f"{rota}: HTTP {resposta.status_code}")
+        return funcao
+    for rota in rotas:
+        medir(f"GET {rota.split('?cursor=')[0] + ('?cursor=<90%>' if '?cursor=' in rota else '')}", requisitar(rota))
+
+    logs.descarregar()
+    return resultados
+
+def comparar(atuais, anteriores, tolerancia, piso_ms):
+    """
+    Imprime a razão entre as medianas e retorna os nomes que pioraram além da tolerância.
+    Diferenças abaixo de `piso_ms` são ignoradas (em medições sub-milissegundo a razão é só ruído).
+    """
+    regressoes = []
+    print(f"\n{'medição':<57}{'antes':>10}{'agora':>10}{'razão':>8}")
+    for nome, medida in atuais.items():
+        anterior = anteriores.get(nome)
+        if not anterior:
+            continue
+        razao = medida["mediana_ms"] / anterior["mediana_ms"] if anterior["mediana_ms"] else float("inf")
+        marca = ""
+        if razao > tolerancia and medida["mediana_ms"] - anterior["mediana_ms"] > piso_ms:
+            regressoes.append(nome)
+            marca = "  <- regressão"
+        print(f"{nome:<57}{anterior['mediana_ms']:>10.2f}{medida['mediana_ms']:>10.2f}{razao:>8.2f}{marca}")
+    return regressoes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--banco", help="banco gerado por gerar_dados.py (não é alterado)")
+    parser.add_argument("--itens", type=int, default=5000)
+    parser.add_argument("--movimentacoes", type=int, default=200000)
+    parser.add_argument("--pedidos", type=int, default=2000)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--repeticoes", type=int, default=20)
+    parser.add_argument("--linhas-planilha", type=int, default=1000)
+    parser.add_argument("--saida", help="arquivo JSON com os resultados")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior")
+    parser.add_argument("--tolerancia", type=float, default=1.25, help="razão máxima aceita na comparação")
+    parser.add_argument("--piso-ms", type=float, default=0.5, help="diferença mínima (ms) para contar como regressão")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = os.path.join(pasta, "benchmark.db")
+        if args.banco:
+            _copiar_banco(args.banco, caminho)
+            database.DB_NAME = caminho
+            database.criar_tabelas()  # bancos antigos: aplica as migrações pendentes (só na cópia)
+            banco = {"origem": os.path.abspath(args.banco)}
+        else:
+            print("Gerando banco de dados...")
+            banco = gerar(caminho, itens=args.itens, movimentacoes=args.movimentacoes, pedidos=args.pedidos,
+                          semente=args.semente)
+            banco["semente"] = args.semente
+
+        database.DB_NAME = caminho
+        conn = database.conectar_bd()
+        for tabela in ("itens_estoque", "movimentacoes", "pedidos"):
+            banco[f"linhas_{tabela}"] = conn.execute(f"SELECT COUNT(*) FROM {tabela}").fetchone()[0]
+        conn.close()
+        banco["tamanho_mib"] = round(os.path.getsize(caminho) / 2**20, 1)
+
+        print(f"Medindo ({args.repeticoes} repetições, mediana):")
+        resultados = executar(caminho, args.repeticoes, args.linhas_planilha, pasta)
+        database.fechar_pool()
+
+    relatorio = {
+        "gerado_em": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "ambiente": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                     "plataforma": platform.platform(), "processador": platform.processor() or platform.machine()},
+        "banco": banco,
+        "parametros": {"repeticoes": args.repeticoes, "linhas_planilha": args.linhas_planilha},
+        "resultados": resultados,
+    }
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+        print(f"\nResultados gravados em {args.saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as arquivo:
+            anteriores = json.load(arquivo)["resultados"]
+        regressoes = comparar(resultados, anteriores, args.tolerancia, args.piso_ms)
+        if regressoes:
+            print(f"\n{len(regressoes)} medição(ões) acima da tolerância de {args.tolerancia:.2f}x")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# benchmarks/tempo_importacao.py
+"""
+Verifica o custo de inicialização da aplicação (import app), medido com `python -X importtime`.
+
+Falha (código de saída 1) se:
+  - alguma dependência pesada (pandas, openpyxl...) for importada já na inicialização, em vez de no
+    primeiro uso; ou
+  - o tempo de importação passar do orçamento.
+
+Uso (a partir da raiz do projeto):
+    python benchmarks/tempo_importacao.py [--orcamento-ms 500] [--repeticoes 5]
+Cada repetição roda num processo novo; vale a menor medida (a menos afetada por ruído).
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Módulos que só devem ser carregados quando usados (importação/exportação de planilhas).
+PESADOS = ("pandas", "numpy", "openpyxl", "pdfkit")
+
+ORCAMENTO_PADRAO_MS = int(os.environ.get("ESTOQUE_ORCAMENTO_IMPORTACAO_MS", 500))
+
+def medir():
+    """Roda `import app` num processo novo. Retorna {módulo: (próprio_us, acumulado_us)}."""
+    ambiente = dict(os.environ, ESTOQUE_SECRET_KEY="medicao")  # não grava instance/secret_key
+    saida = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                           cwd=RAIZ, env=ambiente, capture_output=True, text=True, check=True).stderr
+    modulos = {}
+    for linha in saida.splitlines():
+        if not linha.startswith("import time:") or "self [us]" in linha:
+            continue
+        proprio, acumulado, nome = linha[len("import time:"):].split("|")
+        modulos[nome.strip()] = (int(proprio), int(acumulado))
+    return modulos
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orcamento-ms", type=int, default=ORCAMENTO_PADRAO_MS)
+    parser.add_argument("--repeticoes", type=int, default=5)
+    args = parser.parse_args()
+
+    medidas = [medir() for _ in range(args.repeticoes)]
+    melhor = min(medidas, key=lambda modulos: modulos["app"][1])
+    total_ms = melhor["app"][1] / 1000
+
+    print("Módulos mais lentos (acumulado, ms):")
+    for nome, (_, acumulado) in sorted(melhor.items(), key=lambda item: -item[1][1])[:10]:
+        print(f"  {acumulado / 1000:>8.1f}  {nome}")
+    print(f"\nimport app: {total_ms:.1f} ms (orçamento: {args.orcamento_ms} ms)")
+
+    falhas = []
+    carregados = sorted(nome for nome in PESADOS if nome in melhor)
+    if carregados:
+        falhas.append(f"dependências pesadas importadas na inicialização: {', '.join(carregados)}")
+    if total_ms > args.orcamento_ms:
+        falhas.append(f"importação levou {total_ms:.1f} ms, acima do orçamento de {args.orcamento_ms} ms")
+    for falha in falhas:
+        print(f"FALHA: {falha}")
+    sys.exit(1 if falhas else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,405 @@
 # database.py
+import os
+import re
+import sys
+import queue
 import sqlite3
 import logging
+import functools
+import contextlib
+import threading
 
 DB_NAME = "estoque.db"
 
+# Quantidade máxima de conexões ociosas mantidas no pool de cada banco.
+POOL_TAMANHO = int(os.environ.get("ESTOQUE_POOL_TAMANHO", 8))
+
+# Tempo (ms) que uma conexão aguarda um lock antes de falhar com "database is locked".
+BUSY_TIMEOUT_MS = int(os.environ.get("ESTOQUE_BUSY_TIMEOUT_MS", 5000))
+
+# Com a fila ativa, as escritas de movimentação passam pelo escritor único do processo.
+FILA_ESCRITA_ATIVA = os.environ.get("ESTOQUE_FILA_ESCRITA", "1") != "0"
+
+# Número máximo de escritas agrupadas num mesmo commit pelo escritor único.
+LOTE_ESCRITA_MAXIMO = int(os.environ.get("ESTOQUE_LOTE_ESCRITA", 64))
+
+# PRAGMAs aplicados uma única vez, quando a conexão física é aberta.
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",  # leitores não bloqueiam o escritor (e vice-versa)
+    "PRAGMA cache_size = -8000",  # ~8 MB de cache de páginas por conexão
+    "PRAGMA temp_store = MEMORY",
+)
+
+_pools = {}
+_pools_lock = threading.Lock()
+_local = threading.local()
+
+
+class ConexaoPool:
+    """
+    Representa uma conexão emprestada do pool.
+    Repassa tudo para a conexão sqlite3 real, mas `close()` a devolve ao pool
+    (ou ao escopo da requisição) em vez de fechá-la de fato.
+    """
+
+    def __init__(self, conn, devolver=None):
+        self._conn = conn
+        self._devolver = devolver
+        self._fechada = False
+
+    def __getattr__(self, nome):
+        return getattr(self._conn, nome)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        return self._conn.__exit__(*args)
+
+    def close(self):
+        # Idempotente: algumas funções fecham a conexão mais de uma vez.
+        if self._fechada:
+            return
+        self._fechada = True
+        if self._devolver:
+            self._devolver(self._conn)
+        elif self._conn.in_transaction:
+            # Conexão do escopo: segue em uso pela requisição, mas uma transação deixada aberta
+            # (ex.: um INSERT que falhou) é desfeita, como no close() do sqlite3. Sem isso, ela
+            # manteria o lock de escrita até o fim da requisição.
+            self._conn.rollback()
+
+
+def _nova_conexao(caminho):
+    """Abre uma conexão física e aplica os PRAGMAs de configuração."""
+    # check_same_thread=False: a conexão pode ser devolvida ao pool por uma thread e reutilizada por outra.
+    conn = sqlite3.connect(caminho, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    conn.row_factory = sqlite3.Row  # Permite acessar colunas pelo nome
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _get_pool(caminho):
+    with _pools_lock:
+        pool = _pools.get(caminho)
+        if pool is None:
+            pool = _pools[caminho] = queue.LifoQueue(maxsize=POOL_TAMANHO)
+        return pool
+
+
+def _retirar_do_pool(caminho):
+    try:
+        return _get_pool(caminho).get_nowait()
+    except queue.Empty:
+        return _nova_conexao(caminho)
+
+
+def _devolver_ao_pool(caminho, conn):
+    # Uma transação deixada aberta é descartada, como aconteceria ao fechar a conexão.
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _get_pool(caminho).put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+
+def fechar_pool():
+    """Fecha todas as conexões ociosas (ex.: ao encerrar o servidor ou trocar de banco)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        while True:
+            try:
+                pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def abrir_escopo():
+    """
+    Inicia um escopo (ex.: uma requisição Flask) na thread atual.
+    Dentro dele, todas as chamadas a conectar_bd() recebem a mesma conexão.
+    """
+    _local.escopo = {"caminho": None, "conn": None}
+
+
+def encerrar_escopo():
+    """
+    Encerra o escopo da thread atual e devolve a conexão compartilhada ao pool
+    (_devolver_ao_pool desfaz antes uma transação que tenha ficado aberta).
+    """
+    escopo = getattr(_local, "escopo", None)
+    _local.escopo = None
+    if escopo and escopo["conn"] is not None:
+        _devolver_ao_pool(escopo["caminho"], escopo["conn"])
+
+
+class _ConexaoTransacao(ConexaoPool):
+    """
+    Conexão entregue dentro de uma unidade de trabalho (ver `transacao()`).
+    O commit é feito pela unidade, ao final: `commit()` não faz nada e `rollback()` marca a
+    unidade inteira para ser desfeita. `close()` também não devolve a conexão.
+    """
+
+    def __init__(self, unidade):
+        super().__init__(unidade.conn)
+        self._unidade = unidade
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self._unidade.desfeita = True
+
+    def close(self):
+        # A transação é da unidade: não é desfeita aqui, como no close() do escopo.
+        self._fechada = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, rastro):
+        if tipo is not None:
+            self._unidade.desfeita = True
+        return False
+
+
+class _UnidadeDeTrabalho:
+    def __init__(self, conn):
+        self.conn = conn
+        self.desfeita = False
+
+    def executar(self, operacao):
+        """Executa `operacao(cursor)` num savepoint da unidade (mesma semântica de executar_escrita)."""
+        self.conn.execute("SAVEPOINT escrita")
+        try:
+            resultado = operacao(self.conn.cursor())
+        except Exception:
+            self.conn.execute("ROLLBACK TO escrita")
+            raise
+        finally:
+            self.conn.execute("RELEASE escrita")
+        return resultado
+
+
+def transacao_ativa():
+    """Indica se a thread atual está dentro de uma unidade de trabalho."""
+    return getattr(_local, "unidade", None) is not None
+
+
+@contextlib.contextmanager
+def transacao():
+    """
+    Unidade de trabalho: uma operação de negócio = uma conexão, um BEGIN IMMEDIATE e um commit.
+    Dentro do bloco, conectar_bd(), executar_escrita() e registrar_log() usam a mesma transação,
+    então funções que hoje fazem commit por conta própria podem ser encadeadas sem estados pela
+    metade. Uma exceção (ou um `rollback()` de qualquer função chamada) desfaz tudo. Blocos
+    aninhados participam da unidade já aberta.
+
+        with transacao() as conn:
+            conn.execute(...)
+    """
+    unidade = getattr(_local, "unidade", None)
+    if unidade is not None:
+        try:
+            yield _ConexaoTransacao(unidade)
+        except BaseException:
+            unidade.desfeita = True
+            raise
+        return
+
+    # Dentro de um escopo de requisição, a unidade usa a conexão do próprio escopo.
+    escopo = getattr(_local, "escopo", None)
+    if escopo is not None:
+        if escopo["conn"] is None:
+            escopo["caminho"] = DB_NAME
+            escopo["conn"] = _retirar_do_pool(DB_NAME)
+        conn, caminho = escopo["conn"], None
+    else:
+        caminho = DB_NAME
+        conn = _retirar_do_pool(caminho)
+
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        unidade = _local.unidade = _UnidadeDeTrabalho(conn)
+        try:
+            yield _ConexaoTransacao(unidade)
+        except BaseException:
+            conn.rollback()
+            raise
+        if unidade.desfeita:
+            conn.rollback()
+        else:
+            conn.commit()
+    finally:
+        _local.unidade = None
+        if conn.in_transaction:
+            conn.rollback()
+        if caminho is not None:
+            _devolver_ao_pool(caminho, conn)
+
+
 def conectar_bd():
-    """Conecta ao banco de dados SQLite e retorna a conexão e o cursor."""
+    """Conecta ao banco de dados SQLite e retorna a conexão (reaproveitada do pool)."""
     try:
-        conn = sqlite3.connect(DB_NAME)
-        conn.row_factory = sqlite3.Row  # Permite acessar colunas pelo nome
-        return conn
+        unidade = getattr(_local, "unidade", None)
+        if unidade is not None:
+            return _ConexaoTransacao(unidade)
+
+        escopo = getattr(_local, "escopo", None)
+        if escopo is not None:
+            if escopo["conn"] is None:
+                escopo["caminho"] = DB_NAME
+                escopo["conn"] = _retirar_do_pool(DB_NAME)
+            # O escopo é dono da conexão: close() das funções chamadas não a devolve.
+            return ConexaoPool(escopo["conn"])
+
+        caminho = DB_NAME
+        conn = _retirar_do_pool(caminho)
+        return ConexaoPool(conn, lambda c: _devolver_ao_pool(caminho, c))
     except sqlite3.Error as e:
         logging.error(f"Erro ao conectar ao banco de dados: {e}")
         return None
 
+class _TarefaEscrita:
+    def __init__(self, caminho, operacao):
+        self.caminho = caminho
+        self.operacao = operacao
+        self.resultado = None
+        self.erro = None
+        self.concluida = threading.Event()
+
+
+class FilaEscrita:
+    """
+    Escritor único do processo. As operações enfileiradas são executadas em ordem
+    por uma thread dedicada; as que chegam enquanto um commit está em andamento são
+    agrupadas na transação seguinte (group commit), custando um único fsync.
+    """
+
+    def __init__(self, lote_maximo=LOTE_ESCRITA_MAXIMO):
+        self.lote_maximo = lote_maximo
+        self._fila = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def executar(self, operacao):
+        """Enfileira `operacao(cursor)`, aguarda sua execução e retorna o resultado."""
+        tarefa = _TarefaEscrita(DB_NAME, operacao)
+        self._iniciar()
+        self._fila.put(tarefa)
+        tarefa.concluida.wait()
+        if tarefa.erro is not None:
+            raise tarefa.erro
+        return tarefa.resultado
+
+    def _iniciar(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="escritor-estoque", daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            lote = [self._fila.get()]
+            while len(lote) < self.lote_maximo:
+                try:
+                    lote.append(self._fila.get_nowait())
+                except queue.Empty:
+                    break
+            # Tarefas de bancos diferentes (ex.: testes trocando DB_NAME) não compartilham transação.
+            por_banco = {}
+            for tarefa in lote:
+                por_banco.setdefault(tarefa.caminho, []).append(tarefa)
+            for caminho, tarefas in por_banco.items():
+                self._processar(caminho, tarefas)
+
+    def _processar(self, caminho, tarefas):
+        conn = None
+        try:
+            conn = _retirar_do_pool(caminho)
+            conn.execute("BEGIN IMMEDIATE")
+            for tarefa in tarefas:
+                # Cada operação roda num savepoint: uma falha desfaz só a própria operação.
+                conn.execute("SAVEPOINT tarefa")
+                try:
+                    tarefa.resultado = tarefa.operacao(conn.cursor())
+                except Exception as e:
+                    tarefa.erro = e
+                    conn.execute("ROLLBACK TO tarefa")
+                conn.execute("RELEASE tarefa")
+            conn.commit()
+        except Exception as e:
+            logging.error(f"Erro no commit do lote de escrita: {e}")
+            if conn is not None and conn.in_transaction:
+                conn.rollback()
+            for tarefa in tarefas:
+                tarefa.resultado = None
+                tarefa.erro = tarefa.erro or e
+        finally:
+            if conn is not None:
+                _devolver_ao_pool(caminho, conn)
+            for tarefa in tarefas:
+                tarefa.concluida.set()
+
+
+_fila_escrita = FilaEscrita()
+
+# Conexões herdadas de um processo pai; mantidas sem uso nem close() (ver _reiniciar_apos_fork).
+_herdadas = []
+
+
+def _reiniciar_apos_fork():
+    """
+    No processo filho (ex.: um worker do gunicorn), descarta o que foi herdado do pai: uma conexão
+    SQLite não pode ser usada dos dois lados de um fork, e as threads do pai (escritor único) não
+    existem no filho. As conexões herdadas não são fechadas, para não interferir nos arquivos do pai.
+    """
+    global _pools_lock, _local, _fila_escrita
+    _herdadas.extend(_pools.values())
+    _pools.clear()
+    _pools_lock = threading.Lock()
+    _local = threading.local()
+    _fila_escrita = FilaEscrita()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reiniciar_apos_fork)
+
+
+def executar_escrita(operacao):
+    """
+    Executa `operacao(cursor)` numa transação de escrita e retorna o seu resultado.
+    Exceções levantadas pela operação desfazem apenas as alterações dela e são repassadas.
+    Dentro de uma unidade de trabalho, a operação roda na transação da unidade, sem passar pela fila.
+    """
+    unidade = getattr(_local, "unidade", None)
+    if unidade is not None:
+        return unidade.executar(operacao)
+
+    if FILA_ESCRITA_ATIVA:
+        return _fila_escrita.executar(operacao)
+
+    conn = conectar_bd()
+    if not conn:
+        raise sqlite3.OperationalError("Falha na conexão com o banco de dados.")
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        resultado = operacao(conn.cursor())
+        conn.commit()
+        return resultado
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
 def criar_tabelas():
     """Cria as tabelas iniciais do banco de dados se não existirem."""
     conn = conectar_bd()
@@ -114,7 +500,441 @@ def criar_tabelas():
     conn.commit()
     conn.close()
 
+    aplicar_migracoes()
+
+def _preencher_obra_pedido_movimentacoes(cursor):
+    """Preenche obra_id/pedido_id das movimentações antigas a partir do texto da observação."""
+    cursor.execute("SELECT id, obra_id FROM pedidos")
+    obra_do_pedido = {row['id']: row['obra_id'] for row in cursor.fetchall()}
+    # Nomes mais longos primeiro, para "Obra: Casa 10" não casar com a obra "Casa 1".
+    cursor.execute("SELECT id, nome FROM obras")
+    obras = sorted(((row['nome'], row['id']) for row in cursor.fetchall()), key=lambda o: len(o[0]), reverse=True)
+
+    # Observações geradas por aprovar_pedido: "Obra: <nome> (Pedido #<id>)" e "Ref. Pedido Aprovado #<id>".
+    padrao_pedido = re.compile(r"Pedido(?: Aprovado)? #(\d+)")
+    cursor.execute("SELECT id, observacao FROM movimentacoes WHERE observacao LIKE '%Pedido%#%' OR observacao LIKE 'Obra: %'")
+    atualizacoes = []
+    for mov in cursor.fetchall():
+        obra_id = pedido_id = None
+        encontrado = padrao_pedido.search(mov['observacao'])
+        if encontrado and int(encontrado.group(1)) in obra_do_pedido:
+            pedido_id = int(encontrado.group(1))
+            obra_id = obra_do_pedido[pedido_id]
+        if obra_id is None and mov['observacao'].startswith("Obra: "):
+            obra_id = next((id_obra for nome, id_obra in obras if mov['observacao'].startswith(f"Obra: {nome}")), None)
+        if obra_id is not None or pedido_id is not None:
+            atualizacoes.append((obra_id, pedido_id, mov['id']))
+
+    cursor.executemany("UPDATE movimentacoes SET obra_id = ?, pedido_id = ? WHERE id = ?", atualizacoes)
+
+# Migrações do esquema, em ordem. A versão aplicada fica gravada em PRAGMA user_version.
+# Cada migração é (versão, descrição, passos); um passo é um comando SQL ou uma função que recebe o cursor.
+MIGRACOES = [
+    (1, "Índices das consultas de relatórios, pedidos e auditoria", [
+        "CREATE INDEX IF NOT EXISTS idx_movimentacoes_data ON movimentacoes (data)",
+        "CREATE INDEX IF NOT EXISTS idx_movimentacoes_item_tipo ON movimentacoes (item_id, tipo)",
+        "CREATE INDEX IF NOT EXISTS idx_pedidos_status_data ON pedidos (status, data_solicitacao)",
+        "CREATE INDEX IF NOT EXISTS idx_pedidos_solicitante ON pedidos (solicitante_id, data_solicitacao)",
+        "CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs_auditoria (timestamp)",
+    ]),
+    (2, "Obra e pedido de origem nas movimentações", [
+        "ALTER TABLE movimentacoes ADD COLUMN obra_id INTEGER REFERENCES obras (id)",
+        "ALTER TABLE movimentacoes ADD COLUMN pedido_id INTEGER REFERENCES pedidos (id)",
+        _preencher_obra_pedido_movimentacoes,
+        "CREATE INDEX IF NOT EXISTS idx_movimentacoes_obra ON movimentacoes (obra_id, tipo, data)",
+        "CREATE INDEX IF NOT EXISTS idx_movimentacoes_pedido ON movimentacoes (pedido_id)",
+    ]),
+    (3, "Contadores mantidos por triggers (total de movimentações)", [
+        """CREATE TABLE IF NOT EXISTS contadores (
+            nome TEXT PRIMARY KEY,
+            valor NUMERIC NOT NULL DEFAULT 0
+        )""",
+        "INSERT OR REPLACE INTO contadores (nome, valor) SELECT 'movimentacoes', COUNT(*) FROM movimentacoes",
+        """CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_contador_ins AFTER INSERT ON movimentacoes
+        BEGIN
+            UPDATE contadores SET valor = valor + 1 WHERE nome = 'movimentacoes';
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_contador_del AFTER DELETE ON movimentacoes
+        BEGIN
+            UPDATE contadores SET valor = valor - 1 WHERE nome = 'movimentacoes';
+        END""",
+    ]),
+    (4, "Tarefas em segundo plano (exportações)", [
+        """CREATE TABLE IF NOT EXISTS tarefas (
+            id TEXT PRIMARY KEY,
+            tipo TEXT NOT NULL,
+            parametros TEXT,
+            status TEXT NOT NULL DEFAULT 'pendente' CHECK(status IN ('pendente', 'executando', 'concluida', 'erro', 'expirada')),
+            progresso INTEGER NOT NULL DEFAULT 0,
+            usuario_id INTEGER,
+            arquivo TEXT,
+            nome_arquivo TEXT,
+            mimetype TEXT,
+            erro TEXT,
+            criada_em DATETIME DEFAULT CURRENT_TIMESTAMP,
+            iniciada_em DATETIME,
+            concluida_em DATETIME,
+            expira_em DATETIME,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_tarefas_status_expiracao ON tarefas (status, expira_em)",
+    ]),
+    (5, "Resumos de movimentações por tipo e por item/tipo", [
+        """CREATE TABLE IF NOT EXISTS resumo_movimentacoes_tipo (
+            tipo TEXT PRIMARY KEY,
+            total_movimentacoes INTEGER NOT NULL DEFAULT 0,
+            quantidade_total INTEGER NOT NULL DEFAULT 0
+        )""",
+        """CREATE TABLE IF NOT EXISTS resumo_movimentacoes_item (
+            item_id INTEGER NOT NULL,
+            tipo TEXT NOT NULL,
+            total_movimentacoes INTEGER NOT NULL DEFAULT 0,
+            quantidade_total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (item_id, tipo)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_resumo_item_tipo_quantidade ON resumo_movimentacoes_item (tipo, quantidade_total)",
+        lambda cursor: _recalcular_resumos(cursor, ("resumo_movimentacoes_tipo", "resumo_movimentacoes_item")),
+        """CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_resumo_ins AFTER INSERT ON movimentacoes
+        BEGIN
+            INSERT INTO resumo_movimentacoes_tipo (tipo, total_movimentacoes, quantidade_total)
+            VALUES (NEW.tipo, 1, NEW.quantidade)
+            ON CONFLICT (tipo) DO UPDATE SET total_movimentacoes = total_movimentacoes + 1,
+                                             quantidade_total = quantidade_total + excluded.quantidade_total;
+            INSERT INTO resumo_movimentacoes_item (item_id, tipo, total_movimentacoes, quantidade_total)
+            VALUES (NEW.item_id, NEW.tipo, 1, NEW.quantidade)
+            ON CONFLICT (item_id, tipo) DO UPDATE SET total_movimentacoes = total_movimentacoes + 1,
+                                                      quantidade_total = quantidade_total + excluded.quantidade_total;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_resumo_del AFTER DELETE ON movimentacoes
+        BEGIN
+            UPDATE resumo_movimentacoes_tipo
+            SET total_movimentacoes = total_movimentacoes - 1, quantidade_total = quantidade_total - OLD.quantidade
+            WHERE tipo = OLD.tipo;
+            UPDATE resumo_movimentacoes_item
+            SET total_movimentacoes = total_movimentacoes - 1, quantidade_total = quantidade_total - OLD.quantidade
+            WHERE item_id = OLD.item_id AND tipo = OLD.tipo;
+        END""",
+    ]),
+    (6, "Resumo diário de movimentações por item e tipo", [
+        """CREATE TABLE IF NOT EXISTS resumo_movimentacoes_diario (
+            dia TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            tipo TEXT NOT NULL,
+            total_movimentacoes INTEGER NOT NULL DEFAULT 0,
+            quantidade_total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dia, item_id, tipo)
+        )""",
+        lambda cursor: _recalcular_resumos(cursor, ("resumo_movimentacoes_diario",)),
+        """CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_diario_ins AFTER INSERT ON movimentacoes
+        BEGIN
+            INSERT INTO resumo_movimentacoes_diario (dia, item_id, tipo, total_movimentacoes, quantidade_total)
+            VALUES (DATE(NEW.data, 'localtime'), NEW.item_id, NEW.tipo, 1, NEW.quantidade)
+            ON CONFLICT (dia, item_id, tipo) DO UPDATE SET total_movimentacoes = total_movimentacoes + 1,
+                                                           quantidade_total = quantidade_total + excluded.quantidade_total;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_diario_del AFTER DELETE ON movimentacoes
+        BEGIN
+            UPDATE resumo_movimentacoes_diario
+            SET total_movimentacoes = total_movimentacoes - 1, quantidade_total = quantidade_total - OLD.quantidade
+            WHERE dia = DATE(OLD.data, 'localtime') AND item_id = OLD.item_id AND tipo = OLD.tipo;
+        END""",
+    ]),
+    (7, "Valor total do estoque mantido por triggers", [
+        """INSERT OR REPLACE INTO contadores (nome, valor)
+           SELECT 'valor_estoque', COALESCE(SUM(quantidade * preco_unitario), 0) FROM itens_estoque""",
+        """CREATE TRIGGER IF NOT EXISTS trg_itens_valor_ins AFTER INSERT ON itens_estoque
+        BEGIN
+            UPDATE contadores SET valor = valor + NEW.quantidade * COALESCE(NEW.preco_unitario, 0)
+            WHERE nome = 'valor_estoque';
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_itens_valor_upd AFTER UPDATE OF quantidade, preco_unitario ON itens_estoque
+        BEGIN
+            UPDATE contadores SET valor = valor + NEW.quantidade * COALESCE(NEW.preco_unitario, 0)
+                                                - OLD.quantidade * COALESCE(OLD.preco_unitario, 0)
+            WHERE nome = 'valor_estoque';
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_itens_valor_del AFTER DELETE ON itens_estoque
+        BEGIN
+            UPDATE contadores SET valor = valor - OLD.quantidade * COALESCE(OLD.preco_unitario, 0)
+            WHERE nome = 'valor_estoque';
+        END""",
+    ]),
+    (8, "Contador de pedidos pendentes mantido por triggers", [
+        "INSERT OR REPLACE INTO contadores (nome, valor) SELECT 'pedidos_pendentes', COUNT(*) FROM pedidos WHERE status = 'pendente'",
+        """CREATE TRIGGER IF NOT EXISTS trg_pedidos_pendentes_ins AFTER INSERT ON pedidos WHEN NEW.status = 'pendente'
+        BEGIN
+            UPDATE contadores SET valor = valor + 1 WHERE nome = 'pedidos_pendentes';
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_pedidos_pendentes_upd AFTER UPDATE OF status ON pedidos
+        WHEN (OLD.status = 'pendente') <> (NEW.status = 'pendente')
+        BEGIN
+            UPDATE contadores SET valor = valor + (CASE WHEN NEW.status = 'pendente' THEN 1 ELSE -1 END)
+            WHERE nome = 'pedidos_pendentes';
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_pedidos_pendentes_del AFTER DELETE ON pedidos WHEN OLD.status = 'pendente'
+        BEGIN
+            UPDATE contadores SET valor = valor - 1 WHERE nome = 'pedidos_pendentes';
+        END""",
+    ]),
+    (9, "Versão do catálogo (itens e descrições) mantida por triggers", [
+        "INSERT OR REPLACE INTO contadores (nome, valor) VALUES ('versao_catalogo', 1)",
+        "INSERT OR REPLACE INTO contadores (nome, valor) VALUES ('catalogo_modificado_em', CAST(strftime('%s', 'now') AS INTEGER))",
+        """CREATE TRIGGER IF NOT EXISTS trg_itens_estoque_catalogo_ins AFTER INSERT ON itens_estoque
+        BEGIN
+            UPDATE contadores SET valor = CASE nome WHEN 'versao_catalogo' THEN valor + 1
+                                                   ELSE CAST(strftime('%s', 'now') AS INTEGER) END
+            WHERE nome IN ('versao_catalogo', 'catalogo_modificado_em');
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_itens_estoque_catalogo_upd AFTER UPDATE ON itens_estoque
+        BEGIN
+            UPDATE contadores SET valor = CASE nome WHEN 'versao_catalogo' THEN valor + 1
+                                                   ELSE CAST(strftime('%s', 'now') AS INTEGER) END
+            WHERE nome IN ('versao_catalogo', 'catalogo_modificado_em');
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_itens_estoque_catalogo_del AFTER DELETE ON itens_estoque
+        BEGIN
+            UPDATE contadores SET valor = CASE nome WHEN 'versao_catalogo' THEN valor + 1
+                                                   ELSE CAST(strftime('%s', 'now') AS INTEGER) END
+            WHERE nome IN ('versao_catalogo', 'catalogo_modificado_em');
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_descricoes_catalogo_ins AFTER INSERT ON descricoes
+        BEGIN
+            UPDATE contadores SET valor = CASE nome WHEN 'versao_catalogo' THEN valor + 1
+                                                   ELSE CAST(strftime('%s', 'now') AS INTEGER) END
+            WHERE nome IN ('versao_catalogo', 'catalogo_modificado_em');
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_descricoes_catalogo_upd AFTER UPDATE ON descricoes
+        BEGIN
+            UPDATE contadores SET valor = CASE nome WHEN 'versao_catalogo' THEN valor + 1
+                                                   ELSE CAST(strftime('%s', 'now') AS INTEGER) END
+            WHERE nome IN ('versao_catalogo', 'catalogo_modificado_em');
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_descricoes_catalogo_del AFTER DELETE ON descricoes
+        BEGIN
+            UPDATE contadores SET valor = CASE nome WHEN 'versao_catalogo' THEN valor + 1
+                                                   ELSE CAST(strftime('%s', 'now') AS INTEGER) END
+            WHERE nome IN ('versao_catalogo', 'catalogo_modificado_em');
+        END""",
+    ]),
+    (10, "Índice de busca textual (FTS5) de itens e índice por quantidade", [
+        """CREATE VIRTUAL TABLE IF NOT EXISTS itens_busca USING fts5(
+            nome, descricao, tokenize = 'unicode61 remove_diacritics 2'
+        )""",
+        """INSERT INTO itens_busca (rowid, nome, descricao)
+           SELECT i.id, i.nome, d.nome FROM itens_estoque i LEFT JOIN descricoes d ON i.descricao_id = d.id""",
+        """CREATE TRIGGER IF NOT EXISTS trg_itens_busca_ins AFTER INSERT ON itens_estoque
+        BEGIN
+            INSERT INTO itens_busca (rowid, nome, descricao)
+            VALUES (NEW.id, NEW.nome, (SELECT nome FROM descricoes WHERE id = NEW.descricao_id));
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_itens_busca_upd AFTER UPDATE OF nome, descricao_id ON itens_estoque
+        BEGIN
+            DELETE FROM itens_busca WHERE rowid = OLD.id;
+            INSERT INTO itens_busca (rowid, nome, descricao)
+            VALUES (NEW.id, NEW.nome, (SELECT nome FROM descricoes WHERE id = NEW.descricao_id));
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_itens_busca_del AFTER DELETE ON itens_estoque
+        BEGIN
+            DELETE FROM itens_busca WHERE rowid = OLD.id;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_descricoes_busca_upd AFTER UPDATE OF nome ON descricoes
+        BEGIN
+            UPDATE itens_busca SET descricao = NEW.nome
+            WHERE rowid IN (SELECT id FROM itens_estoque WHERE descricao_id = NEW.id);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_descricoes_busca_del AFTER DELETE ON descricoes
+        BEGIN
+            UPDATE itens_busca SET descricao = NULL
+            WHERE rowid IN (SELECT id FROM itens_estoque WHERE descricao_id = OLD.id);
+        END""",
+        "CREATE INDEX IF NOT EXISTS idx_itens_quantidade ON itens_estoque (quantidade)",
+    ]),
+]
+
+# Tabelas de resumo mantidas por triggers e a consulta que recalcula cada uma do zero
+# (as colunas da consulta seguem a ordem das colunas da tabela).
+RESUMOS = {
+    "resumo_movimentacoes_tipo": "SELECT tipo, COUNT(*), SUM(quantidade) FROM movimentacoes GROUP BY tipo",
+    "resumo_movimentacoes_item": "SELECT item_id, tipo, COUNT(*), SUM(quantidade) FROM movimentacoes GROUP BY item_id, tipo",
+    "resumo_movimentacoes_diario": """SELECT DATE(data, 'localtime'), item_id, tipo, COUNT(*), SUM(quantidade)
+                                      FROM movimentacoes GROUP BY DATE(data, 'localtime'), item_id, tipo""",
+}
+
+def _recalcular_resumos(cursor, tabelas):
+    """Recalcula as tabelas de resumo informadas a partir de movimentacoes (sem commit)."""
+    for tabela in tabelas:
+        cursor.execute(f"DELETE FROM {tabela}")
+        cursor.execute(f"INSERT INTO {tabela} {RESUMOS[tabela]}")
+
+def reconstruir_resumos():
+    """
+    Recalcula do zero os resumos e os contadores de movimentações e de pedidos pendentes, numa única transação.
+    Retorna, por tabela, quantas linhas divergiam do recálculo (0 = resumo consistente).
+    """
+    conn = conectar_bd()
+    if not conn:
+        return None
+
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.cursor()
+        divergencias = {}
+        for tabela, consulta in RESUMOS.items():
+            # Linhas zeradas (de movimentações excluídas) não contam como divergência
+            armazenado = f"SELECT * FROM {tabela} WHERE total_movimentacoes <> 0"
+            cursor.execute(f"SELECT COUNT(*) FROM ({armazenado} EXCEPT {consulta})")
+            divergentes = cursor.fetchone()[0]
+            cursor.execute(f"SELECT COUNT(*) FROM ({consulta} EXCEPT {armazenado})")
+            divergencias[tabela] = divergentes + cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM movimentacoes")
+        total = cursor.fetchone()[0]
+        divergencias["contadores"] = int(ler_contador(cursor, 'movimentacoes') != total)
+        cursor.execute("SELECT COUNT(*) FROM pedidos WHERE status = 'pendente'")
+        pendentes = cursor.fetchone()[0]
+        divergencias["contadores"] += int(ler_contador(cursor, 'pedidos_pendentes') != pendentes)
+
+        _recalcular_resumos(cursor, RESUMOS)
+        cursor.execute("UPDATE contadores SET valor = ? WHERE nome = 'movimentacoes'", (total,))
+        cursor.execute("UPDATE contadores SET valor = ? WHERE nome = 'pedidos_pendentes'", (pendentes,))
+        conn.commit()
+        return divergencias
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def ler_contador(cursor, nome):
+    """Lê um valor da tabela `contadores` (mantida por triggers)."""
+    cursor.execute("SELECT valor FROM contadores WHERE nome = ?", (nome,))
+    row = cursor.fetchone()
+    return row['valor'] if row else 0
+
+# Diferença abaixo da qual o valor acumulado é considerado igual ao recalculado (arredondamento de REAL)
+TOLERANCIA_VALOR_ESTOQUE = 0.005
+
+def verificar_valor_estoque():
+    """
+    Recalcula o valor total do estoque e corrige o contador 'valor_estoque' se ele tiver divergido.
+    Retorna a diferença encontrada (0.0 = consistente).
+    """
+    conn = conectar_bd()
+    if not conn:
+        return None
+
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(SUM(quantidade * preco_unitario), 0) FROM itens_estoque")
+        recalculado = cursor.fetchone()[0]
+        diferenca = float(ler_contador(cursor, 'valor_estoque')) - recalculado
+        if abs(diferenca) < TOLERANCIA_VALOR_ESTOQUE:
+            conn.rollback()
+            return 0.0
+        cursor.execute("UPDATE contadores SET valor = ? WHERE nome = 'valor_estoque'", (recalculado,))
+        conn.commit()
+        logging.warning(f"Valor do estoque divergia em {diferenca:.2f}; contador corrigido.")
+        return diferenca
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def versao_catalogo():
+    """
+    Retorna (versão, modificado_em) do catálogo. A versão muda a cada escrita em itens_estoque
+    ou descricoes (inclusive movimentações de estoque); modificado_em é um timestamp Unix.
+    """
+    conn = conectar_bd()
+    if not conn:
+        return None, None
+    cursor = conn.cursor()
+    cursor.execute("SELECT nome, valor FROM contadores WHERE nome IN ('versao_catalogo', 'catalogo_modificado_em')")
+    valores = {row['nome']: row['valor'] for row in cursor.fetchall()}
+    conn.close()
+    return valores.get('versao_catalogo'), valores.get('catalogo_modificado_em')
+
+def cache_por_versao(contador):
+    """
+    Decorador: guarda em memória o resultado da função, por argumentos, enquanto o valor do
+    contador `contador` não mudar. Como a versão é lida do banco a cada chamada, o cache continua
+    correto com vários processos. O resultado é compartilhado entre as chamadas: não o modifique.
+    """
+    def decorador(funcao):
+        cache = {}
+        lock = threading.Lock()
+
+        @functools.wraps(funcao)
+        def envoltorio(*args):
+            # Numa unidade de trabalho ainda sem commit, a versão lida pode ser desfeita: não usa o cache.
+            if transacao_ativa():
+                return funcao(*args)
+            conn = conectar_bd()
+            if not conn:
+                return funcao(*args)
+            # A versão é lida antes dos dados: no pior caso guarda-se um dado mais novo que a versão,
+            # o que só causa uma nova consulta na próxima chamada.
+            versao = ler_contador(conn.cursor(), contador)
+            conn.close()
+
+            chave = (DB_NAME, args)
+            with lock:
+                guardado = cache.get(chave)
+            if guardado and guardado[0] == versao:
+                return guardado[1]
+            resultado = funcao(*args)
+            with lock:
+                cache[chave] = (versao, resultado)
+            return resultado
+
+        envoltorio.limpar_cache = cache.clear
+        return envoltorio
+    return decorador
+
+def versao_esquema(conn):
+    """Retorna a versão do esquema gravada no banco."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def aplicar_migracoes():
+    """Aplica as migrações pendentes, cada uma em sua própria transação."""
+    conn = conectar_bd()
+    if not conn:
+        return
+
+    try:
+        for versao, descricao, passos in MIGRACOES:
+            # BEGIN IMMEDIATE antes de reler a versão: outro processo pode ter migrado enquanto isso.
+            conn.execute("BEGIN IMMEDIATE")
+            if versao_esquema(conn) >= versao:
+                conn.rollback()
+                continue
+            cursor = conn.cursor()
+            for passo in passos:
+                if callable(passo):
+                    passo(cursor)
+                else:
+                    cursor.execute(passo)
+            cursor.execute(f"PRAGMA user_version = {int(versao)}")
+            conn.commit()
+            print(f"Migração {versao} aplicada: {descricao}")
+    except sqlite3.Error as e:
+        if conn.in_transaction:
+            conn.rollback()
+        logging.error(f"Erro ao aplicar migração: {e}")
+        raise
+    finally:
+        conn.close()
+
 if __name__ == '__main__':
     # Este bloco permite criar o banco de dados executando `python database.py`
     criar_tabelas()
     print(f"Banco de dados '{DB_NAME}' e tabelas foram criados/verificados.")
+
+    # `python database.py reconstruir` recalcula os resumos e informa se havia divergências
+    if len(sys.argv) > 1 and sys.argv[1] == 'reconstruir':
+        for tabela, divergentes in reconstruir_resumos().items():
+            situacao = "consistente" if divergentes == 0 else f"{divergentes} linha(s) divergente(s) corrigida(s)"
+            print(f"{tabela}: {situacao}")
+        diferenca = verificar_valor_estoque()
+        print("valor_estoque: " + ("consistente" if not diferenca else f"divergia em {diferenca:.2f}, corrigido"))
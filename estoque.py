@@ -1,38 +1,34 @@
 # estoque.py
 import sqlite3
-from database import conectar_bd
+from database import conectar_bd, executar_escrita, cache_por_versao, transacao
 from logs import registrar_log
 
 def criar_novo_item(nome, descricao_id, preco_unitario, quantidade, usuario_id):
     """Adiciona um novo item ao catálogo do estoque."""
-    conn = conectar_bd()
-    if not conn:
-        return False, "Falha na conexão com o banco de dados."
-
     try:
-        cursor = conn.cursor()
-        # 1. Insere o item com quantidade 0 para garantir que ele exista antes da movimentação.
-        cursor.execute(
-            "INSERT INTO itens_estoque (nome, descricao_id, preco_unitario, quantidade) VALUES (?, ?, ?, 0)",
-            (nome, descricao_id, preco_unitario)
-        )
-        item_id = cursor.lastrowid
-        registrar_log(usuario_id, "CADASTRO_ITEM", f"Item: {nome}, ID: {item_id}")
-
-        # 2. Se houver quantidade inicial, registra como uma movimentação de entrada.
-        if quantidade > 0:
-            conn.commit() # Comita a criação do item antes de chamar a outra função
-            conn.close()
-            # A função registrar_entrada já abre e fecha sua própria conexão.
-            return registrar_entrada(item_id, quantidade, usuario_id, "Entrada inicial de estoque.")
+        # Item, entrada inicial e logs numa única transação: não sobra item cadastrado sem a entrada.
+        with transacao() as conn:
+            cursor = conn.cursor()
+            # 1. Insere o item com quantidade 0 para garantir que ele exista antes da movimentação.
+            cursor.execute(
+                "INSERT INTO itens_estoque (nome, descricao_id, preco_unitario, quantidade) VALUES (?, ?, ?, 0)",
+                (nome, descricao_id, preco_unitario)
+            )
+            item_id = cursor.lastrowid
+            registrar_log(usuario_id, "CADASTRO_ITEM", f"Item: {nome}, ID: {item_id}")
+
+            # 2. Se houver quantidade inicial, registra como uma movimentação de entrada.
+            if quantidade > 0:
+                sucesso, msg = registrar_entrada(item_id, quantidade, usuario_id, "Entrada inicial de estoque.")
+                if not sucesso:
+                    conn.rollback()
+                return sucesso, msg
 
-        conn.commit()
         return True, f"Item '{nome}' cadastrado com sucesso."
     except sqlite3.IntegrityError:
         return False, f"Erro: O item '{nome}' já existe no catálogo."
-    finally:
-        if conn:
-            conn.close()
+    except sqlite3.Error as e:
+        return False, f"Erro ao cadastrar item: {e}"
 
 def get_item(item_id: int):
     """Busca um item do estoque pelo seu ID."""
@@ -46,67 +42,115 @@ def get_item(item_id: int):
 
 def atualizar_item(item_id: int, nome: str, descricao_id: int, preco_unitario: float, usuario_id: int):
     """Atualiza os dados de um item do estoque."""
-    conn = conectar_bd()
-    if not conn: return False, "Falha na conexão com o banco de dados."
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE itens_estoque SET nome = ?, descricao_id = ?, preco_unitario = ? WHERE id = ?",
-            (nome, descricao_id, preco_unitario, item_id)
-        )
-        conn.commit()
-        registrar_log(usuario_id, "ATUALIZAR_ITEM", f"Item ID: {item_id}, Novo Nome: {nome}")
+        with transacao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE itens_estoque SET nome = ?, descricao_id = ?, preco_unitario = ? WHERE id = ?",
+                (nome, descricao_id, preco_unitario, item_id)
+            )
+            registrar_log(usuario_id, "ATUALIZAR_ITEM", f"Item ID: {item_id}, Novo Nome: {nome}")
         return True, f"Item '{nome}' atualizado com sucesso."
     except sqlite3.IntegrityError:
         return False, f"O nome de item '{nome}' já está em uso."
     except Exception as e:
         return False, f"Erro ao atualizar item: {e}"
-    finally:
-        conn.close()
 
-def _modificar_estoque(item_id, quantidade, tipo_movimentacao, usuario_id, observacao=""):
-    """Função interna para registrar movimentação e atualizar quantidade."""
-    conn = conectar_bd()
-    if not conn: return False, "Falha na conexão com o banco de dados."
+def _aplicar_movimentacao(cursor, item_id, quantidade, tipo_movimentacao, usuario_id, observacao="", obra_id=None, pedido_id=None):
+    """Aplica a movimentação no cursor informado, sem commit. Retorna (sucesso, mensagem, novo_saldo)."""
+    if quantidade <= 0:
+        return False, "Erro: A quantidade da movimentação deve ser maior que zero.", None
 
-    try:
-        cursor = conn.cursor()
-        
-        # 1. Verificar se o item existe e obter a quantidade atual
-        cursor.execute("SELECT quantidade, nome FROM itens_estoque WHERE id = ?", (item_id,))
-        resultado = cursor.fetchone()
-        if not resultado:
-            return False, f"Erro: Item com ID {item_id} não encontrado."
-        
-        qtd_atual, nome_item = resultado
-
-        # 2. Calcular nova quantidade e validar
-        if tipo_movimentacao == 'saida':
-            if qtd_atual < quantidade:
-                return False, f"Erro: Estoque insuficiente para o item '{nome_item}'. Disponível: {qtd_atual}, Requisitado: {quantidade}"
-            nova_quantidade = qtd_atual - quantidade
-        else: # entrada ou compra
-            nova_quantidade = qtd_atual + quantidade
-
-        # 3. Atualizar a quantidade na tabela de itens
-        cursor.execute("UPDATE itens_estoque SET quantidade = ? WHERE id = ?", (nova_quantidade, item_id))
-
-        # 4. Registrar a movimentação
+    # 1. Atualização relativa e condicional: a validação do saldo e a baixa acontecem num único
+    #    comando, sem janela entre a leitura e a escrita para outra transação interferir.
+    if tipo_movimentacao == 'saida':
         cursor.execute(
-            "INSERT INTO movimentacoes (item_id, tipo, quantidade, usuario_id, observacao) VALUES (?, ?, ?, ?, ?)",
-            (item_id, tipo_movimentacao, quantidade, usuario_id, observacao)
+            "UPDATE itens_estoque SET quantidade = quantidade - ? WHERE id = ? AND quantidade >= ? RETURNING quantidade, nome",
+            (quantidade, item_id, quantidade)
         )
-        
-        conn.commit()
-        mensagem = f"Movimentação '{tipo_movimentacao}' de {quantidade} unidade(s) do item '{nome_item}' registrada com sucesso."
-        registrar_log(usuario_id, f"MOVIMENTACAO_{tipo_movimentacao.upper()}", f"Item ID: {item_id}, Qtd: {quantidade}, Novo Saldo: {nova_quantidade}")
-        return True, mensagem
+    else: # entrada ou compra
+        cursor.execute(
+            "UPDATE itens_estoque SET quantidade = quantidade + ? WHERE id = ? RETURNING quantidade, nome",
+            (quantidade, item_id)
+        )
+    resultado = cursor.fetchone()
+
+    # 2. Nenhuma linha alterada: o item não existe ou o saldo é insuficiente
+    if not resultado:
+        cursor.execute("SELECT quantidade, nome FROM itens_estoque WHERE id = ?", (item_id,))
+        atual = cursor.fetchone()
+        if not atual:
+            return False, f"Erro: Item com ID {item_id} não encontrado.", None
+        return False, f"Erro: Estoque insuficiente para o item '{atual['nome']}'. Disponível: {atual['quantidade']}, Requisitado: {quantidade}", None
+
+    nova_quantidade, nome_item = resultado
+
+    # 3. Registrar a movimentação
+    cursor.execute(
+        "INSERT INTO movimentacoes (item_id, tipo, quantidade, usuario_id, observacao, obra_id, pedido_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (item_id, tipo_movimentacao, quantidade, usuario_id, observacao, obra_id, pedido_id)
+    )
+
+    mensagem = f"Movimentação '{tipo_movimentacao}' de {quantidade} unidade(s) do item '{nome_item}' registrada com sucesso."
+    return True, mensagem, nova_quantidade
 
+def _modificar_estoque(item_id, quantidade, tipo_movimentacao, usuario_id, observacao="", obra_id=None, pedido_id=None):
+    """Função interna para registrar movimentação e atualizar quantidade."""
+    try:
+        # A escrita passa pelo escritor único, que agrupa movimentações simultâneas num só commit.
+        sucesso, mensagem, nova_quantidade = executar_escrita(
+            lambda cursor: _aplicar_movimentacao(cursor, item_id, quantidade, tipo_movimentacao, usuario_id, observacao, obra_id, pedido_id)
+        )
     except Exception as e:
-        conn.rollback()
         return False, f"Erro ao modificar estoque: {e}"
-    finally:
-        conn.close()
+
+    if sucesso:
+        registrar_log(usuario_id, f"MOVIMENTACAO_{tipo_movimentacao.upper()}", f"Item ID: {item_id}, Qtd: {quantidade}, Novo Saldo: {nova_quantidade}")
+    return sucesso, mensagem
+
+# Número máximo de linhas aceitas num único romaneio
+LIMITE_LINHAS_ROMANEIO = 500
+
+class _RomaneioRecusado(Exception):
+    """Levantada dentro da escrita para desfazer o romaneio inteiro; carrega os erros por linha."""
+
+def registrar_romaneio(linhas, tipo_movimentacao, usuario_id, observacao=""):
+    """
+    Registra várias movimentações do mesmo tipo (ex.: a carga de um caminhão) numa única transação.
+    `linhas` é uma lista de (item_id, quantidade). Ou todas as linhas são aplicadas, ou nenhuma.
+    """
+    if tipo_movimentacao not in ('entrada', 'saida'):
+        return False, "Tipo de movimentação inválido."
+    if not linhas:
+        return False, "O romaneio não tem nenhuma linha."
+    if len(linhas) > LIMITE_LINHAS_ROMANEIO:
+        return False, f"O romaneio pode ter no máximo {LIMITE_LINHAS_ROMANEIO} linhas."
+
+    def aplicar(cursor):
+        # Todas as linhas são tentadas para que o usuário veja todos os problemas de uma vez;
+        # havendo qualquer erro, a exceção desfaz as linhas já aplicadas.
+        erros, total = [], 0
+        for numero, (item_id, quantidade) in enumerate(linhas, start=1):
+            sucesso, mensagem, _ = _aplicar_movimentacao(cursor, item_id, quantidade, tipo_movimentacao, usuario_id, observacao)
+            if sucesso:
+                total += quantidade
+            else:
+                erros.append(f"Linha {numero}: {mensagem.replace('Erro: ', '', 1)}")
+        if erros:
+            raise _RomaneioRecusado(erros)
+        return total
+
+    try:
+        total = executar_escrita(aplicar)
+    except _RomaneioRecusado as e:
+        return False, "Romaneio não registrado, nenhuma linha foi aplicada. " + " ".join(e.args[0])
+    except Exception as e:
+        return False, f"Erro ao registrar romaneio: {e}"
+
+    itens = ", ".join(f"{item_id}:{quantidade}" for item_id, quantidade in linhas)
+    registrar_log(usuario_id, f"ROMANEIO_{tipo_movimentacao.upper()}",
+                  f"{len(linhas)} linha(s), {total} unidade(s). Itens (ID:Qtd): {itens}")
+    return True, f"Romaneio de {tipo_movimentacao} registrado: {len(linhas)} linha(s), {total} unidade(s)."
 
 def registrar_entrada(item_id, quantidade, usuario_id, observacao=""):
     return _modificar_estoque(item_id, quantidade, 'entrada', usuario_id, observacao)
@@ -117,8 +161,9 @@ def registrar_saida(item_id, quantidade, usuario_id, observacao=""):
 def registrar_compra(item_id, quantidade, usuario_id, observacao=""):
     return _modificar_estoque(item_id, quantidade, 'compra', usuario_id, observacao)
 
+@cache_por_versao('versao_catalogo')
 def listar_itens():
-    """Lista todos os itens do estoque com suas quantidades."""
+    """Lista todos os itens do estoque com suas quantidades (em cache até a próxima alteração do catálogo)."""
     conn = conectar_bd()
     if not conn: return []
     
@@ -133,6 +178,52 @@ def listar_itens():
     conn.close()
     return [dict(item) for item in itens] # Converte para lista de dicionários
 
+# Colunas aceitas na ordenação da busca (o id desempata, para a paginação ser estável)
+ORDENACOES_BUSCA = {
+    'nome': "i.nome",
+    'descricao': "d.nome",
+    'quantidade': "i.quantidade",
+}
+
+def _consulta_fts(termo: str) -> str:
+    """Monta a consulta FTS5: todas as palavras, cada uma como prefixo ("cim" encontra "cimento")."""
+    palavras = termo.replace('"', ' ').split()
+    return " ".join(f'"{palavra}"*' for palavra in palavras)
+
+def buscar_itens(termo="", ordenar="nome", direcao="asc", pagina=1, por_pagina=50):
+    """
+    Busca paginada de itens por nome e descrição (índice FTS5 itens_busca, sem diferenciar acentos).
+    Retorna {"itens", "total", "pagina", "por_pagina", "tem_mais"}.
+    """
+    coluna = ORDENACOES_BUSCA.get(ordenar, ORDENACOES_BUSCA['nome'])
+    sentido = "DESC" if direcao == "desc" else "ASC"
+    pagina = max(1, pagina)
+    consulta_fts = _consulta_fts(termo or "")
+
+    resultado = {"itens": [], "total": 0, "pagina": pagina, "por_pagina": por_pagina, "tem_mais": False}
+    conn = conectar_bd()
+    if not conn: return resultado
+
+    cursor = conn.cursor()
+    filtro = "WHERE i.id IN (SELECT rowid FROM itens_busca WHERE itens_busca MATCH ?)" if consulta_fts else ""
+    parametros = (consulta_fts,) if consulta_fts else ()
+
+    cursor.execute(f"SELECT COUNT(*) FROM itens_estoque i {filtro}", parametros)
+    resultado["total"] = cursor.fetchone()[0]
+    cursor.execute(f"""
+        SELECT i.id, i.nome, i.quantidade, i.preco_unitario, d.nome as descricao
+        FROM itens_estoque i
+        LEFT JOIN descricoes d ON i.descricao_id = d.id
+        {filtro}
+        ORDER BY {coluna} {sentido}, i.id {sentido}
+        LIMIT ? OFFSET ?
+    """, (*parametros, por_pagina, (pagina - 1) * por_pagina))
+    resultado["itens"] = [dict(item) for item in cursor.fetchall()]
+    conn.close()
+
+    resultado["tem_mais"] = pagina * por_pagina < resultado["total"]
+    return resultado
+
 def listar_itens_estoque_baixo(minimo=50):
     """Lista todos os itens com quantidade igual ou abaixo do mínimo."""
     conn = conectar_bd()
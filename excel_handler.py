@@ -1,94 +1,386 @@
 # excel_handler.py
-import pandas as pd
+import io
+import csv
+import sqlite3
+import hashlib
 import unicodedata
+from decimal import Decimal
 from database import conectar_bd
+from logs import registrar_log
 
-def importar_do_excel(caminho_arquivo: str):
+# Colunas esperadas, já com o cabeçalho normalizado (sem acentos, espaços e "_", em minúsculas)
+COLUNAS_IMPORTACAO = {
+    'nome': 'Nome', 'descricao': 'Descricao', 'precounitario': 'Preco_Unitario', 'quantidade': 'Quantidade'
+}
+
+# Quantas linhas com problema são detalhadas na mensagem de erro (as demais são só contadas)
+MAXIMO_ERROS_EXIBIDOS = 5
+
+def _normalizar_cabecalho(header):
+    # Remove acentos, espaços, converte para minúsculo e remove caracteres especiais
+    s = ''.join(c for c in unicodedata.normalize('NFD', str(header)) if unicodedata.category(c) != 'Mn')
+    return s.lower().replace(" ", "").replace("_", "")
+
+def _ler_planilha(caminho_arquivo: str):
     """
-    Lê uma planilha Excel e insere/atualiza os itens no banco de dados.
-    A planilha deve ter as colunas: 'Nome', 'Descricao', 'Preco_Unitario', 'Quantidade'.
+    Gera primeiro a lista de colunas e depois os valores de cada linha.
+    O .xlsx é lido em modo streaming (read_only), sem carregar a pasta de trabalho inteira;
+    o .xls, que o openpyxl não lê, continua passando pelo pandas.
     """
+    # openpyxl e pandas são importados só quando usados: a inicialização da aplicação não paga esse custo.
+    if caminho_arquivo.endswith('.xlsx'):
+        import openpyxl
+        pasta = openpyxl.load_workbook(caminho_arquivo, read_only=True, data_only=True)
+        try:
+            linhas = pasta.active.iter_rows(values_only=True)
+            cabecalho = next(linhas, ())
+            yield [COLUNAS_IMPORTACAO.get(_normalizar_cabecalho(c), c) if c is not None else '' for c in cabecalho]
+            yield from linhas
+        finally:
+            pasta.close()  # libera o arquivo (o upload é apagado em seguida)
+    else:
+        import pandas as pd
+        df = pd.read_excel(caminho_arquivo)
+        yield [COLUNAS_IMPORTACAO.get(_normalizar_cabecalho(c), c) for c in df.columns]
+        for linha in df.itertuples(index=False, name=None):
+            yield tuple(None if pd.isna(v) else v for v in linha)
+
+def _converter_numero(valor):
+    """Aceita números e textos no formato brasileiro ("1.234,56") ou com ponto decimal ("12.5")."""
+    if isinstance(valor, (int, float)):
+        return valor
+    texto = str(valor).strip()
+    if ',' in texto:
+        texto = texto.replace('.', '').replace(',', '.')
+    return float(texto)
+
+def _validar_linha(valores, posicoes):
+    """Valida e converte uma linha. Retorna (item, erro), onde item = (nome, descrição, preço, quantidade)."""
+    nome, descricao, preco, quantidade = (valores[posicoes[col]] if posicoes[col] < len(valores) else None
+                                          for col in ('Nome', 'Descricao', 'Preco_Unitario', 'Quantidade'))
+    if nome is None or not str(nome).strip():
+        return None, "nome em branco"
+    if descricao is None or not str(descricao).strip():
+        return None, f"descrição em branco ('{nome}')"
     try:
-        # Especifica o motor 'openpyxl' para garantir compatibilidade com .xlsx
-        # Para .xls, o pandas tentará usar 'xlrd' se estiver instalado.
-        engine = 'openpyxl' if caminho_arquivo.endswith('.xlsx') else None
-        df = pd.read_excel(caminho_arquivo, engine=engine)
-
-        # --- MELHORIA: Normaliza os nomes das colunas ---
-        def normalize_header(header):
-            # Remove acentos, espaços, converte para minúsculo e remove caracteres especiais
-            s = ''.join(c for c in unicodedata.normalize('NFD', header) if unicodedata.category(c) != 'Mn')
-            return s.lower().replace(" ", "").replace("_", "")
-
-        df.columns = [normalize_header(col) for col in df.columns]
-        # Mapeamento de nomes de coluna normalizados para os nomes esperados no banco de dados
-        column_mapping = {
-            'nome': 'Nome', 'descricao': 'Descricao', 'precounitario': 'Preco_Unitario', 'quantidade': 'Quantidade'
-        }
-        df.rename(columns=column_mapping, inplace=True)
+        preco = None if preco is None or str(preco).strip() == '' else _converter_numero(preco)
+        if preco is not None and preco < 0:
+            raise ValueError
+    except ValueError:
+        return None, f"preço unitário inválido ('{valores[posicoes['Preco_Unitario']]}')"
+    try:
+        numero = _converter_numero(quantidade)
+        if numero < 0 or numero != int(numero):
+            raise ValueError
+    except (TypeError, ValueError):
+        return None, f"quantidade inválida ('{quantidade}')"
+    return (str(nome), str(descricao), preco, int(numero)), None
 
+def _ler_itens_validados(caminho_arquivo: str, nomes_unicos: bool = False):
+    """
+    Lê e valida todas as linhas da planilha antes de qualquer gravação.
+    Retorna (itens, erro): a lista de (nome, descrição, preço, quantidade) ou a mensagem de erro (mensagem, categoria).
+    Com `nomes_unicos`, um mesmo item repetido na planilha é considerado erro.
+    """
+    linhas = _ler_planilha(caminho_arquivo)
+    try:
+        colunas = next(linhas)
     except FileNotFoundError:
-        return "ERRO: Arquivo não encontrado.", "error"
+        return None, ("ERRO: Arquivo não encontrado.", "error")
     except Exception as e:
-        return f"ERRO ao ler o arquivo Excel: {e}", "error"
+        return None, (f"ERRO ao ler o arquivo Excel: {e}", "error")
 
     required_cols = ['Nome', 'Descricao', 'Preco_Unitario', 'Quantidade']
-    # --- MELHORIA: Mensagem de erro mais específica ---
-    missing_cols = [col for col in required_cols if col not in df.columns]
+    missing_cols = [col for col in required_cols if col not in colunas]
     if missing_cols:
-        return f"ERRO: A planilha não foi importada. Coluna(s) faltando: {', '.join(missing_cols)}. Verifique se o nome das colunas no arquivo Excel está correto.", "danger"
+        linhas.close()
+        return None, (f"ERRO: A planilha não foi importada. Coluna(s) faltando: {', '.join(missing_cols)}. Verifique se o nome das colunas no arquivo Excel está correto.", "danger")
+
+    posicoes = {col: colunas.index(col) for col in required_cols}
+    itens, erros, linha_do_nome = [], [], {}
+    try:
+        for numero_linha, valores in enumerate(linhas, start=2):  # a linha 1 é o cabeçalho
+            if all(v is None or str(v).strip() == '' for v in valores):
+                continue
+            item, erro = _validar_linha(valores, posicoes)
+            if not erro and nomes_unicos:
+                if item[0] in linha_do_nome:
+                    erro = f"item '{item[0]}' repetido (já aparece na linha {linha_do_nome[item[0]]})"
+                linha_do_nome.setdefault(item[0], numero_linha)
+            if erro:
+                erros.append(f"linha {numero_linha}: {erro}")
+            else:
+                itens.append(item)
+    except Exception as e:
+        return None, (f"ERRO ao ler o arquivo Excel: {e}", "error")
+
+    if erros:
+        detalhes = "; ".join(erros[:MAXIMO_ERROS_EXIBIDOS])
+        if len(erros) > MAXIMO_ERROS_EXIBIDOS:
+            detalhes += f" e mais {len(erros) - MAXIMO_ERROS_EXIBIDOS}"
+        return None, (f"ERRO: A planilha não foi importada. {len(erros)} linha(s) com problema: {detalhes}.", "danger")
+    if not itens:
+        return None, ("Nenhum item encontrado na planilha.", "warning")
+    return itens, None
+
+def importar_do_excel(caminho_arquivo: str):
+    """
+    Lê uma planilha Excel e insere os itens novos no banco de dados.
+    A planilha deve ter as colunas: 'Nome', 'Descricao', 'Preco_Unitario', 'Quantidade'.
+    Todas as linhas são validadas antes de gravar; a gravação é feita numa única transação,
+    então ou a planilha inteira é importada ou nada é.
+    """
+    itens, erro = _ler_itens_validados(caminho_arquivo)
+    if erro:
+        return erro
 
     conn = conectar_bd()
     if not conn:
         return "ERRO: Falha na conexão com o banco de dados.", "error"
 
-    cursor = conn.cursor()
-    count_sucesso = 0
-    for _, row in df.iterrows():
-        try:
-            # Tenta inserir. Se o item já existe (UNIQUE constraint no nome), ignora.
-            # Primeiro, encontra ou cria o ID da descrição
-            descricao_nome = row['Descricao']
-            cursor.execute("SELECT id FROM descricoes WHERE nome = ?", (descricao_nome,))
-            descricao_row = cursor.fetchone()
-            if descricao_row:
-                descricao_id = descricao_row['id']
-            else:
-                # Se a descrição não existe, cria e pega o ID
-                cursor.execute("INSERT INTO descricoes (nome) VALUES (?)", (descricao_nome,))
-                descricao_id = cursor.lastrowid
-
-            # Insere o item com o ID da descrição
-            cursor.execute(
-                "INSERT OR IGNORE INTO itens_estoque (nome, descricao_id, preco_unitario, quantidade) VALUES (?, ?, ?, ?)",
-                (row['Nome'], descricao_id, row['Preco_Unitario'], row['Quantidade'])
-            )
-            if cursor.rowcount > 0:
-                count_sucesso += 1
-        except Exception as e:
-            conn.close()
-            return f"ERRO ao inserir o item '{row['Nome']}': {e}", "error"
-    
-    conn.commit()
-    conn.close()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.cursor()
+        # Descrições: cria as que faltam de uma vez e resolve todos os IDs com uma única consulta
+        cursor.executemany("INSERT OR IGNORE INTO descricoes (nome) VALUES (?)",
+                           [(descricao,) for descricao in sorted({item[1] for item in itens})])
+        cursor.execute("SELECT id, nome FROM descricoes")
+        ids_descricoes = {row['nome']: row['id'] for row in cursor.fetchall()}
+
+        # Itens: se o item já existe (UNIQUE no nome), é ignorado
+        cursor.executemany(
+            "INSERT OR IGNORE INTO itens_estoque (nome, descricao_id, preco_unitario, quantidade) VALUES (?, ?, ?, ?)",
+            ((nome, ids_descricoes[descricao], preco, quantidade) for nome, descricao, preco, quantidade in itens)
+        )
+        count_sucesso = cursor.rowcount
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        return f"ERRO ao gravar os itens: {e}. Nenhum item foi importado.", "error"
+    finally:
+        conn.close()
+
     return f"{count_sucesso} novos itens importados com sucesso da planilha.", "success"
 
-def exportar_para_excel():
-    """Exporta o saldo atual do estoque para um arquivo Excel."""
+# --- Importação com atualização (upsert) ---
+
+# Diferenças entre a planilha (tabela temporária `importacao`) e o estoque, calculadas no banco
+_DIFERENCAS = {
+    "novos": """SELECT t.nome, t.descricao, t.preco, t.quantidade
+                FROM temp.importacao t
+                WHERE NOT EXISTS (SELECT 1 FROM itens_estoque i WHERE i.nome = t.nome)""",
+    "precos": """SELECT i.id, t.nome, i.preco_unitario as preco_atual, t.preco as preco_novo
+                 FROM temp.importacao t JOIN itens_estoque i ON i.nome = t.nome
+                 WHERE t.preco IS NOT NULL AND (i.preco_unitario IS NULL OR ABS(t.preco - i.preco_unitario) > 1e-9)""",
+    "quantidades": """SELECT i.id, t.nome, i.quantidade as quantidade_atual, t.quantidade as quantidade_nova
+                      FROM temp.importacao t JOIN itens_estoque i ON i.nome = t.nome
+                      WHERE t.quantidade <> i.quantidade""",
+}
+
+# Quantas linhas de cada tipo de alteração aparecem na prévia (as contagens são sempre completas)
+LINHAS_PREVIA = 100
+
+def _carregar_importacao(cursor, itens):
+    """Carrega as linhas da planilha numa tabela temporária da conexão."""
+    cursor.execute("DROP TABLE IF EXISTS temp.importacao")
+    cursor.execute("""CREATE TEMP TABLE importacao (
+        nome TEXT PRIMARY KEY, descricao TEXT NOT NULL, preco REAL, quantidade INTEGER NOT NULL
+    )""")
+    cursor.executemany("INSERT INTO temp.importacao (nome, descricao, preco, quantidade) VALUES (?, ?, ?, ?)", itens)
+
+def _calcular_diferencas(cursor):
+    """Contagens, amostras e uma assinatura (hash) do conjunto completo de alterações."""
+    resultado = {"assinatura": hashlib.sha1()}
+    for tipo, consulta in _DIFERENCAS.items():
+        cursor.execute(f"{consulta} ORDER BY t.nome")
+        linhas = [dict(row) for row in cursor]
+        for linha in linhas:
+            resultado["assinatura"].update(repr(tuple(linha.values())).encode())
+        resultado[tipo] = {"total": len(linhas), "amostra": linhas[:LINHAS_PREVIA]}
+    resultado["assinatura"] = resultado["assinatura"].hexdigest()
+    return resultado
+
+def previa_importacao(caminho_arquivo: str):
+    """
+    Compara a planilha com o estoque sem gravar nada: itens novos, preços alterados e ajustes de quantidade.
+    Retorna (previa, erro); erro no mesmo formato (mensagem, categoria) de importar_do_excel.
+    """
+    itens, erro = _ler_itens_validados(caminho_arquivo, nomes_unicos=True)
+    if erro:
+        return None, erro
+
     conn = conectar_bd()
     if not conn:
-        return None, "ERRO: Falha na conexão com o banco de dados."
+        return None, ("ERRO: Falha na conexão com o banco de dados.", "error")
+    try:
+        cursor = conn.cursor()
+        _carregar_importacao(cursor, itens)
+        previa = _calcular_diferencas(cursor)
+        previa["linhas"] = len(itens)
+        previa["inalterados"] = len(itens) - previa["novos"]["total"] - cursor.execute(
+            f"SELECT COUNT(DISTINCT nome) FROM ({_DIFERENCAS['precos']} UNION ALL {_DIFERENCAS['quantidades']})"
+        ).fetchone()[0]
+        cursor.execute("DROP TABLE temp.importacao")
+        conn.commit()  # só a tabela temporária foi alterada
+        return previa, None
+    finally:
+        conn.close()
+
+def aplicar_importacao(caminho_arquivo: str, usuario_id: int, assinatura: str):
+    """
+    Aplica a planilha ao estoque numa única transação: cadastra os itens novos, atualiza os preços e
+    ajusta as quantidades. Cada ajuste (e a quantidade inicial dos itens novos) vira uma movimentação,
+    para o histórico continuar batendo com o saldo. Se as alterações não forem mais as da prévia
+    (`assinatura`), nada é gravado.
+    """
+    itens, erro = _ler_itens_validados(caminho_arquivo, nomes_unicos=True)
+    if erro:
+        return False, erro[0]
+
+    conn = conectar_bd()
+    if not conn:
+        return False, "ERRO: Falha na conexão com o banco de dados."
+
+    observacao = "Ajuste de estoque pela importação de planilha."
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.cursor()
+        _carregar_importacao(cursor, itens)
+        diferencas = _calcular_diferencas(cursor)
+        if diferencas["assinatura"] != assinatura:
+            conn.rollback()
+            return False, "O estoque mudou desde a prévia. Confira as alterações novamente antes de aplicar."
+
+        # 1. Ajustes de quantidade: primeiro o registro no histórico, depois o saldo
+        cursor.execute(f"""
+            INSERT INTO movimentacoes (item_id, tipo, quantidade, usuario_id, observacao)
+            SELECT id, CASE WHEN quantidade_nova > quantidade_atual THEN 'entrada' ELSE 'saida' END,
+                   ABS(quantidade_nova - quantidade_atual), ?, ?
+            FROM ({_DIFERENCAS['quantidades']})
+        """, (usuario_id, observacao))
+        cursor.execute("""
+            UPDATE itens_estoque AS i SET quantidade = t.quantidade
+            FROM temp.importacao AS t
+            WHERE t.nome = i.nome AND t.quantidade <> i.quantidade
+        """)
+
+        # 2. Preços
+        cursor.execute("""
+            UPDATE itens_estoque AS i SET preco_unitario = t.preco
+            FROM temp.importacao AS t
+            WHERE t.nome = i.nome AND t.preco IS NOT NULL
+              AND (i.preco_unitario IS NULL OR ABS(t.preco - i.preco_unitario) > 1e-9)
+        """)
+
+        # 3. Itens novos (com as descrições que faltarem) e a entrada inicial de cada um
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM itens_estoque")
+        ultimo_id = cursor.fetchone()[0]
+        cursor.execute(f"INSERT OR IGNORE INTO descricoes (nome) SELECT DISTINCT descricao FROM ({_DIFERENCAS['novos']})")
+        cursor.execute(f"""
+            INSERT INTO itens_estoque (nome, descricao_id, preco_unitario, quantidade)
+            SELECT n.nome, d.id, n.preco, n.quantidade
+            FROM ({_DIFERENCAS['novos']}) n JOIN descricoes d ON d.nome = n.descricao
+        """)
+        cursor.execute("""
+            INSERT INTO movimentacoes (item_id, tipo, quantidade, usuario_id, observacao)
+            SELECT id, 'entrada', quantidade, ?, 'Entrada inicial de estoque (importação de planilha).'
+            FROM itens_estoque WHERE id > ? AND quantidade > 0
+        """, (usuario_id, ultimo_id))
+
+        cursor.execute("DROP TABLE temp.importacao")
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        return False, f"ERRO ao aplicar a planilha: {e}. Nenhuma alteração foi gravada."
+    finally:
+        conn.close()
+
+    resumo = (f"{diferencas['novos']['total']} item(ns) novo(s), {diferencas['precos']['total']} preço(s) e "
+              f"{diferencas['quantidades']['total']} quantidade(s) atualizados")
+    registrar_log(usuario_id, "IMPORTACAO_PLANILHA", resumo)
+    return True, f"Planilha aplicada: {resumo}."
+
+# Colunas da exportação do saldo (os mesmos cabeçalhos da exportação anterior, feita pelo pandas)
+COLUNAS_EXPORTACAO = ['id', 'nome', 'descricao', 'quantidade', 'preco_unitario']
+
+def iterar_saldo(tamanho_lote: int = 1000):
+    """Percorre o saldo do estoque em ordem de nome, em lotes (paginação pelo nome, que é único)."""
+    ultimo_nome = None
+    while True:
+        conn = conectar_bd()
+        if not conn: return
+        cursor = conn.cursor()
+        filtro = "WHERE i.nome > ?" if ultimo_nome is not None else ""
+        cursor.execute(f"""
+            SELECT i.id, i.nome, d.nome as descricao, i.quantidade, i.preco_unitario
+            FROM itens_estoque i
+            LEFT JOIN descricoes d ON i.descricao_id = d.id
+            {filtro}
+            ORDER BY i.nome
+            LIMIT ?
+        """, (*((ultimo_nome,) if ultimo_nome is not None else ()), tamanho_lote))
+        lote = [tuple(row) for row in cursor.fetchall()]
+        conn.close()
+        yield from lote
+        if len(lote) < tamanho_lote:
+            return
+        ultimo_nome = lote[-1][1]
+
+def exportar_para_excel(caminho_saida: str, ao_avancar=None):
+    """
+    Exporta o saldo atual do estoque para um arquivo Excel.
+    As linhas vão do cursor direto para uma pasta de trabalho write-only, sem montar tudo em memória.
+    `ao_avancar(linhas)` é chamado a cada lote gravado, para acompanhar o progresso.
+    """
+    import openpyxl
+    pasta = openpyxl.Workbook(write_only=True)
+    planilha = pasta.create_sheet("Saldo")
+    planilha.append(COLUNAS_EXPORTACAO)
+    linhas = 0
+    for linha in iterar_saldo():
+        planilha.append(linha)
+        linhas += 1
+        if ao_avancar and linhas % 1000 == 0:
+            ao_avancar(linhas)
+    pasta.save(caminho_saida)
+
+    return caminho_saida, f"Estoque exportado com sucesso para '{caminho_saida}'."
+
+def _numero_br(valor, casas_minimas=0):
+    """Número sem notação científica e com vírgula decimal, a partir da menor representação exata (repr)."""
+    inteiro, _, fracao = format(Decimal(repr(valor)), 'f').partition('.')
+    fracao = fracao.rstrip('0').ljust(casas_minimas, '0')
+    return f"{inteiro},{fracao}" if fracao else inteiro
+
+def gerar_csv_saldo():
+    """
+    Gera, em pedaços de texto, o saldo do estoque em CSV, para ser enviado enquanto é lido.
+    Formato do Excel em português: separador ';', vírgula decimal e BOM UTF-8.
+    """
+    # Números por extenso e com vírgula: o Excel em português não reconhece a notação científica (1e-05).
+    # O preço sai com todas as casas que tiver (como no xlsx), com no mínimo duas; a quantidade é
+    # arredondada a 6 casas, para não levar o ruído das atualizações relativas (0,30000000000000004).
+    def formatar_preco(valor):
+        if isinstance(valor, (int, float)):
+            return _numero_br(valor, casas_minimas=2)
+        return valor
 
-    # Usamos o Pandas para ler diretamente a query do SQL para um DataFrame
-    df = pd.read_sql_query("""
-        SELECT i.id, i.nome, d.nome as descricao, i.quantidade, i.preco_unitario
-        FROM itens_estoque i
-        LEFT JOIN descricoes d ON i.descricao_id = d.id
-        ORDER BY i.nome
-    """, conn)
-    conn.close()
+    def formatar_quantidade(valor):
+        if isinstance(valor, float):
+            return _numero_br(round(valor, 6) + 0.0)  # + 0.0 evita "-0"
+        return valor
 
-    caminho_saida = "saldo_estoque_exportado.xlsx"
-    df.to_excel(caminho_saida, index=False, engine='openpyxl')
+    formatos = {'quantidade': formatar_quantidade, 'preco_unitario': formatar_preco}
+    formatadores = [formatos.get(coluna, lambda valor: valor) for coluna in COLUNAS_EXPORTACAO]
 
-    return caminho_saida, f"Estoque exportado com sucesso para '{caminho_saida}'."
\ No newline at end of file
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=';', lineterminator='\r\n')
+    buffer.write('\ufeff')
+    escritor.writerow(COLUNAS_EXPORTACAO)
+    for numero, linha in enumerate(iterar_saldo(), start=1):
+        escritor.writerow([formatar(valor) for formatar, valor in zip(formatadores, linha)])
+        if numero % 1000 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
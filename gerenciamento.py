@@ -1,10 +1,11 @@
 # gerenciamento.py
 import sqlite3
-from database import conectar_bd
+from database import conectar_bd, cache_por_versao
 from logs import registrar_log
 
+@cache_por_versao('versao_catalogo')
 def listar_descricoes():
-    """Lista todas as descrições do catálogo."""
+    """Lista todas as descrições do catálogo (em cache até a próxima alteração do catálogo)."""
     conn = conectar_bd()
     if not conn: return []
     cursor = conn.cursor()
@@ -1,21 +1,151 @@
 # logs.py
-from database import conectar_bd
+import os
+import time
+import queue
+import atexit
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timezone
+from database import conectar_bd, transacao_ativa
+
+# Em modo síncrono (ex.: testes) cada registro é gravado na hora, sem passar pela fila.
+MODO_SINCRONO = os.environ.get("ESTOQUE_LOG_SINCRONO", "0") == "1"
+
+# Capacidade da fila em memória. Com a fila cheia, o registro é gravado de forma síncrona.
+FILA_CAPACIDADE = 10000
+
+# Número máximo de registros gravados num mesmo INSERT em lote.
+LOTE_MAXIMO = 500
+
+# Com o banco ocupado ("database is locked"), o lote é tentado de novo até esse número de vezes,
+# com espera crescente a partir de ESPERA_INICIAL_S.
+TENTATIVAS_GRAVACAO = 4
+ESPERA_INICIAL_S = 0.2
+
+_INSERT = "INSERT INTO logs_auditoria (timestamp, usuario_id, acao, detalhes) VALUES (?, ?, ?, ?)"
+
+_fila = queue.Queue(maxsize=FILA_CAPACIDADE)
+_thread = None
+_lock = threading.Lock()
+
+def _agora():
+    # Mesmo formato (UTC) do DEFAULT CURRENT_TIMESTAMP da coluna, mas com a hora do evento, não a da gravação.
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+def _ocupado(erro):
+    texto = str(erro).lower()
+    return "locked" in texto or "busy" in texto
+
+def _gravar(registros):
+    """
+    Grava os registros numa única transação. Com o banco ocupado, tenta de novo com espera crescente;
+    se continuar ocupado, levanta sqlite3.OperationalError para quem chamou decidir o que fazer.
+    """
+    for tentativa in range(TENTATIVAS_GRAVACAO):
+        conn = conectar_bd()
+        if not conn:
+            logging.error(f"Falha na conexão com o BD: {len(registros)} registro(s) de auditoria não gravado(s).")
+            return
+        try:
+            conn.executemany(_INSERT, registros)
+            conn.commit()
+            return
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            if not _ocupado(e) or tentativa == TENTATIVAS_GRAVACAO - 1:
+                raise
+            espera = ESPERA_INICIAL_S * 2 ** tentativa
+            logging.warning(f"Banco ocupado ao gravar a auditoria ({e}); nova tentativa em {espera:.1f}s.")
+        except sqlite3.Error as e:
+            conn.rollback()
+            logging.error(f"Erro ao registrar log: {e}. {len(registros)} registro(s) não gravado(s).")
+            return
+        finally:
+            conn.close()
+        time.sleep(espera)
+
+def _devolver_a_fila(lote, erro):
+    """Lote que não pôde ser gravado: com o banco ainda ocupado, volta para a fila; caso contrário, é perdido."""
+    if not _ocupado(erro):
+        logging.error(f"Erro ao registrar log: {erro}. {len(lote)} registro(s) não gravado(s).")
+        return
+    perdidos = 0
+    for registro in lote:
+        try:
+            _fila.put_nowait(registro)
+        except queue.Full:
+            perdidos += 1
+    logging.warning(f"Banco ocupado: {len(lote) - perdidos} registro(s) de auditoria de volta à fila.")
+    if perdidos:
+        logging.error(f"Fila de auditoria cheia: {perdidos} registro(s) não gravado(s).")
+
+def _consumir():
+    """Laço da thread de gravação: esvazia a fila em lotes."""
+    while True:
+        lote = [_fila.get()]
+        while len(lote) < LOTE_MAXIMO:
+            try:
+                lote.append(_fila.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            _gravar(lote)
+        except sqlite3.OperationalError as e:
+            _devolver_a_fila(lote, e)  # antes do task_done, para descarregar() continuar aguardando
+        finally:
+            for _ in lote:
+                _fila.task_done()
+
+def _iniciar():
+    global _thread
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_consumir, name="auditoria", daemon=True)
+            _thread.start()
 
 def registrar_log(usuario_id: int, acao: str, detalhes: str = ""):
-    """Registra uma ação no log de auditoria."""
-    conn = conectar_bd()
-    if not conn:
-        print("ERRO: Não foi possível registrar o log por falha na conexão com o BD.")
+    """Registra uma ação no log de auditoria (de forma assíncrona, salvo em modo síncrono ou numa unidade de trabalho)."""
+    registro = (_agora(), usuario_id, acao, detalhes)
+    # Numa unidade de trabalho o registro entra na mesma transação: é gravado (ou desfeito) junto com a
+    # operação. Um erro aqui é repassado; quem abriu a unidade a desfaz e informa a falha.
+    if transacao_ativa():
+        conn = conectar_bd()
+        conn.execute(_INSERT, registro)
+        conn.close()
         return
 
+    if not MODO_SINCRONO:
+        _iniciar()
+        try:
+            _fila.put_nowait(registro)
+            return
+        except queue.Full:
+            pass
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO logs_auditoria (usuario_id, acao, detalhes) VALUES (?, ?, ?)",
-            (usuario_id, acao, detalhes)
-        )
-        conn.commit()
-    except Exception as e:
-        print(f"Erro ao registrar log: {e}")
-    finally:
-        conn.close()
+        _gravar([registro])
+    except sqlite3.OperationalError as e:
+        logging.error(f"Erro ao registrar log: {e}. Registro não gravado: {acao}.")
+
+def descarregar(timeout: float = 10.0):
+    """Aguarda a gravação dos registros pendentes. Retorna False se o tempo esgotar."""
+    limite = time.monotonic() + timeout
+    while _fila.unfinished_tasks:
+        if time.monotonic() >= limite:
+            return False
+        time.sleep(0.01)
+    return True
+
+def _reiniciar_apos_fork():
+    """No processo filho, começa com uma fila vazia: a thread de gravação do pai não existe aqui."""
+    global _fila, _thread, _lock
+    _fila = queue.Queue(maxsize=FILA_CAPACIDADE)
+    _thread = None
+    _lock = threading.Lock()
+
+# Garante que os registros enfileirados sejam gravados quando o processo terminar.
+atexit.register(descarregar)
+
+if hasattr(os, "register_at_fork"):
+    # Registros ainda na fila seriam gravados duas vezes (pelo pai e pelo filho): esvazia antes do fork.
+    os.register_at_fork(before=descarregar, after_in_child=_reiniciar_apos_fork)
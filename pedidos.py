@@ -1,41 +1,36 @@
 # pedidos.py
 import sqlite3
-from database import conectar_bd
+from database import conectar_bd, ler_contador, transacao
 from logs import registrar_log
 import estoque
 
 # --- Funções de Obras ---
 
 def criar_obra(nome: str, localizacao: str, usuario_id: int):
-    conn = conectar_bd()
-    if not conn: return False, "Falha na conexão com o banco de dados."
     try:
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO obras (nome, localizacao) VALUES (?, ?)", (nome, localizacao))
-        conn.commit()
-        registrar_log(usuario_id, "CRIAR_OBRA", f"Obra: {nome}")
+        with transacao() as conn:
+            conn.execute("INSERT INTO obras (nome, localizacao) VALUES (?, ?)", (nome, localizacao))
+            registrar_log(usuario_id, "CRIAR_OBRA", f"Obra: {nome}")
         return True, f"Obra '{nome}' criada com sucesso."
     except sqlite3.IntegrityError:
         return False, f"A obra '{nome}' já existe."
-    finally:
-        conn.close()
+    except sqlite3.Error as e:
+        return False, f"Erro ao criar obra: {e}"
 
 def atualizar_obra(obra_id: int, nome: str, localizacao: str, usuario_id: int):
     """Atualiza os dados de uma obra existente."""
-    conn = conectar_bd()
-    if not conn: return False, "Falha na conexão com o banco de dados."
     try:
-        cursor = conn.cursor()
-        cursor.execute("UPDATE obras SET nome = ?, localizacao = ? WHERE id = ?", (nome, localizacao, obra_id))
-        conn.commit()
-        if cursor.rowcount == 0:
-            return False, "Nenhuma obra encontrada com este ID."
-        registrar_log(usuario_id, "ATUALIZAR_OBRA", f"Obra ID: {obra_id}, Novo Nome: {nome}")
+        with transacao() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE obras SET nome = ?, localizacao = ? WHERE id = ?", (nome, localizacao, obra_id))
+            if cursor.rowcount == 0:
+                return False, "Nenhuma obra encontrada com este ID."
+            registrar_log(usuario_id, "ATUALIZAR_OBRA", f"Obra ID: {obra_id}, Novo Nome: {nome}")
         return True, f"Obra '{nome}' atualizada com sucesso."
     except sqlite3.IntegrityError:
         return False, f"O nome de obra '{nome}' já está em uso por outra obra."
-    finally:
-        conn.close()
+    except sqlite3.Error as e:
+        return False, f"Erro ao atualizar obra: {e}"
 
 def listar_obras():
     conn = conectar_bd()
@@ -60,64 +55,70 @@ def get_materiais_por_obra(obra_id: int):
     conn = conectar_bd()
     if not conn: return []
 
-    # Primeiro, busca o nome da obra para usar no filtro
-    cursor = conn.cursor()
-    cursor.execute("SELECT nome FROM obras WHERE id = ?", (obra_id,))
-    obra = cursor.fetchone()
-    if not obra:
-        conn.close()
-        return []
-    
-    # Agora, busca as movimentações usando o nome da obra na observação
+    # Busca pela obra de destino gravada na movimentação (índice obra_id, tipo, data)
     cursor = conn.cursor()
     cursor.execute("""
         SELECT m.data, i.nome as item_nome, m.quantidade, u.username as usuario_nome
         FROM movimentacoes m
         JOIN itens_estoque i ON m.item_id = i.id
         JOIN usuarios u ON m.usuario_id = u.id
-        WHERE m.tipo = 'saida' AND m.observacao LIKE ?
+        WHERE m.obra_id = ? AND m.tipo = 'saida'
         ORDER BY m.data DESC
-    """, (f"Obra: {obra['nome']}%",))
+    """, (obra_id,))
     materiais = cursor.fetchall()
     conn.close()
     return [dict(m) for m in materiais]
 
+def iterar_materiais_por_obra(obra_id: int, tamanho_lote: int = 500):
+    """Percorre os materiais enviados para a obra em lotes (paginação por data e id), com memória limitada."""
+    chave = None
+    while True:
+        conn = conectar_bd()
+        if not conn: return
+        cursor = conn.cursor()
+        filtro = "AND (m.data, m.id) < (?, ?)" if chave else ""
+        cursor.execute(f"""
+            SELECT m.id, m.data, i.nome as item_nome, m.quantidade, u.username as usuario_nome
+            FROM movimentacoes m
+            JOIN itens_estoque i ON m.item_id = i.id
+            JOIN usuarios u ON m.usuario_id = u.id
+            WHERE m.obra_id = ? AND m.tipo = 'saida' {filtro}
+            ORDER BY m.data DESC, m.id DESC
+            LIMIT ?
+        """, (obra_id, *(chave or ()), tamanho_lote))
+        lote = [dict(m) for m in cursor.fetchall()]
+        conn.close()
+        yield from lote
+        if len(lote) < tamanho_lote:
+            return
+        chave = (lote[-1]['data'], lote[-1]['id'])
+
 # --- Funções de Pedidos ---
 
 def criar_pedido_saida(item_id: int, quantidade: int, obra_id: int, justificativa: str, solicitante_id: int):
-    conn = conectar_bd()
-    if not conn: return False, "Falha na conexão com o banco de dados."
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO pedidos (item_id, quantidade, tipo, solicitante_id, obra_id, justificativa) VALUES (?, ?, 'saida', ?, ?, ?)",
-            (item_id, quantidade, solicitante_id, obra_id, justificativa)
-        )
-        conn.commit()
-        registrar_log(solicitante_id, "CRIAR_PEDIDO_SAIDA", f"Item ID: {item_id}, Qtd: {quantidade}, Obra ID: {obra_id}")
+        with transacao() as conn:
+            conn.execute(
+                "INSERT INTO pedidos (item_id, quantidade, tipo, solicitante_id, obra_id, justificativa) VALUES (?, ?, 'saida', ?, ?, ?)",
+                (item_id, quantidade, solicitante_id, obra_id, justificativa)
+            )
+            registrar_log(solicitante_id, "CRIAR_PEDIDO_SAIDA", f"Item ID: {item_id}, Qtd: {quantidade}, Obra ID: {obra_id}")
         return True, "Pedido de saída de material enviado para aprovação."
     except Exception as e:
         return False, f"Erro ao criar pedido: {e}"
-    finally:
-        conn.close()
 
 def criar_pedido_compra(item_id: int, quantidade: int, justificativa: str, solicitante_id: int):
     """Cria um pedido de compra para um item, que fica pendente de aprovação."""
-    conn = conectar_bd()
-    if not conn: return False, "Falha na conexão com o banco de dados."
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO pedidos (item_id, quantidade, tipo, solicitante_id, justificativa) VALUES (?, ?, 'compra', ?, ?)",
-            (item_id, quantidade, solicitante_id, justificativa)
-        )
-        conn.commit()
-        registrar_log(solicitante_id, "CRIAR_PEDIDO_COMPRA", f"Item ID: {item_id}, Qtd: {quantidade}")
+        with transacao() as conn:
+            conn.execute(
+                "INSERT INTO pedidos (item_id, quantidade, tipo, solicitante_id, justificativa) VALUES (?, ?, 'compra', ?, ?)",
+                (item_id, quantidade, solicitante_id, justificativa)
+            )
+            registrar_log(solicitante_id, "CRIAR_PEDIDO_COMPRA", f"Item ID: {item_id}, Qtd: {quantidade}")
         return True, "Pedido de compra enviado para aprovação."
     except Exception as e:
         return False, f"Erro ao criar pedido de compra: {e}"
-    finally:
-        conn.close()
 
 def listar_pedidos_pendentes():
     conn = conectar_bd()
@@ -137,10 +138,19 @@ def listar_pedidos_pendentes():
     conn.close()
     return [dict(p) for p in pedidos]
 
-def aprovar_pedido(pedido_id: int, aprovador_id: int):
+def contar_pedidos_pendentes():
+    """Número de pedidos pendentes (contador mantido por triggers na tabela pedidos)."""
     conn = conectar_bd()
-    if not conn: return False, "Falha na conexão com o banco de dados."
-    cursor = conn.cursor()
+    if not conn: return 0
+    total = ler_contador(conn.cursor(), 'pedidos_pendentes')
+    conn.close()
+    return int(total)
+
+def _aprovar_no_cursor(cursor, pedido_id: int, aprovador_id: int):
+    """
+    Aprova o pedido e efetiva a movimentação no mesmo cursor, sem commit; roda dentro de uma unidade de
+    trabalho (transacao()), junto com o registro de auditoria da movimentação. Retorna (sucesso, mensagem).
+    """
     # Busca o pedido e o nome da obra associada
     cursor.execute("""
         SELECT p.*, o.nome as obra_nome 
@@ -150,7 +160,6 @@ def aprovar_pedido(pedido_id: int, aprovador_id: int):
     """, (pedido_id,))
     pedido = cursor.fetchone()
     if not pedido:
-        conn.close()
         return False, "Pedido não encontrado ou já processado."
 
     # Efetiva a movimentação no estoque
@@ -164,35 +173,88 @@ def aprovar_pedido(pedido_id: int, aprovador_id: int):
     # CORREÇÃO: Padroniza o tipo de movimentação para 'entrada' quando o pedido é de 'compra'.
     tipo_movimentacao = 'entrada' if pedido['tipo'] == 'compra' else pedido['tipo']
 
-    sucesso, msg = estoque._modificar_estoque(pedido['item_id'], pedido['quantidade'], tipo_movimentacao, solicitante_id, observacao)
+    sucesso, msg, novo_saldo = estoque._aplicar_movimentacao(cursor, pedido['item_id'], pedido['quantidade'], tipo_movimentacao,
+                                                             solicitante_id, observacao, obra_id=pedido['obra_id'], pedido_id=pedido_id)
+    if not sucesso:
+        return False, msg
+    # Mesmo registro de _modificar_estoque; chamado numa unidade de trabalho, entra na mesma transação.
+    registrar_log(solicitante_id, f"MOVIMENTACAO_{tipo_movimentacao.upper()}",
+                  f"Item ID: {pedido['item_id']}, Qtd: {pedido['quantidade']}, Novo Saldo: {novo_saldo}")
 
-    if sucesso:
-        # Apenas se a movimentação de estoque for bem-sucedida, atualiza o status do pedido.
-        cursor.execute("UPDATE pedidos SET status = 'aprovado', aprovador_id = ?, data_decisao = CURRENT_TIMESTAMP WHERE id = ?", (aprovador_id, pedido_id))
-        conn.commit()
-        registrar_log(aprovador_id, "APROVAR_PEDIDO", f"Pedido ID: {pedido_id}")
-    
-    # Substitui a mensagem de movimentação por uma mensagem de aprovação mais clara.
-    msg = f"Pedido #{pedido_id} aprovado com sucesso e estoque atualizado."
-    conn.close()
+    # A movimentação e a mudança de status são gravadas na mesma transação.
+    cursor.execute("UPDATE pedidos SET status = 'aprovado', aprovador_id = ?, data_decisao = CURRENT_TIMESTAMP WHERE id = ?", (aprovador_id, pedido_id))
+    return True, f"Pedido #{pedido_id} aprovado com sucesso e estoque atualizado."
+
+def _rejeitar_no_cursor(cursor, pedido_id: int, aprovador_id: int, motivo: str):
+    """Rejeita o pedido no cursor informado, sem commit. Retorna (sucesso, mensagem)."""
+    cursor.execute(
+        "UPDATE pedidos SET status = 'rejeitado', aprovador_id = ?, data_decisao = CURRENT_TIMESTAMP, motivo_rejeicao = ? WHERE id = ? AND status = 'pendente'",
+        (aprovador_id, motivo, pedido_id)
+    )
+    if cursor.rowcount == 0:
+        return False, "Pedido não encontrado ou já processado."
+    return True, "Pedido rejeitado com sucesso."
+
+def aprovar_pedido(pedido_id: int, aprovador_id: int):
+    try:
+        # Movimentação, status do pedido e log num único commit.
+        with transacao() as conn:
+            sucesso, msg = _aprovar_no_cursor(conn.cursor(), pedido_id, aprovador_id)
+            if sucesso:
+                registrar_log(aprovador_id, "APROVAR_PEDIDO", f"Pedido ID: {pedido_id}")
+    except Exception as e:
+        return False, f"Erro ao aprovar pedido: {e}"
     return sucesso, msg
 
 def rejeitar_pedido(pedido_id: int, aprovador_id: int, motivo: str):
     """Altera o status de um pedido para 'rejeitado'."""
-    conn = conectar_bd()
-    if not conn: return False, "Falha na conexão com o banco de dados."
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM pedidos WHERE id = ? AND status = 'pendente'", (pedido_id,))
-    pedido = cursor.fetchone()
-    if not pedido:
-        conn.close()
-        return False, "Pedido não encontrado ou já processado."
+    try:
+        with transacao() as conn:
+            sucesso, msg = _rejeitar_no_cursor(conn.cursor(), pedido_id, aprovador_id, motivo)
+            if sucesso:
+                registrar_log(aprovador_id, "REJEITAR_PEDIDO", f"Pedido ID: {pedido_id}, Motivo: {motivo}")
+    except Exception as e:
+        return False, f"Erro ao rejeitar pedido: {e}"
+    return sucesso, msg
 
-    cursor.execute("UPDATE pedidos SET status = 'rejeitado', aprovador_id = ?, data_decisao = CURRENT_TIMESTAMP, motivo_rejeicao = ? WHERE id = ?", (aprovador_id, motivo, pedido_id))
-    conn.commit()
-    registrar_log(aprovador_id, "REJEITAR_PEDIDO", f"Pedido ID: {pedido_id}, Motivo: {motivo}")
-    conn.close()
-    return True, "Pedido rejeitado com sucesso."
+# Número máximo de pedidos processados numa única chamada em lote
+LIMITE_PEDIDOS_LOTE = 500
+
+def processar_pedidos_em_lote(pedido_ids, acao: str, aprovador_id: int, motivo: str = ""):
+    """
+    Aprova ou rejeita vários pedidos numa única transação. Cada pedido roda no seu próprio savepoint:
+    um pedido que falha (ex.: estoque insuficiente) é desfeito sozinho, sem impedir os demais, e a
+    movimentação de estoque de cada pedido sempre é gravada junto com a mudança de status.
+    Retorna a lista de resultados por pedido: [{"pedido_id", "sucesso", "mensagem"}, ...].
+    """
+    if acao not in ('aprovar', 'rejeitar'):
+        raise ValueError(f"Ação inválida: {acao}")
+    pedido_ids = list(dict.fromkeys(pedido_ids))[:LIMITE_PEDIDOS_LOTE]  # sem repetidos, na ordem recebida
+
+    resultados = []
+    try:
+        with transacao() as conn:
+            cursor = conn.cursor()
+            for pedido_id in pedido_ids:
+                cursor.execute("SAVEPOINT pedido")
+                try:
+                    if acao == 'aprovar':
+                        sucesso, msg = _aprovar_no_cursor(cursor, pedido_id, aprovador_id)
+                    else:
+                        sucesso, msg = _rejeitar_no_cursor(cursor, pedido_id, aprovador_id, motivo)
+                except sqlite3.Error as e:
+                    sucesso, msg = False, f"Erro ao processar pedido: {e}"
+                if not sucesso:
+                    cursor.execute("ROLLBACK TO pedido")
+                elif acao == 'aprovar':
+                    registrar_log(aprovador_id, "APROVAR_PEDIDO", f"Pedido ID: {pedido_id} (lote)")
+                else:
+                    registrar_log(aprovador_id, "REJEITAR_PEDIDO", f"Pedido ID: {pedido_id}, Motivo: {motivo} (lote)")
+                cursor.execute("RELEASE pedido")
+                resultados.append({"pedido_id": pedido_id, "sucesso": sucesso, "mensagem": msg})
+    except Exception as e:
+        return [{"pedido_id": pedido_id, "sucesso": False, "mensagem": f"Erro ao processar o lote: {e}"} for pedido_id in pedido_ids]
+    return resultados
 
 def get_pedidos_por_solicitante(solicitante_id: int):
     """Busca todos os pedidos feitos por um usuário específico."""
@@ -1,14 +1,47 @@
 # relatorios.py
-from database import conectar_bd
+import os
+import time
+import base64
+import binascii
+from datetime import date, timedelta
+from database import conectar_bd, ler_contador, verificar_valor_estoque
 
-def get_todas_movimentacoes(page=1, per_page=15):
-    """Busca todas as movimentações do estoque de forma paginada."""
+def _codificar_cursor(mov):
+    """Gera o token de paginação (opaco para o navegador) a partir da chave (data, id)."""
+    return base64.urlsafe_b64encode(f"{mov['data']}|{mov['id']}".encode()).decode()
+
+def _decodificar_cursor(token):
+    """Retorna a chave (data, id) de um token, ou None se o token for inválido."""
+    try:
+        data, mov_id = base64.urlsafe_b64decode(token.encode()).decode().rsplit("|", 1)
+        return data, int(mov_id)
+    except (ValueError, binascii.Error, UnicodeError):
+        return None
+
+def get_todas_movimentacoes(cursor_pagina=None, direcao="proximo", per_page=15):
+    """
+    Busca as movimentações do estoque, da mais recente para a mais antiga, paginadas por cursor.
+    A página é localizada pela chave (data, id) da última linha vista, e não por OFFSET,
+    de modo que o custo não cresce com a profundidade da página.
+    """
+    vazio = {"movimentacoes": [], "total": 0, "per_page": per_page, "proximo": None, "anterior": None}
     conn = conectar_bd()
     if not conn:
-        return []
+        return vazio
+
+    chave = _decodificar_cursor(cursor_pagina) if cursor_pagina else None
+    if chave is None:
+        filtro, ordem, voltando = "", "DESC", False
+        params = (per_page + 1,)
+    elif direcao == "anterior":
+        filtro, ordem, voltando = "WHERE (m.data, m.id) > (?, ?)", "ASC", True
+        params = (*chave, per_page + 1)
+    else:
+        filtro, ordem, voltando = "WHERE (m.data, m.id) < (?, ?)", "DESC", False
+        params = (*chave, per_page + 1)
 
     cursor = conn.cursor()
-    cursor.execute("""
+    cursor.execute(f"""
         SELECT 
             m.id,
             m.data,
@@ -20,23 +53,47 @@ def get_todas_movimentacoes(page=1, per_page=15):
         FROM movimentacoes m
         JOIN itens_estoque i ON m.item_id = i.id
         JOIN usuarios u ON m.usuario_id = u.id
-        ORDER BY m.data DESC
-        LIMIT ? OFFSET ?
-    """, (per_page, (page - 1) * per_page))
+        {filtro}
+        ORDER BY m.data {ordem}, m.id {ordem}
+        LIMIT ?
+    """, params)
     movimentacoes = [dict(row) for row in cursor.fetchall()]
 
-    # Pega o total de registros para calcular o total de páginas
-    cursor.execute("SELECT COUNT(*) as total FROM movimentacoes")
-    total = cursor.fetchone()['total']
+    # Uma linha a mais que o tamanho da página indica se existe outra página na mesma direção
+    ha_mais = len(movimentacoes) > per_page
+    movimentacoes = movimentacoes[:per_page]
+    if voltando:
+        movimentacoes.reverse()
 
+    # O total é mantido por trigger na tabela de contadores, sem COUNT(*) a cada página
+    total = ler_contador(cursor, 'movimentacoes')
     conn.close()
+
+    proximo = anterior = None
+    if movimentacoes:
+        if ha_mais or voltando:
+            proximo = _codificar_cursor(movimentacoes[-1])
+        if (ha_mais and voltando) or (chave is not None and not voltando):
+            anterior = _codificar_cursor(movimentacoes[0])
+
     return {
         "movimentacoes": movimentacoes,
         "total": total,
-        "page": page,
-        "per_page": per_page
+        "per_page": per_page,
+        "proximo": proximo,
+        "anterior": anterior
     }
 
+def iterar_movimentacoes(tamanho_lote=500):
+    """Percorre todo o histórico (mais recente primeiro) em lotes, sem carregá-lo inteiro na memória."""
+    cursor_pagina = None
+    while True:
+        pagina = get_todas_movimentacoes(cursor_pagina=cursor_pagina, per_page=tamanho_lote)
+        yield from pagina['movimentacoes']
+        cursor_pagina = pagina['proximo']
+        if not cursor_pagina:
+            break
+
 def get_ultimas_movimentacoes(limit=5):
     """Busca as últimas N movimentações do estoque."""
     conn = conectar_bd()
@@ -72,8 +129,10 @@ def get_dados_graficos():
 
     cursor = conn.cursor()
 
+    # Os totais vêm das tabelas de resumo, mantidas por triggers a cada movimentação
+
     # 1. Dados para o gráfico de movimentações por tipo
-    cursor.execute("SELECT tipo, COUNT(*) as count FROM movimentacoes GROUP BY tipo")
+    cursor.execute("SELECT tipo, total_movimentacoes as count FROM resumo_movimentacoes_tipo WHERE total_movimentacoes > 0 ORDER BY tipo")
     mov_por_tipo_raw = cursor.fetchall()
     mov_por_tipo = {
         "labels": [row['tipo'].capitalize() for row in mov_por_tipo_raw],
@@ -82,12 +141,11 @@ def get_dados_graficos():
 
     # 2. Dados para o gráfico de top 5 itens com mais saída (por quantidade)
     cursor.execute("""
-        SELECT i.nome, SUM(m.quantidade) as total_saida
-        FROM movimentacoes m
-        JOIN itens_estoque i ON m.item_id = i.id
-        WHERE m.tipo = 'saida'
-        GROUP BY i.nome
-        ORDER BY total_saida DESC
+        SELECT i.nome, r.quantidade_total as total_saida
+        FROM resumo_movimentacoes_item r
+        JOIN itens_estoque i ON r.item_id = i.id
+        WHERE r.tipo = 'saida' AND r.total_movimentacoes > 0
+        ORDER BY r.quantidade_total DESC
         LIMIT 5
     """)
     top_saidas_raw = cursor.fetchall()
@@ -99,20 +157,24 @@ def get_dados_graficos():
     conn.close()
     return {"mov_por_tipo": mov_por_tipo, "top_saidas": top_saidas}
 
+# Intervalo mínimo entre as conferências do valor acumulado com a soma real dos itens
+INTERVALO_VERIFICACAO_VALOR_S = int(os.environ.get("ESTOQUE_VERIFICACAO_VALOR_MIN", 60)) * 60
+_ultima_verificacao_valor = time.monotonic()
+
 def relatorio_saldo_geral():
-    """Calcula e retorna o valor total do estoque."""
+    """Retorna o valor total do estoque (contador mantido por triggers em itens_estoque)."""
+    global _ultima_verificacao_valor
+    if time.monotonic() - _ultima_verificacao_valor >= INTERVALO_VERIFICACAO_VALOR_S:
+        _ultima_verificacao_valor = time.monotonic()
+        verificar_valor_estoque()
+
     conn = conectar_bd()
     if not conn: 
         return 0.0
 
-    cursor = conn.cursor()
-    # Calcula o valor total (quantidade * preço unitário) para cada item e soma tudo
-    cursor.execute("SELECT SUM(quantidade * preco_unitario) as valor_total FROM itens_estoque")
-    resultado = cursor.fetchone()
+    valor_total = ler_contador(conn.cursor(), 'valor_estoque')
     conn.close()
-
-    valor_total = resultado['valor_total'] if resultado['valor_total'] else 0.0
-    return valor_total
+    return float(valor_total or 0.0)
 
 def get_movimentacoes_do_dia():
     """Calcula o total de entradas e saídas do dia atual."""
@@ -122,16 +184,74 @@ def get_movimentacoes_do_dia():
 
     cursor = conn.cursor()
 
-    # Total de entradas no dia
-    cursor.execute("SELECT SUM(quantidade) as total FROM movimentacoes WHERE tipo = 'entrada' AND DATE(data, 'localtime') = DATE('now', 'localtime')")
-    entrada_dia = cursor.fetchone()['total'] or 0
-
-    # Total de saídas no dia
-    cursor.execute("SELECT SUM(quantidade) as total FROM movimentacoes WHERE tipo = 'saida' AND DATE(data, 'localtime') = DATE('now', 'localtime')")
-    saida_dia = cursor.fetchone()['total'] or 0
+    # Lê apenas as linhas do dia no resumo diário (chave dia, item, tipo), sem varrer o histórico
+    cursor.execute("""
+        SELECT tipo, SUM(quantidade_total) as total
+        FROM resumo_movimentacoes_diario
+        WHERE dia = DATE('now', 'localtime')
+        GROUP BY tipo
+    """)
+    totais = {row['tipo']: row['total'] for row in cursor.fetchall()}
 
     conn.close()
     return {
-        "total_entrada": entrada_dia,
-        "total_saida": saida_dia
+        "total_entrada": totais.get('entrada') or 0,
+        "total_saida": totais.get('saida') or 0
+    }
+
+GRANULARIDADES = ('dia', 'semana', 'mes')
+
+def _inicio_periodo(dia: date, granularidade: str) -> date:
+    if granularidade == 'semana':
+        return dia - timedelta(days=dia.weekday())  # semanas começam na segunda-feira
+    if granularidade == 'mes':
+        return dia.replace(day=1)
+    return dia
+
+def _proximo_periodo(inicio: date, granularidade: str) -> date:
+    if granularidade == 'semana':
+        return inicio + timedelta(days=7)
+    if granularidade == 'mes':
+        return (inicio.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return inicio + timedelta(days=1)
+
+def get_serie_movimentacoes(inicio: date, fim: date, granularidade='dia', item_id=None):
+    """
+    Série temporal de entradas e saídas (quantidades) entre `inicio` e `fim`, inclusive,
+    agrupada por dia, semana ou mês. Períodos sem movimentação aparecem com zero.
+    """
+    if granularidade not in GRANULARIDADES:
+        raise ValueError(f"Granularidade inválida: {granularidade}")
+    if fim < inicio:
+        raise ValueError("A data final deve ser posterior à inicial.")
+
+    # Todos os períodos do intervalo, já zerados, para preencher as lacunas
+    periodos = {}
+    atual = _inicio_periodo(inicio, granularidade)
+    while atual <= fim:
+        periodos[atual] = {"entrada": 0, "saida": 0}
+        atual = _proximo_periodo(atual, granularidade)
+
+    conn = conectar_bd()
+    if conn:
+        cursor = conn.cursor()
+        filtro_item = "AND item_id = ?" if item_id else ""
+        cursor.execute(f"""
+            SELECT dia, tipo, SUM(quantidade_total) as total
+            FROM resumo_movimentacoes_diario
+            WHERE dia BETWEEN ? AND ? {filtro_item}
+            GROUP BY dia, tipo
+        """, (inicio.isoformat(), fim.isoformat(), *((item_id,) if item_id else ())))
+        for row in cursor.fetchall():
+            periodo = _inicio_periodo(date.fromisoformat(row['dia']), granularidade)
+            # Compras efetivadas entram no estoque, então somam como entrada
+            chave = 'saida' if row['tipo'] == 'saida' else 'entrada'
+            periodos[periodo][chave] += row['total']
+        conn.close()
+
+    return {
+        "granularidade": granularidade,
+        "labels": [periodo.isoformat() for periodo in periodos],
+        "entradas": [valores['entrada'] for valores in periodos.values()],
+        "saidas": [valores['saida'] for valores in periodos.values()]
     }
@@ -0,0 +1,223 @@
+# relatorios_pdf.py
+import zlib
+import relatorios
+import pedidos
+
+# A4 em paisagem, em pontos (1/72 pol.)
+LARGURA, ALTURA = 842, 595
+MARGEM = 36
+COR_TITULO = "0.173 0.243 0.314"  # #2c3e50, a mesma cor usada nos relatórios HTML
+COR_ZEBRA = "0.949 0.949 0.949"   # #f2f2f2
+
+class EscritorPDF:
+    """
+    Gera um PDF simples (texto, linhas e retângulos) página a página, sem programas externos.
+    Cada método devolve os bytes a serem enviados, então o documento pode ser transmitido
+    enquanto é produzido; só os deslocamentos dos objetos ficam em memória.
+    """
+
+    def __init__(self, titulo):
+        self.titulo = titulo
+        self._posicao = 0
+        self._deslocamentos = {}
+        self._paginas = []
+        self._proximo_objeto = 5  # 1: catálogo, 2: árvore de páginas, 3 e 4: fontes
+
+    def _objeto(self, numero, conteudo: bytes) -> bytes:
+        self._deslocamentos[numero] = self._posicao
+        dados = b"%d 0 obj\n" % numero + conteudo + b"\nendobj\n"
+        self._posicao += len(dados)
+        return dados
+
+    def _novo_objeto(self):
+        numero = self._proximo_objeto
+        self._proximo_objeto += 1
+        return numero
+
+    def inicio(self) -> bytes:
+        """Cabeçalho, catálogo e fontes (Helvetica com acentuação WinAnsi)."""
+        cabecalho = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+        self._posicao = len(cabecalho)
+        return (
+            cabecalho
+            + self._objeto(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+            + self._objeto(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+            + self._objeto(4, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>")
+        )
+
+    def pagina(self, comandos) -> bytes:
+        """Grava uma página a partir da lista de comandos de desenho (operadores PDF)."""
+        fluxo = zlib.compress("\n".join(comandos).encode("cp1252", errors="replace"))
+        numero_conteudo = self._novo_objeto()
+        numero_pagina = self._novo_objeto()
+        self._paginas.append(numero_pagina)
+        return (
+            self._objeto(numero_conteudo, b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(fluxo) + fluxo + b"\nendstream")
+            + self._objeto(numero_pagina, (
+                "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+                "/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>"
+                % (LARGURA, ALTURA, numero_conteudo)).encode())
+        )
+
+    def fim(self) -> bytes:
+        """Árvore de páginas, metadados, tabela de referências cruzadas e trailer."""
+        filhos = " ".join("%d 0 R" % n for n in self._paginas)
+        dados = self._objeto(2, ("<< /Type /Pages /Kids [%s] /Count %d >>" % (filhos, len(self._paginas))).encode())
+        numero_info = self._novo_objeto()
+        dados += self._objeto(numero_info, b"<< /Title " + _texto_pdf(self.titulo) + b" /Producer (WS Construct) >>")
+
+        inicio_xref = self._posicao
+        xref = [b"xref\n0 %d\n" % self._proximo_objeto, b"0000000000 65535 f \n"]
+        for numero in range(1, self._proximo_objeto):
+            xref.append(b"%010d 00000 n \n" % self._deslocamentos[numero])
+        xref.append(b"trailer\n<< /Size %d /Root 1 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                    % (self._proximo_objeto, numero_info, inicio_xref))
+        return dados + b"".join(xref)
+
+def _texto_pdf(texto) -> bytes:
+    """Converte um texto em string literal PDF, escapando os caracteres especiais."""
+    bruto = str(texto).encode("cp1252", errors="replace")
+    return b"(" + bruto.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+def _cortar(texto, largura, tamanho):
+    """Corta o texto para caber na largura da coluna (largura média aproximada da Helvetica)."""
+    texto = " ".join(str(texto if texto is not None else "").split())
+    maximo = int(largura / (tamanho * 0.5))
+    return texto if len(texto) <= maximo else texto[:max(maximo - 3, 0)] + "..."
+
+def formatar_moeda(valor):
+    """Formata no padrão brasileiro: 1.234,56."""
+    return "{:,.2f}".format(float(valor or 0)).replace(",", "X").replace(".", ",").replace("X", ".")
+
+class _Pagina:
+    """Acumula os comandos de desenho de uma página."""
+
+    def __init__(self):
+        self.comandos = []
+
+    def texto(self, x, y, texto, tamanho=9, negrito=False, cor="0 0 0"):
+        fonte = "F2" if negrito else "F1"
+        self.comandos.append(f"BT {cor} rg /{fonte} {tamanho} Tf {x:.1f} {y:.1f} Td "
+                             + _texto_pdf(texto).decode("cp1252") + " Tj ET")
+
+    def texto_centralizado(self, y, texto, tamanho=9, negrito=False, cor="0 0 0"):
+        x = (LARGURA - len(str(texto)) * tamanho * 0.5) / 2
+        self.texto(max(x, MARGEM), y, texto, tamanho, negrito, cor)
+
+    def retangulo(self, x, y, largura, altura, cor):
+        self.comandos.append(f"{cor} rg {x:.1f} {y:.1f} {largura:.1f} {altura:.1f} re f")
+
+    def linha(self, x1, y1, x2, y2, cor="0.867 0.867 0.867"):
+        self.comandos.append(f"{cor} RG 0.5 w {x1:.1f} {y1:.1f} m {x2:.1f} {y2:.1f} l S")
+
+class _Tabela:
+    """
+    Distribui as linhas de uma tabela pelas páginas, repetindo o cabeçalho a cada página.
+    `adicionar()` devolve os bytes das páginas que ficaram completas (ou b"").
+    """
+    ALTURA_LINHA = 16
+
+    def __init__(self, doc, colunas, primeira_pagina=None, y_inicial=None):
+        self.doc = doc
+        self.colunas = colunas  # lista de (título, largura)
+        self.numero_pagina = 0
+        self.linhas_na_pagina = 0
+        self._nova_pagina(primeira_pagina, y_inicial)
+
+    def _nova_pagina(self, pagina=None, y_inicial=None):
+        self.numero_pagina += 1
+        self.pagina = pagina or _Pagina()
+        self.y = y_inicial if y_inicial is not None else ALTURA - MARGEM
+        self.linhas_na_pagina = 0
+        self.pagina.texto(MARGEM, MARGEM / 2, f"{self.doc.titulo} - Página {self.numero_pagina}", tamanho=7, cor="0.4 0.4 0.4")
+        # Cabeçalho da tabela
+        self.y -= self.ALTURA_LINHA
+        self.pagina.retangulo(MARGEM, self.y - 4, LARGURA - 2 * MARGEM, self.ALTURA_LINHA, COR_TITULO)
+        x = MARGEM
+        for titulo, largura in self.colunas:
+            self.pagina.texto(x + 4, self.y, titulo, negrito=True, cor="1 1 1")
+            x += largura
+
+    def _fechar_pagina(self):
+        return self.doc.pagina(self.pagina.comandos)
+
+    def adicionar(self, valores) -> bytes:
+        saida = b""
+        if self.y - self.ALTURA_LINHA < MARGEM:
+            saida = self._fechar_pagina()
+            self._nova_pagina()
+        self.y -= self.ALTURA_LINHA
+        if self.linhas_na_pagina % 2:
+            self.pagina.retangulo(MARGEM, self.y - 4, LARGURA - 2 * MARGEM, self.ALTURA_LINHA, COR_ZEBRA)
+        x = MARGEM
+        for (_, largura), valor in zip(self.colunas, valores):
+            self.pagina.texto(x + 4, self.y, _cortar(valor, largura - 8, 9))
+            x += largura
+        self.pagina.linha(MARGEM, self.y - 4, LARGURA - MARGEM, self.y - 4)
+        self.linhas_na_pagina += 1
+        return saida
+
+    def vazia(self, mensagem):
+        self.y -= self.ALTURA_LINHA
+        self.pagina.texto_centralizado(self.y, mensagem, cor="0.4 0.4 0.4")
+
+    def finalizar(self) -> bytes:
+        return self._fechar_pagina() + self.doc.fim()
+
+def gerar_pdf_movimentacoes(valor_total, ao_avancar=None):
+    """
+    Gera, em pedaços de bytes, o PDF do histórico de movimentações (lido do banco em lotes).
+    `ao_avancar(linhas)` é chamado a cada página concluída, para acompanhar o progresso.
+    """
+    doc = EscritorPDF("Relatório de Movimentações de Estoque")
+    yield doc.inicio()
+
+    capa = _Pagina()
+    y = ALTURA - MARGEM - 20
+    capa.texto_centralizado(y, "Relatório de Movimentações de Estoque", tamanho=18, negrito=True, cor=COR_TITULO)
+    capa.linha(MARGEM, y - 10, LARGURA - MARGEM, y - 10, cor=COR_TITULO)
+    capa.retangulo(LARGURA / 4, y - 70, LARGURA / 2, 48, COR_ZEBRA)
+    capa.texto_centralizado(y - 38, "Valor Total em Estoque", tamanho=11, negrito=True, cor=COR_TITULO)
+    capa.texto_centralizado(y - 60, f"R$ {formatar_moeda(valor_total)}", tamanho=16, negrito=True)
+    capa.texto_centralizado(y - 100, "Histórico de Movimentações", tamanho=13, negrito=True, cor=COR_TITULO)
+
+    tabela = _Tabela(doc, [("Data", 110), ("Item", 170), ("Tipo", 60), ("Quantidade", 70), ("Usuário", 100), ("Observação", 260)],
+                     primeira_pagina=capa, y_inicial=y - 110)
+    linhas = 0
+    for mov in relatorios.iterar_movimentacoes():
+        linhas += 1
+        pedaco = tabela.adicionar([mov['data'].split('.')[0], mov['item_nome'], mov['tipo'].capitalize(),
+                                   mov['quantidade'], mov['usuario_nome'], mov['observacao']])
+        if pedaco:
+            if ao_avancar:
+                ao_avancar(linhas)
+            yield pedaco
+    if not linhas:
+        tabela.vazia("Nenhuma movimentação registrada.")
+    yield tabela.finalizar()
+
+def gerar_pdf_obra(obra):
+    """Gera, em pedaços de bytes, o PDF dos materiais enviados para uma obra."""
+    doc = EscritorPDF(f"Relatório de Materiais - {obra['nome']}")
+    yield doc.inicio()
+
+    capa = _Pagina()
+    y = ALTURA - MARGEM - 20
+    capa.texto_centralizado(y, "Relatório de Materiais da Obra", tamanho=18, negrito=True, cor=COR_TITULO)
+    capa.texto_centralizado(y - 22, f"Obra: {obra['nome']}", tamanho=11)
+    capa.texto_centralizado(y - 38, f"Localização: {obra['localizacao'] or ''}", tamanho=11)
+    capa.linha(MARGEM, y - 48, LARGURA - MARGEM, y - 48, cor=COR_TITULO)
+    capa.texto(MARGEM, y - 74, "Histórico de Materiais Enviados", tamanho=13, negrito=True, cor=COR_TITULO)
+
+    tabela = _Tabela(doc, [("Data", 160), ("Item", 320), ("Quantidade", 110), ("Solicitante", 180)],
+                     primeira_pagina=capa, y_inicial=y - 84)
+    vazio = True
+    for material in pedidos.iterar_materiais_por_obra(obra['id']):
+        vazio = False
+        pedaco = tabela.adicionar([material['data'].split(' ')[0], material['item_nome'],
+                                   material['quantidade'], material['usuario_nome']])
+        if pedaco:
+            yield pedaco
+    if vazio:
+        tabela.vazia("Nenhum material foi enviado para esta obra ainda.")
+    yield tabela.finalizar()
@@ -0,0 +1,113 @@
+# servidor.py
+"""
+Servidor de produção da aplicação.
+
+Uso (a partir da raiz do projeto):
+    python servidor.py [--bind 0.0.0.0:8000] [--workers N] [--threads N]
+
+Com o gunicorn (Linux), sobe vários processos (workers) com várias threads cada. A inicialização
+(migrações, verificações e aquecimento dos caches) roda uma única vez, no processo principal, antes
+de criar os workers. No encerramento (SIGTERM), cada worker termina as requisições em andamento e
+grava o que ainda estiver em memória (fila de auditoria, tarefas em execução); as tarefas que ele não
+conseguir concluir a tempo são marcadas como erro.
+Sem o gunicorn (ex.: Windows), usa o waitress: um único processo, com várias threads.
+"""
+import os
+import sys
+import argparse
+
+import database
+import logs
+import tarefas
+import estoque
+import gerenciamento
+import pedidos
+from app import app, inicializar_sistema
+
+# Endereço e porta em que o servidor escuta.
+BIND_PADRAO = os.environ.get("ESTOQUE_BIND", "0.0.0.0:8000")
+
+# Processos (workers) e threads por processo.
+WORKERS_PADRAO = int(os.environ.get("ESTOQUE_WORKERS", os.cpu_count() or 1))
+THREADS_PADRAO = int(os.environ.get("ESTOQUE_THREADS", 4))
+
+# Tempo (s) para terminar as requisições e tarefas em andamento ao encerrar.
+TIMEOUT_ENCERRAMENTO = int(os.environ.get("ESTOQUE_TIMEOUT_ENCERRAMENTO", 30))
+
+def aquecer():
+    """Carrega os caches do catálogo, que os workers herdam prontos do processo principal."""
+    estoque.listar_itens()
+    gerenciamento.listar_descricoes()
+    pedidos.contar_pedidos_pendentes()
+
+def preparar():
+    """Inicialização feita uma única vez, antes de criar os workers."""
+    inicializar_sistema()
+    aquecer()
+    # Nada de conexões abertas nem registros na fila atravessando o fork.
+    logs.descarregar()
+    database.fechar_pool()
+
+def encerrar():
+    """Encerramento de um processo: aguarda as tarefas em execução e grava a fila de auditoria."""
+    tarefas.encerrar(TIMEOUT_ENCERRAMENTO)
+    logs.descarregar()
+    database.fechar_pool()
+
+def _servir_gunicorn(bind, workers, threads):
+    from gunicorn.app.base import BaseApplication
+
+    class _Aplicacao(BaseApplication):
+        def load_config(self):
+            opcoes = {
+                "bind": bind,
+                "workers": workers,
+                "threads": threads,
+                "worker_class": "gthread",
+                "preload_app": True,
+                "graceful_timeout": TIMEOUT_ENCERRAMENTO,
+                "worker_exit": lambda servidor, worker: encerrar(),
+            }
+            for chave, valor in opcoes.items():
+                self.cfg.set(chave, valor)
+
+        def load(self):
+            # Com preload_app, roda no processo principal, antes do fork.
+            preparar()
+            return app
+
+    _Aplicacao().run()
+
+def _servir_waitress(bind, threads):
+    import waitress
+
+    preparar()
+    try:
+        waitress.serve(app, listen=bind, threads=threads)
+    finally:
+        encerrar()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bind", default=BIND_PADRAO)
+    parser.add_argument("--workers", type=int, default=WORKERS_PADRAO)
+    parser.add_argument("--threads", type=int, default=THREADS_PADRAO)
+    args = parser.parse_args()
+
+    try:
+        import gunicorn.app.base  # noqa: F401 (não funciona no Windows)
+    except ImportError:
+        try:
+            import waitress  # noqa: F401
+        except ImportError:
+            sys.exit("Instale o gunicorn (Linux) ou o waitress (Windows): pip install gunicorn / pip install waitress")
+        print(f"gunicorn indisponível; usando o waitress em {args.bind} ({args.threads} threads).")
+        _servir_waitress(args.bind, args.threads)
+        return
+
+    # O gunicorn lê sys.argv; os argumentos já foram tratados acima.
+    sys.argv = sys.argv[:1]
+    _servir_gunicorn(args.bind, args.workers, args.threads)
+
+if __name__ == "__main__":
+    main()
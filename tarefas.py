@@ -0,0 +1,256 @@
+# tarefas.py
+import os
+import json
+import uuid
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, wait
+from database import conectar_bd, ler_contador, executar_escrita
+import relatorios
+import relatorios_pdf
+import pedidos
+import excel_handler
+
+# Pasta onde ficam os arquivos gerados pelas tarefas (um arquivo por tarefa).
+PASTA_RESULTADOS = os.environ.get("ESTOQUE_PASTA_EXPORTACOES", "exportacoes")
+
+# Por quanto tempo um arquivo gerado fica disponível para download.
+VALIDADE_RESULTADO_MIN = int(os.environ.get("ESTOQUE_VALIDADE_EXPORTACAO_MIN", 60))
+
+# Intervalo (s) entre as tentativas de iniciar uma tarefa cujo tipo já está no limite de execuções.
+INTERVALO_RESERVA_S = 1.0
+
+# Tarefas em execução há mais tempo que isso não contam no limite (o processo que as executava pode
+# ter morrido sem atualizá-las).
+TEMPO_MAXIMO_EXECUCAO_MIN = int(os.environ.get("ESTOQUE_TEMPO_MAXIMO_TAREFA_MIN", 30))
+
+# Tipos de tarefa registrados: tipo -> (função executora, extensão, mimetype, limite, pool de threads do tipo).
+# O limite de execuções simultâneas vale para todos os processos (workers): é conferido na tabela tarefas.
+_tipos = {}
+
+# Sinaliza o encerramento do processo às tarefas que aguardam a vez de executar.
+_encerrando = threading.Event()
+
+# Execuções agendadas neste processo e ainda não terminadas: futuro -> ID da tarefa (para o
+# encerramento do processo aguardá-las e marcar como erro as que não terminarem).
+_em_andamento = {}
+_em_andamento_lock = threading.Lock()
+
+def registrar_tipo(tipo: str, extensao: str, mimetype: str, limite_simultaneas: int = 1):
+    """
+    Registra a função executora de um tipo de tarefa.
+    A função recebe (parametros, caminho_destino, progresso) e retorna o nome do arquivo para download.
+    `limite_simultaneas` é o máximo de execuções do tipo ao mesmo tempo, somando todos os workers.
+    """
+    def decorador(funcao):
+        executor = ThreadPoolExecutor(max_workers=limite_simultaneas, thread_name_prefix=f"tarefa-{tipo}")
+        _tipos[tipo] = (funcao, extensao, mimetype, limite_simultaneas, executor)
+        return funcao
+    return decorador
+
+def _agora_sql(minutos: int = 0):
+    """Data/hora UTC no formato do CURRENT_TIMESTAMP do SQLite, deslocada em `minutos`."""
+    return (datetime.now(timezone.utc) + timedelta(minutes=minutos)).strftime("%Y-%m-%d %H:%M:%S")
+
+def _atualizar(tarefa_id: str, **campos):
+    conn = conectar_bd()
+    if not conn: return
+    try:
+        atribuicoes = ", ".join(f"{campo} = ?" for campo in campos)
+        conn.execute(f"UPDATE tarefas SET {atribuicoes} WHERE id = ?", (*campos.values(), tarefa_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+def _reservar(tarefa_id: str, tipo: str, limite: int):
+    """Passa a tarefa para 'executando' se o tipo estiver abaixo do limite, contando todos os processos."""
+    def reservar(cursor):
+        cursor.execute("""
+            UPDATE tarefas SET status = 'executando', iniciada_em = ?
+            WHERE id = ? AND status = 'pendente'
+              AND (SELECT COUNT(*) FROM tarefas
+                   WHERE tipo = ? AND status = 'executando' AND iniciada_em >= ?) < ?
+        """, (_agora_sql(), tarefa_id, tipo, _agora_sql(-TEMPO_MAXIMO_EXECUCAO_MIN), limite))
+        return cursor.rowcount == 1
+    return executar_escrita(reservar)
+
+def _executar(tarefa_id: str, tipo: str, parametros: dict):
+    funcao, extensao, mimetype, limite, _ = _tipos[tipo]
+    # Com o tipo no limite (em qualquer worker), a tarefa continua pendente e tenta de novo.
+    try:
+        while not _reservar(tarefa_id, tipo, limite):
+            tarefa = get_tarefa(tarefa_id)
+            if not tarefa or tarefa['status'] != 'pendente' or _encerrando.wait(INTERVALO_RESERVA_S):
+                return
+    except Exception as e:
+        # Sem isso, uma falha ao reservar (ex.: banco ocupado) deixaria a tarefa pendente para sempre.
+        logging.exception(f"Erro ao iniciar a tarefa {tarefa_id} ({tipo})")
+        _atualizar(tarefa_id, status='erro', erro=f"Não foi possível iniciar a tarefa: {e}", concluida_em=_agora_sql())
+        return
+
+    os.makedirs(PASTA_RESULTADOS, exist_ok=True)
+    destino = os.path.join(PASTA_RESULTADOS, tarefa_id + extensao)
+
+    ultimo = {"percentual": 0}
+    def progresso(percentual):
+        # Só grava quando o percentual inteiro muda, para o progresso não virar carga de escrita.
+        percentual = max(0, min(99, int(percentual)))
+        if percentual != ultimo["percentual"]:
+            ultimo["percentual"] = percentual
+            _atualizar(tarefa_id, progresso=percentual)
+
+    try:
+        nome_arquivo = funcao(parametros, destino, progresso)
+        _atualizar(tarefa_id, status='concluida', progresso=100, arquivo=destino, nome_arquivo=nome_arquivo,
+                   mimetype=mimetype, concluida_em=_agora_sql(), expira_em=_agora_sql(VALIDADE_RESULTADO_MIN))
+    except Exception as e:
+        logging.exception(f"Erro na tarefa {tarefa_id} ({tipo})")
+        if os.path.exists(destino):
+            os.remove(destino)
+        _atualizar(tarefa_id, status='erro', erro=str(e), concluida_em=_agora_sql())
+
+def enviar(tipo: str, parametros: dict, usuario_id: int):
+    """Cria a tarefa no banco, agenda sua execução e retorna o seu ID."""
+    if tipo not in _tipos:
+        raise ValueError(f"Tipo de tarefa desconhecido: {tipo}")
+    limpar_expiradas()
+
+    tarefa_id = uuid.uuid4().hex
+    conn = conectar_bd()
+    if not conn:
+        raise RuntimeError("Falha na conexão com o banco de dados.")
+    try:
+        conn.execute(
+            "INSERT INTO tarefas (id, tipo, parametros, usuario_id) VALUES (?, ?, ?, ?)",
+            (tarefa_id, tipo, json.dumps(parametros), usuario_id)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    executor = _tipos[tipo][4]
+    futuro = executor.submit(_executar, tarefa_id, tipo, parametros)
+    with _em_andamento_lock:
+        _em_andamento[futuro] = tarefa_id
+    futuro.add_done_callback(_descartar)
+    return tarefa_id
+
+def _descartar(futuro):
+    # As canceladas no encerramento ficam, para serem marcadas como erro (ver encerrar).
+    if not futuro.cancelled():
+        with _em_andamento_lock:
+            _em_andamento.pop(futuro, None)
+
+def _ler_tarefa(tarefa_id: str):
+    conn = conectar_bd()
+    if not conn: return None
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM tarefas WHERE id = ?", (tarefa_id,))
+    tarefa = cursor.fetchone()
+    conn.close()
+    return dict(tarefa) if tarefa else None
+
+def get_tarefa(tarefa_id: str):
+    """Busca uma tarefa pelo seu ID. Se o prazo de download já passou, apaga os arquivos expirados antes."""
+    tarefa = _ler_tarefa(tarefa_id)
+    if tarefa and expirada(tarefa):
+        limpar_expiradas()
+        tarefa = _ler_tarefa(tarefa_id)
+    return tarefa
+
+def expirada(tarefa) -> bool:
+    """Indica se o prazo de download de uma tarefa concluída já passou."""
+    return tarefa['status'] == 'concluida' and tarefa['expira_em'] is not None and tarefa['expira_em'] < _agora_sql()
+
+def limpar_expiradas():
+    """Apaga os arquivos das tarefas concluídas cujo prazo de download já passou."""
+    conn = conectar_bd()
+    if not conn: return
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, arquivo FROM tarefas WHERE status = 'concluida' AND expira_em < CURRENT_TIMESTAMP")
+        expiradas = cursor.fetchall()
+        for tarefa in expiradas:
+            if tarefa['arquivo'] and os.path.exists(tarefa['arquivo']):
+                os.remove(tarefa['arquivo'])
+        cursor.executemany("UPDATE tarefas SET status = 'expirada', arquivo = NULL WHERE id = ?", [(t['id'],) for t in expiradas])
+        conn.commit()
+    finally:
+        conn.close()
+
+def recuperar_interrompidas(tarefa_ids=None):
+    """
+    Marca como erro as tarefas que ficaram pendentes/em execução quando o servidor parou.
+    Com `tarefa_ids`, só essas (as de um worker que está encerrando, enquanto os outros seguem).
+    """
+    if tarefa_ids is not None and not tarefa_ids:
+        return
+    filtro = f"AND id IN ({', '.join('?' * len(tarefa_ids))})" if tarefa_ids else ""
+    conn = conectar_bd()
+    if not conn: return
+    try:
+        conn.execute(f"""
+            UPDATE tarefas SET status = 'erro', erro = 'Tarefa interrompida pela reinicialização do servidor.'
+            WHERE status IN ('pendente', 'executando') {filtro}
+        """, tuple(tarefa_ids or ()))
+        conn.commit()
+    finally:
+        conn.close()
+
+def encerrar(timeout: float = 30.0):
+    """
+    Encerramento do processo: descarta as tarefas que ainda não começaram e aguarda até `timeout`
+    segundos pelas que estão em execução. As descartadas e as que não terminarem a tempo são marcadas
+    como erro, para que a página da tarefa não fique aguardando para sempre quando só um worker é
+    reiniciado. Retorna False se o tempo esgotar.
+    """
+    for *_, executor in _tipos.values():
+        executor.shutdown(wait=False, cancel_futures=True)
+    # Antes de liberar as que aguardam vaga: ao desistir, elas saem de _em_andamento ainda pendentes.
+    with _em_andamento_lock:
+        agendadas = dict(_em_andamento)
+    _encerrando.set()
+    _, pendentes = wait(list(agendadas), timeout=timeout)
+    recuperar_interrompidas(list(agendadas.values()))
+    return not pendentes
+
+# --- Tipos de Tarefa (exportações) ---
+
+@registrar_tipo('pdf_movimentacoes', '.pdf', 'application/pdf', limite_simultaneas=1)
+def _exportar_pdf_movimentacoes(parametros, destino, progresso):
+    conn = conectar_bd()
+    total = ler_contador(conn.cursor(), 'movimentacoes') if conn else 0
+    if conn: conn.close()
+
+    def ao_avancar(linhas):
+        if total:
+            progresso(100 * linhas / total)
+
+    with open(destino, 'wb') as arquivo:
+        for pedaco in relatorios_pdf.gerar_pdf_movimentacoes(relatorios.relatorio_saldo_geral(), ao_avancar=ao_avancar):
+            arquivo.write(pedaco)
+    return "relatorio_estoque.pdf"
+
+@registrar_tipo('pdf_obra', '.pdf', 'application/pdf', limite_simultaneas=2)
+def _exportar_pdf_obra(parametros, destino, progresso):
+    obra = pedidos.get_obra(parametros['obra_id'])
+    if not obra:
+        raise ValueError("Obra não encontrada.")
+    with open(destino, 'wb') as arquivo:
+        for pedaco in relatorios_pdf.gerar_pdf_obra(obra):
+            arquivo.write(pedaco)
+    return f"relatorio_obra_{obra['nome'].replace(' ', '_')}.pdf"
+
+@registrar_tipo('excel_estoque', '.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', limite_simultaneas=1)
+def _exportar_excel_estoque(parametros, destino, progresso):
+    conn = conectar_bd()
+    total = conn.execute("SELECT COUNT(*) FROM itens_estoque").fetchone()[0] if conn else 0
+    if conn: conn.close()
+
+    def ao_avancar(linhas):
+        if total:
+            progresso(100 * linhas / total)
+
+    excel_handler.exportar_para_excel(destino, ao_avancar=ao_avancar)
+    return f"saldo_estoque_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"